@@ -1,139 +1,275 @@
+import concurrent.futures
+import os
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import scipy.sparse
-import joblib
-from sklearn.model_selection import train_test_split
 
-from recommender_systems import RecommenderSystem, evaluate_algorithms
+import data_registry
+from recommender_systems import RecommenderSystem, blend_components, evaluate_algorithms, stack_components
 
-# 加载处理后的数据
-full_data = pd.read_csv('data/processed/full_data.csv')
-tfidf_matrix = scipy.sparse.load_npz('data/processed/tfidf_matrix.npz')
-le_user = joblib.load('data/processed/le_user.pkl')
-le_movie = joblib.load('data/processed/le_movie.pkl')
-tfidf = joblib.load('data/processed/tfidf_vectorizer.pkl')
+# 处理后的数据由data_registry在首次使用时加载（兼容 algorithm_cmp.full_data 等旧写法）
+def __getattr__(name):
+    if name in data_registry.registry:
+        return data_registry.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # 准备评估数据
-def prepare_evaluation_data(ratings, test_size=0.2):
-    """将数据分为训练集和测试集用于评估"""
-    # 确保每个用户在测试集中至少有一个评分
-    unique_users = ratings['userId'].unique()
-    train_data = []
-    test_data = []
-
-    for user in unique_users:
-        user_ratings = ratings[ratings['userId'] == user]
-        if len(user_ratings) > 1:
-            # 为每个用户保留一些评分作为测试
-            user_train, user_test = train_test_split(user_ratings, test_size=test_size, random_state=42)
-            train_data.append(user_train)
-            test_data.append(user_test)
-        else:
-            # 如果用户只有一个评分，全部放入训练集
-            train_data.append(user_ratings)
-
-    return pd.concat(train_data), pd.concat(test_data)
+def prepare_evaluation_data(ratings, test_size=0.2, random_state=42):
+    """将数据分为训练集和测试集用于评估
 
+    一次分组完成划分：每条评分取一个随机数，按 (用户, 随机数) 排序后，每个用户排在前面的ceil(test_size×评分数)条作为测试集
+    """
+    # 确保每个用户在测试集中至少有一个评分，且训练集中至少保留一个
+    users = ratings['userId'].to_numpy()
+    rng = np.random.default_rng(random_state)
+    order = np.lexsort((rng.random(len(users)), users))
+    sorted_users = users[order]
+    starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]]) if len(users) else np.array([], dtype=np.int64)
+    counts = np.diff(np.r_[starts, len(users)])
+    # 如果用户只有一个评分，全部放入训练集
+    n_test = np.where(counts > 1, np.minimum(np.ceil(counts * test_size).astype(np.int64), counts - 1), 0)
 
-# 评估推荐质量
-def evaluate_recommendations(recommender, test_data, n_recommendations=10):
-    """评估推荐系统的准确率、召回率等指标"""
-    precision_scores = []
-    recall_scores = []
-    f1_scores = []
-
-    unique_users = test_data['userId'].unique()
-
-    for user_id in unique_users:
-        # 获取用户在测试集中喜欢的电影(评分>=4)
-        user_test = test_data[test_data['userId'] == user_id]
-        liked_movies = set(user_test[user_test['rating'] >= 4]['movieId'])
-
-        if len(liked_movies) == 0:
-            continue
-
-        # 获取推荐
-        recommendations = recommender.hybrid_recommender(user_id, n_recommendations)
-        recommended_movies = set([movie for movie, _ in recommendations])
-
-        # 计算准确率和召回率
-        intersection = liked_movies & recommended_movies
-        precision = len(intersection) / len(recommended_movies) if recommended_movies else 0
-        recall = len(intersection) / len(liked_movies) if liked_movies else 0
-
-        # 计算F1分数
-        if precision + recall > 0:
-            f1 = 2 * (precision * recall) / (precision + recall)
-        else:
-            f1 = 0
-
-        precision_scores.append(precision)
-        recall_scores.append(recall)
-        f1_scores.append(f1)
-
-    # 计算覆盖率
-    all_movies = set(recommender.ratings['movieId'].unique())
-    all_recommendations = set()
+    position = np.arange(len(users)) - np.repeat(starts, counts)
+    is_test = np.zeros(len(users), dtype=bool)
+    is_test[order] = position < np.repeat(n_test, counts)
+    return ratings[~is_test], ratings[is_test]
 
-    # 为多个用户生成推荐以计算覆盖率
-    sample_users = np.random.choice(unique_users, min(100, len(unique_users)), replace=False)
-    for user_id in sample_users:
-        recommendations = recommender.hybrid_recommender(user_id, n_recommendations)
-        all_recommendations.update([movie for movie, _ in recommendations])
 
-    coverage = len(all_recommendations) / len(all_movies) if all_movies else 0
+# 评估进程中使用的推荐器（由进程池的initializer设置）
+_eval_recommender = None
 
-    return {
-        'Precision': np.mean(precision_scores),
-        'Recall': np.mean(recall_scores),
-        'F1': np.mean(f1_scores),
-        'Coverage': coverage
-    }
 
+def _init_eval_worker(recommender, item_neighbors, content_neighbors, factor_model):
+    # 近邻索引不随推荐器pickle，单独传入，避免每个进程重新构建
+    global _eval_recommender
+    recommender.item_neighbors = item_neighbors
+    recommender.content_neighbors = content_neighbors
+    recommender.factor_model = factor_model
+    _eval_recommender = recommender
 
-# 模型参数调优
-def optimize_hybrid_weights(recommender, test_data):
-    """优化混合推荐系统的权重参数"""
-    # 尝试不同的权重组合
-    weight_combinations = [
-        [0.4, 0.4, 0.1, 0.1],  # 更侧重协同过滤
-        [0.1, 0.1, 0.4, 0.4],  # 更侧重内容和矩阵分解
-        [0.25, 0.25, 0.25, 0.25],  # 平均权重
-        [0.3, 0.2, 0.3, 0.2],  # 平衡协同过滤和矩阵分解
-        [0.2, 0.3, 0.2, 0.3]  # 平衡协同过滤和内容推荐
-    ]
 
-    best_score = -1
-    best_weights = None
+def _recommend_block(user_ids, n_recommendations, weights):
+    results = _eval_recommender.recommend_batch(user_ids, n_recommendations, weights=weights)
+    return {user_id: [movie for movie, _ in recs] for user_id, recs in results.items()}
+
+
+def _components_block(user_ids, n_recommendations):
+    return _eval_recommender.hybrid_components(user_ids, n_recommendations)
+
+
+def map_user_blocks(recommender, user_ids, task, args=(), n_jobs=None, block_size=256):
+    """把用户按block_size分块，在进程池中对每块执行 task(块内用户, *args)，按块的顺序返回结果列表
+
+    n_jobs默认为CPU核数，1表示在当前进程计算
+    """
+    # 先在主进程中准备好近邻索引和因子模型，各评估进程直接复用
+    if recommender.item_neighbors is None:
+        recommender.build_item_neighbors()
+    if recommender.content_neighbors is None:
+        recommender.build_content_neighbors()
+    if recommender.factor_model is None:
+        recommender.fit_factor_model()
+
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    blocks = [user_ids[start:start + block_size] for start in range(0, len(user_ids), block_size)]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(blocks))
+    init_args = (recommender, recommender.item_neighbors, recommender.content_neighbors, recommender.factor_model)
+
+    if n_jobs <= 1:
+        _init_eval_worker(*init_args)
+        return [task(block, *args) for block in blocks]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_eval_worker,
+                                                initargs=init_args) as executor:
+        futures = [executor.submit(task, block, *args) for block in blocks]
+        return [future.result() for future in futures]
 
-    for weights in weight_combinations:
-        # 临时修改权重
-        def temp_hybrid(user_id, n_recs=10):
-            return recommender.hybrid_recommender(user_id, n_recs, weights)
 
-        # 创建临时推荐器
-        class TempRecommender:
-            def __init__(self, rec_func):
-                self.rec_func = rec_func
-                self.ratings = recommender.ratings
+def recommend_users(recommender, user_ids, n_recommendations=10, weights=[0.3, 0.3, 0.2, 0.2], n_jobs=None,
+                    block_size=256):
+    """为一批用户生成混合推荐（分块在进程池中计算），返回 {user_id: [编码后movieId, ...]}"""
+    recommendations = {}
+    for result in map_user_blocks(recommender, user_ids, _recommend_block, (n_recommendations, weights),
+                                  n_jobs, block_size):
+        recommendations.update(result)
+    return recommendations
 
-            def hybrid_recommender(self, user_id, n_recs=10):
-                return self.rec_func(user_id, n_recs)
 
-        temp_rec = TempRecommender(temp_hybrid)
+def _liked_movies(recommender, test_data):
+    """测试集中每个用户喜欢的电影(评分>=4)，只保留出现在训练集中的用户
 
-        # 评估
-        metrics = evaluate_recommendations(temp_rec, test_data)
-        current_score = metrics['F1']
+    返回 (users, liked_keys, liked_counts)：有喜欢电影的用户（升序）、用户×电影数+电影 的组合键（升序）、每个用户喜欢的电影数
+    """
+    liked = test_data[test_data['rating'] >= 4]
+    liked_users = liked['userId'].to_numpy(dtype=np.int64)
+    liked_movies = liked['movieId'].to_numpy(dtype=np.int64)
+    # 测试用户必须出现在训练集中
+    known = liked_users < len(recommender.user_mask)
+    known[known] = recommender.user_mask[liked_users[known]]
 
-        # 记录最佳权重
-        if current_score > best_score:
-            best_score = current_score
-            best_weights = weights
+    n_movies = recommender.user_item_matrix.shape[1]
+    liked_keys = np.unique(liked_users[known] * n_movies + liked_movies[known])
+    users, liked_counts = np.unique(liked_keys // n_movies, return_counts=True)
+    return users, liked_keys, liked_counts
 
-    return best_weights, best_score
+
+# 评估推荐质量
+def evaluate_recommendations(recommender, test_data, n_recommendations=10, weights=[0.3, 0.3, 0.2, 0.2],
+                             n_jobs=None, coverage_users=100, random_state=42):
+    """评估推荐系统的准确率、召回率等指标
+
+    每个用户只推荐一次，同一份推荐结果用于计算准确率、召回率、F1和覆盖率（覆盖率取其中coverage_users个用户）
+    """
+    # 没有喜欢电影的用户不参与评估
+    unique_users, liked_keys, liked_counts = _liked_movies(recommender, test_data)
+    if len(unique_users) == 0:
+        return {'Precision': 0.0, 'Recall': 0.0, 'F1': 0.0, 'Coverage': 0.0}
+
+    # 获取推荐
+    recommendations = recommend_users(recommender, unique_users, n_recommendations, weights, n_jobs)
+    rec_counts = np.array([len(recommendations[user_id]) for user_id in unique_users])
+    rec_users = np.repeat(unique_users, rec_counts)
+    rec_movies = np.array([movie for user_id in unique_users for movie in recommendations[user_id]], dtype=np.int64)
+
+    # 用 (用户, 电影) 组合键一次求出每个用户推荐命中的电影数
+    n_movies = recommender.user_item_matrix.shape[1]
+    hit = np.isin(rec_users * n_movies + rec_movies, liked_keys)
+    hits = np.bincount(np.searchsorted(unique_users, rec_users[hit]), minlength=len(unique_users))
+
+    # 计算准确率、召回率和F1分数
+    precision, recall, f1 = _precision_recall_f1(hits, rec_counts, liked_counts)
+
+    # 计算覆盖率：复用部分用户的推荐结果
+    all_movies = recommender.item_mask.sum()
+    rng = np.random.default_rng(random_state)
+    sample_users = rng.choice(unique_users, min(coverage_users, len(unique_users)), replace=False)
+    all_recommendations = set()
+    for user_id in sample_users:
+        all_recommendations.update(recommendations[int(user_id)])
+
+    coverage = len(all_recommendations) / all_movies if all_movies else 0
+
+    return {
+        'Precision': precision.mean(),
+        'Recall': recall.mean(),
+        'F1': f1.mean(),
+        'Coverage': coverage
+    }
+
+
+def _precision_recall_f1(hits, rec_counts, liked_counts):
+    precision = np.divide(hits, rec_counts, out=np.zeros(len(hits)), where=rec_counts > 0)
+    recall = hits / liked_counts
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(hits)),
+                   where=precision + recall > 0)
+    return precision, recall, f1
+
+
+class HybridWeightTuner:
+    """混合推荐权重调优
+
+    只有最后的加权求和依赖权重：初始化时为每个测试用户计算一次四个组件的归一化分数（hybrid_components），
+    之后每组权重只需一次blend_components（与hybrid recommend_batch使用同一个混合函数，并列分数的排序也一致），
+    就能得到与线上相同的推荐并计算准确率、召回率和F1
+    """
+
+    def __init__(self, recommender, test_data, n_recommendations=10, n_jobs=None):
+        self.n_recommendations = n_recommendations
+        self.users, liked_keys, self.liked_counts = _liked_movies(recommender, test_data)
+        parts = map_user_blocks(recommender, self.users, _components_block, (n_recommendations,), n_jobs)
+        self.candidates, self.component_values = stack_components(parts)
+        # 用户在测试集中喜欢的电影（用户×电影数+电影 的组合键）
+        self.liked_keys = liked_keys
+        self.n_movies = recommender.user_item_matrix.shape[1]
+        self._scores = {}  # 权重 -> F1，避免重复计算
+
+    def recommend(self, weights):
+        """一组权重下每个用户的推荐电影（编码后的ID，不足时用-1填充），与hybrid recommend_batch的结果一致"""
+        movies, _ = blend_components(self.candidates, self.component_values, weights, self.n_recommendations)
+        return movies
+
+    def evaluate(self, weights):
+        """一组权重下的 {'Precision', 'Recall', 'F1'}"""
+        movies = self.recommend(weights)
+        found = movies >= 0
+        hits = (found & np.isin(self.users[:, np.newaxis] * self.n_movies + movies, self.liked_keys)).sum(axis=1)
+        precision, recall, f1 = _precision_recall_f1(hits, found.sum(axis=1), self.liked_counts)
+        return {'Precision': precision.mean(), 'Recall': recall.mean(), 'F1': f1.mean()}
+
+    def score(self, weights):
+        key = tuple(np.round(weights, 6))
+        if key not in self._scores:
+            self._scores[key] = self.evaluate(weights)['F1'] if len(self.users) else 0.0
+        return self._scores[key]
+
+    def search(self, weight_combinations):
+        """逐一评估给定的权重组合，返回 (最佳权重, 对应的F1分数)"""
+        best_score = -1
+        best_weights = None
+        for weights in weight_combinations:
+            current_score = self.score(weights)
+            # 记录最佳权重
+            if current_score > best_score:
+                best_score = current_score
+                best_weights = [float(w) for w in weights]
+        return best_weights, best_score
+
+    def grid_search(self, step=0.05):
+        """在和为1、间隔为step的所有权重组合上搜索（step=0.05时共1771组）"""
+        n_steps = int(round(1 / step))
+        grid = [
+            np.array([a, b, c, n_steps - a - b - c]) / n_steps
+            for a in range(n_steps + 1)
+            for b in range(n_steps + 1 - a)
+            for c in range(n_steps + 1 - a - b)
+        ]
+        return self.search(grid)
+
+    def random_search(self, n_iter=1000, random_state=42):
+        """在权重单纯形上均匀随机采样n_iter组权重（Dirichlet分布）"""
+        rng = np.random.default_rng(random_state)
+        return self.search(rng.dirichlet(np.ones(4), size=n_iter))
+
+    def coordinate_descent(self, initial_weights=[0.3, 0.3, 0.2, 0.2], step=0.1, min_step=0.0125):
+        """坐标下降：依次把每个权重加减step（再归一化），有提升就接受；一轮没有提升时step减半，小于min_step时停止"""
+        weights = np.asarray(initial_weights, dtype=np.float64)
+        weights = weights / weights.sum()
+        best_score = self.score(weights)
+        while step >= min_step:
+            improved = False
+            for i in range(len(weights)):
+                for delta in (step, -step):
+                    candidate = weights.copy()
+                    candidate[i] = max(candidate[i] + delta, 0)
+                    if candidate.sum() == 0:
+                        continue
+                    candidate /= candidate.sum()
+                    current_score = self.score(candidate)
+                    if current_score > best_score:
+                        best_score, weights, improved = current_score, candidate, True
+            if not improved:
+                step /= 2
+        return [float(w) for w in weights], best_score
+
+
+# 模型参数调优
+def optimize_hybrid_weights(recommender, test_data, search='grid', n_jobs=None, **search_params):
+    """优化混合推荐系统的权重参数
+
+    search为 'grid'（网格搜索）/ 'random'（随机搜索）/ 'coordinate'（坐标下降），search_params传给对应的搜索方法。
+    各组件分数只计算一次，之后每组权重只需重新加权
+    """
+    tuner = HybridWeightTuner(recommender, test_data, n_jobs=n_jobs)
+    searches = {
+        'grid': tuner.grid_search,
+        'random': tuner.random_search,
+        'coordinate': tuner.coordinate_descent,
+    }
+    if search not in searches:
+        raise ValueError(f"未知的搜索方法：{search}")
+    return searches[search](**search_params)
 
 
 # 结果可视化
@@ -203,7 +339,7 @@ def run_analysis(ratings_data, movie_features):
     train_data, test_data = prepare_evaluation_data(ratings_data)
 
     # 创建推荐器实例
-    recommender = RecommenderSystem(train_data, movie_features, le_movie)  # 补充le_movie
+    recommender = RecommenderSystem(train_data, movie_features, data_registry.get('le_movie'))  # 补充le_movie
 
     # 评估不同算法
     print("评估各个推荐算法的性能...")
@@ -216,7 +352,7 @@ def run_analysis(ratings_data, movie_features):
 
     # 评估最终混合模型
     print("\n评估最终混合推荐系统...")
-    metrics = evaluate_recommendations(recommender, test_data)
+    metrics = evaluate_recommendations(recommender, test_data, weights=best_weights)
     print("混合推荐系统评估指标:")
     for metric, value in metrics.items():
         print(f"{metric}: {value:.4f}")
@@ -0,0 +1,227 @@
+import time
+
+import numpy as np
+import scipy.sparse
+
+from neighbor_index import top_k_indices
+
+# 索引中向量的存储类型：float16/int8 以精度换内存，int8按行缩放到 [-127, 127]
+STORAGE_DTYPES = ('float32', 'float16', 'int8')
+
+
+class IVFIndex:
+    """倒排文件(IVF)近似最近邻索引，按内积检索
+
+    用k-means把向量分成n_lists个簇（倒排表），查询时只在与查询内积最高的n_probe个簇中精确计算内积并取top-k，
+    每次查询的代价约为 n_lists + n_probe × 平均簇大小，n_lists取 √n 时随物品数亚线性增长。
+    n_probe越大召回率越高、越慢（n_probe = n_lists 即精确检索）。
+    向量可以是稠密数组（如电影因子）或稀疏矩阵（如按行归一化的TF-IDF，此时内积即余弦相似度）
+    """
+
+    def __init__(self, n_lists=None, n_probe=16, dtype='float32', n_iter=10, train_size=50000, random_state=42):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"不支持的存储类型：{dtype}，可选 {STORAGE_DTYPES}")
+        self.n_lists = n_lists  # 簇数，默认 √物品数
+        self.n_probe = n_probe  # 每次查询检索的簇数
+        self.dtype = dtype
+        self.n_iter = n_iter  # k-means迭代次数
+        self.train_size = train_size  # 训练k-means的最大样本数
+        self.random_state = random_state
+        self.centroids = None  # 簇数×维数
+        self.list_items = None  # 按簇排列的物品下标
+        self.list_offsets = None  # 第l个簇的物品为 list_items[list_offsets[l]:list_offsets[l + 1]]
+        self.vectors = None  # 按存储类型保存的向量（稠密数组或CSR）
+        self.scales = None  # int8存储时每行的缩放系数
+
+    def get_params(self):
+        return {
+            'n_lists': self.n_lists,
+            'n_probe': self.n_probe,
+            'dtype': self.dtype,
+            'n_iter': self.n_iter,
+            'train_size': self.train_size,
+            'random_state': self.random_state,
+        }
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def fit(self, vectors):
+        rng = np.random.default_rng(self.random_state)
+        sparse = scipy.sparse.issparse(vectors)
+        vectors = scipy.sparse.csr_matrix(vectors, dtype=np.float32) if sparse else np.asarray(vectors, np.float32)
+        n_items = vectors.shape[0]
+        # k-means（在采样上训练）：按欧氏距离分配，argmin |x-c|² = argmax (x·c - |c|²/2)
+        sample = vectors[np.sort(rng.choice(n_items, min(n_items, self.train_size), replace=False))]
+        n_lists = min(self.n_lists or max(int(round(np.sqrt(n_items))), 1), sample.shape[0])
+        centroids = _dense(sample[rng.choice(sample.shape[0], n_lists, replace=False)])
+        for _ in range(self.n_iter):
+            assignment = _assign(sample, centroids)
+            counts = np.bincount(assignment, minlength=n_lists)
+            membership = scipy.sparse.csr_matrix(
+                (np.ones(len(assignment), dtype=np.float32), (assignment, np.arange(len(assignment)))),
+                shape=(n_lists, sample.shape[0])
+            )
+            sums = _dense(membership @ sample)
+            nonempty = counts > 0  # 空簇保留原来的中心
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, np.newaxis]
+        self.centroids = centroids
+
+        # 所有物品分配到最近的簇，按簇排成倒排表
+        assignment = np.concatenate([
+            _assign(vectors[start:start + self.train_size], centroids)
+            for start in range(0, n_items, self.train_size)
+        ])
+        self.list_items = np.argsort(assignment, kind='stable').astype(np.int64)
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+        self.vectors, self.scales = _quantize(vectors, self.dtype)
+        return self
+
+    def search(self, queries, k=10, n_probe=None):
+        """每个查询返回内积最高的k个物品：(下标, 内积)，均为 查询数×k，不足k个时用-1 / -inf填充"""
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        queries = _as_query_matrix(queries)
+        probes = top_k_indices(_dense(queries @ self.centroids.T), n_probe)
+
+        indices = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        scores = np.full((queries.shape[0], k), -np.inf)
+        for row, lists in enumerate(probes):
+            candidates = np.concatenate([
+                self.list_items[self.list_offsets[l]:self.list_offsets[l + 1]] for l in lists
+            ])
+            candidate_scores = self.score(queries[row], candidates)
+            top = top_k_indices(candidate_scores[np.newaxis, :], k)[0]
+            indices[row, :len(top)] = candidates[top]
+            scores[row, :len(top)] = candidate_scores[top]
+        return indices, scores
+
+    def score(self, query, items):
+        """一个查询与指定物品的内积（使用存储的向量，int8时乘回缩放系数）"""
+        query = _dense(query).ravel()
+        stored = self.vectors[items]
+        if scipy.sparse.issparse(stored):
+            result = stored.astype(np.float32) @ query
+        else:
+            result = stored.astype(np.float32) @ query.astype(np.float32)
+        if self.scales is not None:
+            result = result * self.scales[items]
+        return np.asarray(result, dtype=np.float64).ravel()
+
+    def recall(self, vectors, queries, k=10, n_probe=None, exclude_self=False):
+        """与精确检索（原始向量上的完整内积）比较的召回率 |近似∩精确| / k，同时返回两者的平均查询用时
+
+        exclude_self: 查询就是索引中的物品（queries为物品下标）时，两边都去掉物品自身
+        """
+        if exclude_self:
+            items = np.asarray(queries)
+            queries = vectors[items]
+            k_search = k + 1
+        else:
+            k_search = k
+        queries = _as_query_matrix(queries)
+
+        start = time.perf_counter()
+        approximate, _ = self.search(queries, k_search, n_probe)
+        approximate_seconds = (time.perf_counter() - start) / queries.shape[0]
+        start = time.perf_counter()
+        exact, _ = exact_search(vectors, queries, k_search)
+        exact_seconds = (time.perf_counter() - start) / queries.shape[0]
+
+        hits = 0
+        for row in range(queries.shape[0]):
+            found, truth = approximate[row], exact[row]
+            if exclude_self:
+                found, truth = found[found != items[row]][:k], truth[truth != items[row]][:k]
+            hits += len(np.intersect1d(found[found >= 0], truth))
+        return {
+            'recall': hits / (queries.shape[0] * k),
+            'approximate_ms': approximate_seconds * 1000,
+            'exact_ms': exact_seconds * 1000,
+            'n_probe': n_probe or self.n_probe,
+            'n_lists': len(self.centroids),
+        }
+
+    def to_arrays(self, prefix):
+        """保存到模型文件包的数组（{名字: 数组}），参数由get_params保存"""
+        arrays = {
+            f'{prefix}.centroids': self.centroids,
+            f'{prefix}.list_items': self.list_items,
+            f'{prefix}.list_offsets': self.list_offsets,
+        }
+        if scipy.sparse.issparse(self.vectors):
+            arrays[f'{prefix}.vectors.data'] = self.vectors.data
+            arrays[f'{prefix}.vectors.indices'] = self.vectors.indices
+            arrays[f'{prefix}.vectors.indptr'] = self.vectors.indptr
+            arrays[f'{prefix}.vectors.shape'] = np.array(self.vectors.shape, dtype=np.int64)
+        else:
+            arrays[f'{prefix}.vectors'] = self.vectors
+        if self.scales is not None:
+            arrays[f'{prefix}.scales'] = self.scales
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix, params):
+        index = cls(**params)
+        index.centroids = arrays[f'{prefix}.centroids']
+        index.list_items = arrays[f'{prefix}.list_items']
+        index.list_offsets = arrays[f'{prefix}.list_offsets']
+        if f'{prefix}.vectors.data' in arrays:
+            index.vectors = scipy.sparse.csr_matrix(
+                (arrays[f'{prefix}.vectors.data'], arrays[f'{prefix}.vectors.indices'],
+                 arrays[f'{prefix}.vectors.indptr']),
+                shape=tuple(arrays[f'{prefix}.vectors.shape'])
+            )
+        else:
+            index.vectors = arrays[f'{prefix}.vectors']
+        index.scales = arrays.get(f'{prefix}.scales')
+        return index
+
+
+def exact_search(vectors, queries, k=10, block_size=256):
+    """精确检索：分块计算查询与全部向量的内积后取top-k，返回 (下标, 内积)"""
+    queries = _as_query_matrix(queries)
+    vectors_t = vectors.T.tocsr() if scipy.sparse.issparse(vectors) else np.asarray(vectors).T
+    indices, scores = [], []
+    for start in range(0, queries.shape[0], block_size):
+        block_scores = _dense(queries[start:start + block_size] @ vectors_t).astype(np.float64)
+        top = top_k_indices(block_scores, k)
+        indices.append(top)
+        scores.append(np.take_along_axis(block_scores, top, axis=1))
+    return np.vstack(indices), np.vstack(scores)
+
+
+def _assign(vectors, centroids):
+    scores = _dense(vectors @ centroids.T) - 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    return np.argmax(scores, axis=1)
+
+
+def _quantize(vectors, dtype):
+    """按存储类型转换向量，int8时返回每行的缩放系数"""
+    if dtype != 'int8':
+        if scipy.sparse.issparse(vectors):
+            return scipy.sparse.csr_matrix(vectors, dtype=dtype), None
+        return vectors.astype(dtype), None
+
+    if scipy.sparse.issparse(vectors):
+        max_abs = np.asarray(abs(vectors).max(axis=1).todense()).ravel()
+    else:
+        max_abs = np.abs(vectors).max(axis=1)
+    scales = np.where(max_abs > 0, max_abs / 127, 1).astype(np.float32)
+    if scipy.sparse.issparse(vectors):
+        rows = np.repeat(np.arange(vectors.shape[0]), np.diff(vectors.indptr))
+        data = np.round(vectors.data / scales[rows]).astype(np.int8)
+        return scipy.sparse.csr_matrix((data, vectors.indices, vectors.indptr), shape=vectors.shape), scales
+    return np.round(vectors / scales[:, np.newaxis]).astype(np.int8), scales
+
+
+def _as_query_matrix(queries):
+    if scipy.sparse.issparse(queries):
+        return scipy.sparse.csr_matrix(queries, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    return queries[np.newaxis, :] if queries.ndim == 1 else queries
+
+
+def _dense(matrix):
+    if scipy.sparse.issparse(matrix):
+        return matrix.toarray()
+    return np.asarray(matrix)
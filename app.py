@@ -1,21 +1,35 @@
-from flask import Flask, render_template, redirect, url_for, request, flash, jsonify
+import time
+
+from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, g, Response
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-import pandas as pd
-import joblib
 import os
-import scipy.sparse
+import numpy as np
+import pandas as pd
 from flask_cors import CORS
 
-from make_recommend import recommend_for_new_user,load_or_init_recommender
-from models.user import db, User, Rating
+import data_registry
+import instrumentation
+from make_recommend import RECOMMENDER_BUNDLE_PATH, rebuild_recommender, recommend_for_new_user
+from model_refresher import ModelRefresher
+from models.user import db, User, Rating, ensure_rating_index, upsert_ratings
 from recommender_systems import RecommenderSystem  # 复用推荐系统
+from rec_cache import RecommendationCache
+from popularity import PopularityIndex
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = '12345678'
 base_dir = os.path.abspath(os.path.dirname(__file__))# 获取当前文件所在目录的绝对路径
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(base_dir, "data", "user_ratings.db")}'# 拼接数据库文件的绝对路径
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['RECOMMENDATION_CACHE_SIZE'] = 1024  # 最多缓存多少个用户的推荐结果
+app.config['RECOMMENDATION_CACHE_TTL'] = 600  # 推荐结果缓存有效期（秒）
+app.config['METRICS_ENABLED'] = True  # 是否记录各阶段用时（/metrics）
+app.config['SLOW_REQUEST_SECONDS'] = None  # 超过该用时的请求打印各阶段用时，None表示不记录
+app.config['MAX_BULK_RATINGS'] = 5000  # 批量评分接口单次最多提交的评分数
+app.config['MODEL_REFRESH_INTERVAL'] = 3600  # 后台用 full_data + 数据库评分重建推荐器的间隔（秒）
+app.config['MODEL_REFRESH_SAVE_BUNDLE'] = False  # 重建后是否覆盖保存模型文件包（多个worker进程时只应由一个进程保存）
+app.config['NEIGHBOR_REFRESH_INTERVAL'] = 10  # 后台刷新评分变化电影的物品近邻的间隔（秒）
 CORS(
     app,
     resources={r"/*": {  # 对所有路由生效
@@ -29,12 +43,140 @@ db.init_app(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
-# 加载原有数据和推荐器
-movies_df = pd.read_csv('data/movies.csv')  # 电影元数据
-le_movie = joblib.load('data/processed/le_movie.pkl')  # 电影ID编码器
-tfidf_matrix = scipy.sparse.load_npz('data/processed/tfidf_matrix.npz')
-full_data = pd.read_csv('data/processed/full_data.csv')  # 原有评分数据
-recommender = load_or_init_recommender()  # 初始化推荐器
+# 导入时初始化数据库（flask run、gunicorn等方式启动时同样执行）：建表，并为旧数据库去重后补建评分的唯一索引（upsert依赖该索引）
+os.makedirs(os.path.join(base_dir, 'data'), exist_ok=True)
+with app.app_context():
+    db.create_all()
+    ensure_rating_index()
+
+# 电影元数据、编码器、评分数据和推荐器都由data_registry在第一次用到时加载（推荐器在make_recommend中注册）
+# 电影热度榜（按评分次数排序），第一次访问时计算，之后随新评分增量更新，推荐器替换时重新计算
+data_registry.registry.register('popularity_index', lambda: load_popularity_index())
+# 按用户缓存推荐结果，用户提交评分后失效
+recommendation_cache = RecommendationCache(
+    max_size=app.config['RECOMMENDATION_CACHE_SIZE'],
+    ttl=app.config['RECOMMENDATION_CACHE_TTL']
+)
+
+instrumentation.enabled = app.config['METRICS_ENABLED']
+
+
+def load_online_ratings(n_base_users):
+    """数据库中的全部评分，转换为推荐器使用的编码ID：userId = n_base_users + 数据库用户ID，忽略不在训练集中的电影"""
+    with app.app_context():
+        rows = db.session.query(Rating.user_id, Rating.movie_id, Rating.rating).all()
+    ratings = pd.DataFrame(rows, columns=['userId', 'movieId', 'rating'])
+    positions, known = encode_movie_ids(ratings['movieId'].to_numpy())
+    return pd.DataFrame({
+        'userId': n_base_users + ratings['userId'].to_numpy(dtype=np.int64)[known],
+        'movieId': positions[known],
+        'rating': ratings['rating'].to_numpy(dtype=np.float64)[known],
+    })
+
+
+def load_popularity_index():
+    """热度榜与推荐器重建使用同一份评分：离线的full_data加上数据库中的全部评分"""
+    movie_ids = np.concatenate([
+        data_registry.get('full_data')['movieId'].to_numpy(dtype=np.int64),
+        load_online_ratings(0)['movieId'].to_numpy(dtype=np.int64),
+    ])
+    return PopularityIndex.from_ratings(movie_ids, data_registry.get('movies'), data_registry.get('le_movie'))
+
+
+def on_model_swap(version):
+    # 缓存的推荐结果来自旧模型，一并清空；热度榜按新推荐器所用的评分重新计算（尚未加载时等第一次访问再计算）
+    recommendation_cache.clear()
+    if data_registry.registry.is_loaded('popularity_index'):
+        data_registry.registry.set('popularity_index', load_popularity_index())
+
+
+def rebuild_from_database(current):
+    return rebuild_recommender(
+        current,
+        online_ratings=load_online_ratings(current.n_base_users),
+        bundle_path=RECOMMENDER_BUNDLE_PATH if app.config['MODEL_REFRESH_SAVE_BUNDLE'] else None
+    )
+
+
+# 后台定期重建推荐器并整体替换：请求各自持有取到的推荐器，不加锁；替换后缓存的推荐结果来自旧模型，一并清空
+model_refresher = ModelRefresher(
+    rebuild_from_database,
+    name='recommender',
+    interval=app.config['MODEL_REFRESH_INTERVAL'],
+    on_swap=on_model_swap,
+    maintain=lambda recommender: recommender.refresh_pending_item_neighbors(),
+    maintain_interval=app.config['NEIGHBOR_REFRESH_INTERVAL']
+)
+
+
+@app.before_request
+def start_model_refresher():
+    # 在实际处理请求的进程中启动后台线程（flask run、gunicorn的每个worker、debug模式下reloader的子进程），已启动时直接返回
+    model_refresher.start()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    instrumentation.start_trace()
+
+
+@app.after_request
+def record_request_time(response):
+    trace = instrumentation.end_trace()
+    start = g.pop('request_start', None)
+    if start is None or not instrumentation.enabled:
+        return response
+    elapsed = time.perf_counter() - start
+    instrumentation.request_seconds.observe(request.endpoint or 'unknown', elapsed)
+
+    # 慢请求日志：打印各阶段用时
+    threshold = app.config['SLOW_REQUEST_SECONDS']
+    if threshold is not None and elapsed > threshold:
+        stages = ', '.join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in trace or [])
+        print(f"慢请求 {request.method} {request.path} 用时 {elapsed * 1000:.1f}ms：{stages}")
+    return response
+
+
+def recommender_user_id(db_user_id):
+    """数据库用户在推荐器中的编号：排在离线数据集的用户之后，避免与数据集用户冲突"""
+    return data_registry.get('recommender').n_base_users + db_user_id
+
+
+def encode_movie_ids(movie_ids):
+    """原始movieId数组转换为编码后的ID，返回 (编码ID, 是否在训练集中)；classes_有序，用二分查找代替逐个transform"""
+    classes = data_registry.get('le_movie').classes_
+    movie_ids = np.asarray(movie_ids, dtype=np.int64)
+    positions = np.searchsorted(classes, movie_ids)
+    known = positions < len(classes)
+    known[known] = classes[positions[known]] == movie_ids[known]
+    return positions, known
+
+
+def encode_ratings(rating_dict):
+    """{原始movieId: 评分} 转换为推荐器使用的 {编码后movieId: 评分}，忽略不在训练集中的电影"""
+    positions, known = encode_movie_ids(list(rating_dict.keys()))
+    ratings = np.fromiter(rating_dict.values(), dtype=np.float64, count=len(rating_dict))
+    return dict(zip(positions[known].tolist(), ratings[known].tolist()))
+
+
+def is_valid_rating(rating):
+    return 0.5 <= rating <= 5.0
+
+
+def apply_ratings(db_user_id, rating_dict, new_movies):
+    """评分写入数据库后同步到内存：增量写入推荐器、新增评分计入热度榜，并使该用户缓存的推荐结果失效"""
+    with instrumentation.timer('encode'):
+        encoded_ratings = encode_ratings(rating_dict)
+    recommender = data_registry.get('recommender')
+    with instrumentation.timer('update_ratings'):
+        recommender.update_user_ratings(recommender_user_id(db_user_id), encoded_ratings)
+    if new_movies:
+        popularity_index = data_registry.get('popularity_index')
+        for encoded_movie in encode_ratings({movie_id: rating_dict[movie_id] for movie_id in new_movies}):
+            popularity_index.increment(encoded_movie)
+    recommendation_cache.invalidate(db_user_id)  # 评分变化，缓存的推荐结果失效
+
 
 # 用户加载回调
 @login_manager.user_loader
@@ -96,17 +238,18 @@ def login():
 @login_required
 def movie_list():
     if request.method == 'POST':
-        # 处理用户评分提交（保持原逻辑不变）
-        movie_id = int(request.form['movie_id'])
-        rating = float(request.form['rating'])
-
-        existing_rating = Rating.query.filter_by(user_id=current_user.id, movie_id=movie_id).first()
-        if existing_rating:
-            existing_rating.rating = rating
-        else:
-            new_rating = Rating(user_id=current_user.id, movie_id=movie_id, rating=rating)
-            db.session.add(new_rating)
-        db.session.commit()
+        # 处理用户评分提交
+        try:
+            movie_id = int(request.form['movie_id'])
+            rating = float(request.form['rating'])
+        except (KeyError, ValueError):
+            return jsonify({"status": "error", "message": "请提供 movie_id 和 rating"}), 400
+        if not is_valid_rating(rating):
+            return jsonify({"status": "error", "message": "评分需在0.5到5之间"}), 400
+
+        with instrumentation.timer('db_write'):
+            new_movies = upsert_ratings(current_user.id, {movie_id: rating})
+        apply_ratings(current_user.id, {movie_id: rating}, new_movies)
         return jsonify({"status": "success", "message": "评分成功！"})  # 提交评分后返回JSON
 
     # 处理GET请求：分页返回热门电影JSON数据
@@ -114,53 +257,36 @@ def movie_list():
     page = request.args.get('page', 1, type=int)
     per_page = 8  # 每页8条数据
 
-    # 1. 从全量评分数据中计算每部电影的评分次数
-    movie_ratings_count = full_data['movieId'].value_counts().reset_index()
-    movie_ratings_count.columns = ['movieId', 'rating_count']
-
-    # 2. 转换为原始电影ID（因为full_data中是编码后的ID）
-    movie_ratings_count['original_movieId'] = le_movie.inverse_transform(movie_ratings_count['movieId'])
-
-    # 3. 合并电影元数据并按评分次数排序
-    popular_movies = pd.merge(
-        movies_df,
-        movie_ratings_count,
-        left_on='movieId',
-        right_on='original_movieId',
-        how='inner'
-    ).sort_values(by='rating_count', ascending=False)
-
-    # 4. 计算总页数和当前页数据
-    total = len(popular_movies)
+    popularity_index = data_registry.get('popularity_index')
+    # 1. 计算总页数和当前页范围（page从1开始）
+    total = len(popularity_index)
     total_pages = (total + per_page - 1) // per_page  # 向上取整计算总页数
-    # 分页切片（注意：pandas索引从0开始，page从1开始）
     start = (page - 1) * per_page
     end = start + per_page
-    #current_page_data = popular_movies.iloc[start:end].to_dict('records')
-
-    # 在movie_list函数的GET请求处理部分，修改current_page_data的生成逻辑
-    # 原代码：
-    # current_page_data = popular_movies.iloc[start:end].to_dict('records')
-
-    # 新代码：
-    # 1. 获取当前用户对当前页电影的评分记录
-    current_page_movie_ids = popular_movies.iloc[start:end]['original_movieId'].tolist()
-    # 6. 查询用户对这些电影的评分（使用in_而非movie_id_in）
-    user_ratings = Rating.query.filter(
-        Rating.user_id == current_user.id,
-        Rating.movie_id.in_(current_page_movie_ids)  # 正确使用in_方法
-    ).all()
-
-    # 2. 转换为字典便于查询 {movie_id: rating}
+
+    # 2. 从预先排好序的热度榜中直接切出当前页，再按行号取电影元数据
+    with instrumentation.timer('popularity_page'):
+        page_movies, page_counts = popularity_index.page(max(start, 0), end)
+        page_meta = data_registry.get('movies').iloc[popularity_index.meta_rows[page_movies]]
+    current_page_movie_ids = page_meta['movieId'].tolist()  # 原始电影ID
+
+    # 3. 查询用户对这些电影的评分（使用in_而非movie_id_in）
+    with instrumentation.timer('db_query'):
+        user_ratings = Rating.query.filter(
+            Rating.user_id == current_user.id,
+            Rating.movie_id.in_(current_page_movie_ids)  # 正确使用in_方法
+        ).all()
+
+    # 转换为字典便于查询 {movie_id: rating}
     rating_dict = {r.movie_id: r.rating for r in user_ratings}
 
-    # 3. 为每条电影数据添加用户评分
-    current_page_data = []
-    for _, row in popular_movies.iloc[start:end].iterrows():
-        movie_data = row.to_dict()
-        # 添加用户评分（如果没有则为None或0）
-        movie_data['user_rating'] = rating_dict.get(row['movieId'], None)
-        current_page_data.append(movie_data)
+    # 4. 为每条电影数据添加评分次数和用户评分
+    current_page_data = page_meta.to_dict('records')
+    for movie_data, rating_count in zip(current_page_data, page_counts):
+        movie_data['rating_count'] = int(rating_count)
+        movie_data['original_movieId'] = movie_data['movieId']
+        # 添加用户评分（如果没有则为None）
+        movie_data['user_rating'] = rating_dict.get(movie_data['movieId'], None)
 
     # 5. 转换为JSON格式返回（包含分页信息和当前页数据）
     return jsonify({
@@ -175,11 +301,52 @@ def movie_list():
     })
 
 
+# 批量评分：一次提交多条评分，在一个事务中写入
+@app.route('/ratings/bulk', methods=['POST'])
+@login_required
+def bulk_ratings():
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('ratings')
+    if not isinstance(items, list) or not items:
+        return jsonify({"status": "error", "message": "请提供评分列表 ratings"}), 400
+    if len(items) > app.config['MAX_BULK_RATINGS']:
+        return jsonify({"status": "error", "message": f"单次最多提交 {app.config['MAX_BULK_RATINGS']} 条评分"}), 400
+    try:
+        # 同一部电影出现多次时以最后一条为准
+        rating_dict = {int(item['movie_id']): float(item['rating']) for item in items}
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"status": "error", "message": "每条评分需要包含 movie_id 和 rating"}), 400
+    if not all(is_valid_rating(rating) for rating in rating_dict.values()):
+        return jsonify({"status": "error", "message": "评分需在0.5到5之间"}), 400
+
+    with instrumentation.timer('db_write'):
+        new_movies = upsert_ratings(current_user.id, rating_dict)
+    apply_ratings(current_user.id, rating_dict, new_movies)
+    return jsonify({
+        "status": "success",
+        "message": f"已保存 {len(rating_dict)} 条评分",
+        "data": {"saved": len(rating_dict), "new": len(new_movies)}
+    })
+
+
 @app.route('/recommendations')
 @login_required
 def recommendations():
+    # 用户评分没有变化时直接返回缓存的推荐结果
+    with instrumentation.timer('cache_lookup'):
+        # 先取版本号：计算期间该用户提交了评分（apply_ratings使缓存失效）时，算出的旧结果不写回缓存
+        cache_generation = recommendation_cache.generation(current_user.id)
+        cached = recommendation_cache.get(current_user.id)
+    if cached is not None:
+        return jsonify({
+            "status": "success",
+            "data": cached
+        })
+
+    recommender = data_registry.get('recommender')
     # 获取当前用户的评分记录
-    user_ratings = Rating.query.filter_by(user_id=current_user.id).all()
+    with instrumentation.timer('db_query'):
+        user_ratings = Rating.query.filter_by(user_id=current_user.id).all()
     if not user_ratings:
         # 新用户（无评分）：返回热门电影
         recs = recommend_for_new_user(recommender)
@@ -189,29 +356,69 @@ def recommendations():
             r.movie_id: r.rating for r in user_ratings
         }
         # 调用推荐器（需将原始movieId转换为编码ID）
-        encoded_ratings = {
-            le_movie.transform([mid])[0]: rating
-            for mid, rating in user_rating_dict.items()
-            if mid in le_movie.classes_
-        }
-        # 生成混合推荐
-        recs = recommender.hybrid_recommender(
-            user_id=current_user.id,
-            n_recommendations=10
-        )
+        with instrumentation.timer('encode'):
+            encoded_ratings = encode_ratings(user_rating_dict)
+        # 同步到推荐器（如服务重启后内存中的推荐器还没有这些评分），评分未变化时不做任何更新
+        user_id = recommender_user_id(current_user.id)
+        with instrumentation.timer('update_ratings'):
+            recommender.update_user_ratings(user_id, encoded_ratings)
+        if encoded_ratings:
+            # 生成混合推荐
+            recs = recommender.hybrid_recommender(
+                user_id=user_id,
+                n_recommendations=10
+            )
+        else:
+            # 评分的电影都不在训练集中，按新用户处理
+            recs = recommend_for_new_user(recommender)
 
     # 转换推荐结果为电影信息
-    rec_movie_ids = [mid for mid, _ in recs]
-    original_ids = le_movie.inverse_transform(rec_movie_ids)
-    recommended_movies = movies_df[movies_df['movieId'].isin(original_ids)]
+    with instrumentation.timer('metadata_join'):
+        rec_movie_ids = [mid for mid, _ in recs]
+        original_ids = data_registry.get('le_movie').inverse_transform(rec_movie_ids)
+        movies_df = data_registry.get('movies')
+        recommended_movies = movies_df[movies_df['movieId'].isin(original_ids)]
+        data = recommended_movies[['movieId', 'title', 'genres']].to_dict('records')
+    recommendation_cache.set(current_user.id, data, cache_generation)
 
     # 返回JSON格式数据
     return jsonify({
         "status": "success",
-        "data": recommended_movies[['movieId', 'title', 'genres']].to_dict('records')
+        "data": data
+    })
+
+
+# 推荐缓存命中统计
+@app.route('/recommendations/cache')
+@login_required
+def recommendation_cache_stats():
+    return jsonify({
+        "status": "success",
+        "data": recommendation_cache.stats()
     })
 
 
+# Prometheus指标：各阶段和请求的用时直方图、推荐缓存命中情况
+@app.route('/metrics')
+def metrics():
+    cache_stats = recommendation_cache.stats()
+    extra_lines = [
+        '# HELP frs_recommendation_cache_hits_total 推荐缓存命中次数',
+        '# TYPE frs_recommendation_cache_hits_total counter',
+        f"frs_recommendation_cache_hits_total {cache_stats['hits']}",
+        '# HELP frs_recommendation_cache_misses_total 推荐缓存未命中次数',
+        '# TYPE frs_recommendation_cache_misses_total counter',
+        f"frs_recommendation_cache_misses_total {cache_stats['misses']}",
+        '# HELP frs_recommendation_cache_size 推荐缓存中的用户数',
+        '# TYPE frs_recommendation_cache_size gauge',
+        f"frs_recommendation_cache_size {cache_stats['size']}",
+        '# HELP frs_model_version 当前推荐器的版本号（每次后台重建替换后加1）',
+        '# TYPE frs_model_version gauge',
+        f"frs_model_version {data_registry.registry.version('recommender')}",
+    ]
+    return Response(instrumentation.render_prometheus(extra_lines), mimetype='text/plain; version=0.0.4')
+
+
 # 登出
 @app.route('/logout')
 @login_required
@@ -223,9 +430,4 @@ def logout():
 
 
 if __name__ == '__main__':
-    # 确保data文件夹存在
-    if not os.path.exists('data'):
-        os.makedirs('data')
-    with app.app_context():
-        db.create_all()  # 初始化数据库表
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,247 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import scipy
+import sklearn
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import LabelEncoder, normalize
+
+import data_registry
+import make_recommend
+from recommender_systems import RecommenderSystem
+
+# 合成标签使用的词表
+TAG_WORDS = [
+    'action', 'adventure', 'animation', 'comedy', 'crime', 'drama', 'fantasy', 'horror', 'music', 'mystery',
+    'romance', 'scifi', 'thriller', 'war', 'western', 'funny', 'dark', 'classic', 'twist', 'visual',
+    'space', 'family', 'hero', 'murder', 'love', 'robot', 'magic', 'revenge', 'friendship', 'dystopia',
+]
+# 单用户推荐方法（recommend_for_new_user按新用户的初始评分计算）
+METHODS = ['user_based_cf', 'item_based_cf', 'matrix_factorization', 'content_based', 'hybrid_recommender',
+           'recommend_for_new_user']
+DEFAULT_SIZES = [1000, 10000, 100000]  # 用户数
+PERCENTILES = [50, 90, 99]
+ANN_PROBES = [4, 8, 16, 32]  # 测试ANN召回率时检索的簇数
+
+
+def generate_synthetic_data(n_users, n_movies=None, mean_ratings=60, n_tag_words=5, popularity_exponent=1.0,
+                            seed=42):
+    """生成与MovieLens形状相似的合成数据
+
+    电影热度服从幂律分布（第i热门电影的概率 ∝ 1/i^popularity_exponent），每个用户的评分数服从对数正态分布，
+    评分为0.5~5.0的半星。返回 (full_data, tfidf_matrix, le_movie)，full_data中的ID已编码
+    """
+    rng = np.random.default_rng(seed)
+    if n_movies is None:
+        n_movies = int(min(max(n_users // 10, 1000), 60000))
+
+    # 每个用户的评分数（至少5条），电影按热度抽样
+    counts = np.clip(rng.lognormal(np.log(mean_ratings), 0.8, n_users).astype(np.int64), 5, n_movies)
+    user_ids = np.repeat(np.arange(n_users, dtype=np.int32), counts)
+    popularity = 1.0 / np.arange(1, n_movies + 1) ** popularity_exponent
+    popularity = rng.permutation(popularity / popularity.sum())
+    movie_ids = rng.choice(n_movies, size=len(user_ids), p=popularity).astype(np.int32)
+    ratings = (rng.integers(1, 11, size=len(user_ids)) / 2).astype(np.float32)
+    full_data = pd.DataFrame({'userId': user_ids, 'movieId': movie_ids, 'rating': ratings})
+    full_data = full_data.drop_duplicates(subset=['userId', 'movieId'])
+
+    # 每部电影若干个标签词，热门电影的标签更多
+    n_words = rng.poisson(n_tag_words, n_movies) + (popularity > np.median(popularity))
+    tags = [' '.join(rng.choice(TAG_WORDS, n)) for n in n_words]
+    tfidf_matrix = TfidfVectorizer(stop_words='english').fit_transform(tags)
+
+    le_movie = LabelEncoder()
+    le_movie.fit(np.arange(1, n_movies + 1))  # 原始movieId从1开始
+    return full_data, tfidf_matrix, le_movie
+
+
+def measure(func, *args, **kwargs):
+    """执行func，返回 (结果, 用时秒数, Python内存分配峰值字节数)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def latency_summary(latencies):
+    """延迟统计（毫秒）"""
+    latencies = np.asarray(latencies) * 1000
+    summary = {f'p{p}': float(np.percentile(latencies, p)) for p in PERCENTILES}
+    summary.update({'mean': float(latencies.mean()), 'max': float(latencies.max()), 'n': len(latencies)})
+    return summary
+
+
+def benchmark_size(n_users, n_movies=None, n_queries=200, n_recommendations=10, methods=METHODS, seed=42,
+                   ann=False):
+    """对一种数据规模运行基准测试，返回该规模的结果字典
+
+    ann=True时构建电影因子和TF-IDF上的ANN索引（矩阵分解和混合推荐使用近似检索），
+    并在result['ann']中记录不同n_probe下相对精确检索的召回率和单次查询用时
+    """
+    print(f"\n=== 用户数 {n_users} ===")
+    result = {'n_users': n_users, 'build': {}, 'latency_ms': {}}
+    data, elapsed, peak = measure(generate_synthetic_data, n_users, n_movies, seed=seed)
+    full_data, tfidf_matrix, le_movie = data
+    result.update({'n_movies': len(le_movie.classes_), 'n_ratings': len(full_data)})
+    print(f"生成数据：{len(full_data)} 条评分，{len(le_movie.classes_)} 部电影，用时 {elapsed:.2f} 秒")
+
+    # 构建阶段：用时和内存峰值
+    def record(stage, func, *args):
+        value, elapsed, peak = measure(func, *args)
+        result['build'][stage] = {'seconds': elapsed, 'peak_mb': peak / 2 ** 20}
+        print(f"构建 {stage}：{elapsed:.3f} 秒，内存峰值 {peak / 2 ** 20:.1f} MB")
+        return value
+
+    recommender = record('recommender', RecommenderSystem, full_data, tfidf_matrix, le_movie)
+    record('factor_model', recommender.fit_factor_model)
+    record('item_neighbors', recommender.build_item_neighbors)
+    record('content_neighbors', recommender.build_content_neighbors)
+    if ann:
+        record('factor_index', recommender.build_factor_index)
+        record('content_index', recommender.build_content_index)
+
+    # 新用户推荐使用make_recommend的冷启动推荐器，数据换成本次的合成数据
+    for name, value in (('full_data', full_data), ('tfidf_matrix', tfidf_matrix), ('le_movie', le_movie)):
+        data_registry.registry.set(name, value)
+    make_recommend._cold_start_recommender = None
+    record('cold_start', make_recommend.get_cold_start_recommender, recommender)
+
+    # 查询阶段：随机抽取用户逐个请求，统计延迟分位数
+    rng = np.random.default_rng(seed)
+    users = rng.choice(np.flatnonzero(recommender.user_mask), n_queries)
+    if ann:
+        result['ann'] = benchmark_ann(recommender, users, rng.choice(tfidf_matrix.shape[0], n_queries), n_recommendations)
+    new_users = [
+        {int(movie): float(rating) for movie, rating in
+         zip(rng.choice(le_movie.classes_, 5, replace=False), rng.integers(6, 11, 5) / 2)}
+        for _ in range(n_queries)
+    ]
+    for method in methods:
+        if method == 'recommend_for_new_user':
+            queries = [
+                lambda ratings=ratings: make_recommend.recommend_for_new_user(recommender, ratings, n_recommendations)
+                for ratings in new_users
+            ]
+        else:
+            func = getattr(recommender, method)
+            queries = [lambda user_id=int(user_id): func(user_id, n_recommendations) for user_id in users]
+        queries[0]()  # 预热（首次调用可能构建缓存）
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            query()
+            latencies.append(time.perf_counter() - start)
+        result['latency_ms'][method] = latency_summary(latencies)
+        summary = result['latency_ms'][method]
+        print(f"{method}: p50 {summary['p50']:.2f} ms, p90 {summary['p90']:.2f} ms, p99 {summary['p99']:.2f} ms")
+
+    # 批量推荐的吞吐（每个用户的平均用时）
+    _, elapsed, peak = measure(recommender.recommend_batch, users, n_recommendations)
+    result['batch'] = {'users': len(users), 'ms_per_user': elapsed * 1000 / len(users), 'peak_mb': peak / 2 ** 20}
+    print(f"recommend_batch: 每用户 {result['batch']['ms_per_user']:.2f} ms")
+    if recommender._executor is not None:
+        recommender._executor.shutdown()
+    return result
+
+
+def benchmark_ann(recommender, users, movies, k=10, probes=ANN_PROBES):
+    """ANN索引相对精确检索的召回率：因子索引以用户因子为查询，内容索引以电影自身为查询（去掉自身）"""
+    factor_model = recommender.factor_model
+    content_vectors = normalize(recommender.movie_features)
+    result = {'factors': [], 'content': []}
+    for n_probe in probes:
+        result['factors'].append(factor_model.item_index.recall(
+            factor_model.components.T, factor_model.user_factors[users], k, n_probe
+        ))
+        result['content'].append(recommender.content_index.recall(
+            content_vectors, movies, k, n_probe, exclude_self=True
+        ))
+        for name in ('factors', 'content'):
+            stats = result[name][-1]
+            print(f"ANN {name} n_probe={n_probe}: 召回率 {stats['recall']:.3f}，"
+                  f"{stats['approximate_ms']:.2f} ms（精确检索 {stats['exact_ms']:.2f} ms）")
+    return result
+
+
+def environment_info():
+    """记录运行环境和当前提交，便于比较不同提交的结果"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'sklearn': sklearn.__version__,
+        'machine': platform.platform(),
+    }
+
+
+def compare_results(baseline, current, threshold=1.2):
+    """与之前的结果比较p50延迟和构建用时，变慢超过threshold倍的项目返回为回归列表"""
+    regressions = []
+    baseline_sizes = {result['n_users']: result for result in baseline['results']}
+    for result in current['results']:
+        old = baseline_sizes.get(result['n_users'])
+        if old is None:
+            continue
+        pairs = [(f"{method} p50", old['latency_ms'][method]['p50'], summary['p50'])
+                 for method, summary in result['latency_ms'].items() if method in old['latency_ms']]
+        pairs += [(f"构建 {stage}", old['build'][stage]['seconds'], stats['seconds'])
+                  for stage, stats in result['build'].items() if stage in old['build']]
+        for name, old_value, new_value in pairs:
+            ratio = new_value / old_value if old_value > 0 else 1.0
+            flag = '  <-- 变慢' if ratio > threshold else ''
+            print(f"[{result['n_users']}] {name}: {old_value:.3f} -> {new_value:.3f} ({ratio:.2f}x){flag}")
+            if ratio > threshold:
+                regressions.append({'n_users': result['n_users'], 'item': name, 'ratio': ratio})
+    return regressions
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, n_movies=None, n_queries=200, methods=METHODS, seed=42, output=None,
+                   ann=False):
+    results = {
+        'environment': environment_info(),
+        'config': {'sizes': list(sizes), 'n_movies': n_movies, 'n_queries': n_queries, 'seed': seed, 'ann': ann},
+        'results': [benchmark_size(n_users, n_movies, n_queries, methods=methods, seed=seed, ann=ann)
+                    for n_users in sizes],
+    }
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存至 {output}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='在合成数据上测试推荐系统各方法的延迟、构建用时和内存')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='用户数，可指定多个规模')
+    parser.add_argument('--movies', type=int, default=None, help='电影数（默认随用户数变化）')
+    parser.add_argument('--queries', type=int, default=200, help='每个方法的请求次数')
+    parser.add_argument('--methods', nargs='+', default=METHODS, choices=METHODS, help='要测试的方法')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark_results.json', help='结果JSON文件')
+    parser.add_argument('--ann', action='store_true', help='使用ANN索引并报告相对精确检索的召回率')
+    parser.add_argument('--compare', default=None, help='与之前的结果JSON比较，变慢超过20%%时以非零状态退出')
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.sizes, args.movies, args.queries, args.methods, args.seed, args.output, args.ann)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare_results(baseline, current):
+            raise SystemExit(1)
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+class ColdStartRecommender:
+    """新用户（冷启动）推荐
+
+    只保存每部电影的评分次数/平均分（热门与质量表）和内容近邻索引，
+    新用户的少量评分直接在内容近邻上打分，不复制评分数据、不重建推荐器
+    """
+
+    def __init__(self, movie_ids, ratings, content_neighbors, n_movies):
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.rating_count = np.bincount(movie_ids, minlength=n_movies)
+        rating_sum = np.bincount(movie_ids, weights=np.asarray(ratings, dtype=np.float64), minlength=n_movies)
+        self.avg_rating = np.divide(rating_sum, self.rating_count, out=np.zeros(len(rating_sum)),
+                                    where=self.rating_count > 0)
+        self.content_neighbors = content_neighbors
+        self._popular_cache = {}  # (热门阈值, 最低平均分) -> 排好序的电影
+
+    def popular(self, n_recommendations=10, popular_threshold=50, min_avg_rating=3.5):
+        """热门且质量高的电影：评分次数≥popular_threshold、平均分≥min_avg_rating，按评分次数、平均分降序
+
+        返回 [(编码后movieId, 评分次数/最大评分次数)]
+        """
+        key = (popular_threshold, min_avg_rating)
+        popular_movies = self._popular_cache.get(key)
+        if popular_movies is None:
+            movies = np.flatnonzero((self.rating_count >= popular_threshold) & (self.avg_rating >= min_avg_rating))
+            order = np.lexsort((-self.avg_rating[movies], -self.rating_count[movies]))
+            popular_movies = self._popular_cache[key] = movies[order]
+        if len(popular_movies) == 0:
+            return []
+
+        max_count = self.rating_count[popular_movies[0]]
+        return [(int(movie), self.rating_count[movie] / max_count) for movie in popular_movies[:n_recommendations]]
+
+    def recommend(self, encoded_ratings, n_recommendations=10, n_neighbors=10):
+        """根据新用户的初始评分（{编码后movieId: 评分}），汇总其喜欢电影(评分≥4)的内容近邻
+
+        用户评过分的电影（不论高低）都不会被推荐。返回 [(编码后movieId, 相似度和)]
+        """
+        liked = np.unique([movie for movie, rating in encoded_ratings.items() if rating >= 4]).astype(np.int64)
+        if len(liked) == 0:
+            return []
+
+        candidates, scores = self.content_neighbors.aggregate_sparse(liked, n_neighbors=n_neighbors)
+        rated = np.unique(np.fromiter(encoded_ratings.keys(), dtype=np.int64, count=len(encoded_ratings)))
+        keep = ~np.isin(candidates, rated, assume_unique=True)
+        candidates, scores = candidates[keep], scores[keep]
+        order = np.argsort(-scores, kind='stable')[:n_recommendations]
+        return [(int(movie), score) for movie, score in zip(candidates[order], scores[order])]
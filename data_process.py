@@ -1,95 +1,290 @@
+import argparse
+import os
+import shutil
+
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 from sklearn.preprocessing import LabelEncoder
 from sklearn.feature_extraction.text import TfidfVectorizer
 import scipy.sparse
 import joblib
 
-# 加载所有原始数据（不立即抽样，先保留完整电影集）
-ratings = pd.read_csv('data/ratings.csv')
-movies = pd.read_csv('data/movies.csv')
-tags = pd.read_csv('data/tags.csv')
-links = pd.read_csv('data/links.csv')
+from data_registry import load_full_data
+from neighbor_index import NeighborIndex
+
+DATA_DIR = 'data'
+OUTPUT_DIR = 'data/processed'
+FULL_DATA_DIR = 'full_data'  # 评分数据按列保存为.npy，位于OUTPUT_DIR下
+SAMPLE_FRACTION = 0.01  # 默认用户抽样比例，1.0表示使用全部用户
+CHUNK_SIZE = 1_000_000  # 每次读取的CSV行数，决定处理过程的内存上限
+
+# 评分数据只读需要的列，并使用紧凑类型（原来全部是int64/float64）
+RATING_DTYPES = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32, 'timestamp': np.int64}
+# 写出的列及类型：userId、movieId为编码后的ID（列名与data_registry.FULL_DATA_COLUMNS一致）
+FULL_DATA_COLUMNS = {
+    'userId': np.int32,
+    'movieId': np.int32,
+    'rating': np.float32,
+    'timestamp': np.int64,  # 秒级时间戳
+    'rating_year': np.int16,
+}
+
 
 # --------------------------
 # 1. 处理电影数据（保留全部电影）
 # --------------------------
-# 清洗电影数据（确保所有电影都被纳入）
-movies = movies.dropna(subset=['movieId', 'title', 'genres']).drop_duplicates(subset='movieId')
-all_movie_ids = movies['movieId'].unique()  # 全部电影的ID列表
-
-# 处理标签数据（合并到电影表，确保所有电影都有标签字段）
-# 关键修复：将tag列转换为字符串并填充空值，避免拼接时出现float类型
-tags['tag'] = tags['tag'].astype(str).fillna('')
-movie_tags = tags.groupby('movieId')['tag'].apply(lambda x: ', '.join(x)).reset_index()
-# 用所有电影ID左连接标签（确保无标签的电影也保留，填充空字符串）
-movie_data = pd.merge(movies, movie_tags, on='movieId', how='left')
-movie_data['tag'] = movie_data['tag'].fillna('')  # 无标签的电影用空字符串填充
+def load_movies(data_dir=DATA_DIR):
+    """读取并清洗电影表（确保所有电影都被纳入）"""
+    movies = pd.read_csv(os.path.join(data_dir, 'movies.csv'))
+    return movies.dropna(subset=['movieId', 'title', 'genres']).drop_duplicates(subset='movieId')
+
+
+def load_movie_tags(data_dir=DATA_DIR, chunk_size=CHUNK_SIZE, movie_ids=None):
+    """分块读取标签，返回 {movieId: 逗号拼接的标签}；给定movie_ids时只保留这些电影的标签
+
+    逐块按电影拼接标签，块之间按出现顺序继续拼接，结果与一次性groupby相同
+    """
+    tag_parts = {}
+    tag_chunks = pd.read_csv(os.path.join(data_dir, 'tags.csv'), usecols=['movieId', 'tag'],
+                             dtype={'movieId': np.int32, 'tag': object}, chunksize=chunk_size)
+    for chunk in tag_chunks:
+        if movie_ids is not None:
+            chunk = chunk[np.isin(chunk['movieId'].to_numpy(), movie_ids)]
+        # 关键修复：将tag列转换为字符串并填充空值，避免拼接时出现float类型
+        chunk['tag'] = chunk['tag'].astype(str).fillna('')
+        for movie_id, tag in chunk.groupby('movieId', sort=False)['tag'].agg(', '.join).items():
+            tag_parts.setdefault(movie_id, []).append(tag)
+    return {movie_id: ', '.join(parts) for movie_id, parts in tag_parts.items()}
+
+
+def load_movie_data(data_dir=DATA_DIR, chunk_size=CHUNK_SIZE):
+    """读取电影表并合并每部电影的标签"""
+    movies = load_movies(data_dir)
+    movie_tags = load_movie_tags(data_dir, chunk_size)
+    # 用所有电影ID左连接标签（确保无标签的电影也保留，填充空字符串）
+    movie_data = movies.copy()
+    movie_data['tag'] = movie_data['movieId'].map(movie_tags).fillna('')  # 无标签的电影用空字符串填充
+    return movie_data
+
 
 # --------------------------
 # 2. 用户抽样（仅对交互数据抽样，不影响电影集）
 # --------------------------
-sample_fraction = 0.01  # 抽样比例
-np.random.seed(42)
+def sample_users(ratings_path, sample_fraction=SAMPLE_FRACTION, chunk_size=CHUNK_SIZE, seed=42):
+    """只读取userId列统计全部用户并抽样，返回排好序的抽样用户；sample_fraction>=1时返回None（不抽样）
 
-# 对用户抽样（仅影响评分和标签的用户范围，不影响电影集）
-unique_users = ratings['userId'].unique()
-sampled_users = np.random.choice(unique_users, size=int(len(unique_users) * sample_fraction), replace=False)
+    用户按首次出现的顺序排列后再抽样，与一次性读取全部评分时的抽样结果相同
+    """
+    if sample_fraction >= 1:
+        return None
+    unique_users = []
+    for chunk in pd.read_csv(ratings_path, usecols=['userId'], dtype={'userId': np.int32}, chunksize=chunk_size):
+        unique_users.append(chunk['userId'].unique())
+    unique_users = pd.unique(np.concatenate(unique_users)) if unique_users else np.array([], dtype=np.int32)
+
+    np.random.seed(seed)
+    sampled_users = np.random.choice(unique_users, size=int(len(unique_users) * sample_fraction), replace=False)
+    return np.sort(sampled_users)
 
-# 过滤评分和标签数据（仅保留抽样用户的交互）
-ratings = ratings[ratings['userId'].isin(sampled_users)]
-tags = tags[tags['userId'].isin(sampled_users)]
 
 # --------------------------
-# 3. 合并数据并编码（确保编码基于全部电影）
+# 3. 分块读取评分、过滤并编码（确保编码基于全部电影）
 # --------------------------
-# 合并评分与电影数据（仅保留抽样用户的交互，但保留所有电影的元数据）
-full_data = pd.merge(ratings, movie_data, on='movieId', how='inner')
+def process_ratings(ratings_path, movie_ids, sampled_users, output_path, chunk_size=CHUNK_SIZE):
+    """逐块读取评分，只保留抽样用户对已知电影的评分，按列写出为.npy
 
-# 对用户ID编码（仅针对抽样用户）
-le_user = LabelEncoder()
-full_data['userId'] = le_user.fit_transform(full_data['userId'])
+    每列先追加写入临时的二进制文件，最后分块转换成.npy并对用户ID编码，
+    内存中同时只有一个数据块，与抽样比例无关。movie_ids需已排序。返回(行数, 用户编码器)
+    """
+    tmp_path = f'{output_path}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    columns = {name: open(os.path.join(tmp_path, f'{name}.bin'), 'wb') for name in FULL_DATA_COLUMNS}
 
-# 对电影ID编码（关键：基于全部电影ID，而非仅抽样用户交互过的电影）
-le_movie = LabelEncoder()
-le_movie.fit(all_movie_ids)  # 用所有电影ID训练编码器
-full_data['movieId'] = le_movie.transform(full_data['movieId'])  # 转换交互数据中的电影ID
+    n_rows = 0
+    user_ids = []
+    try:
+        for chunk in pd.read_csv(ratings_path, usecols=list(RATING_DTYPES), dtype=RATING_DTYPES,
+                                 chunksize=chunk_size):
+            user = chunk['userId'].to_numpy()
+            movie = chunk['movieId'].to_numpy()
+            # 过滤评分（仅保留抽样用户的交互）；与电影表内连接，只保留电影表中存在的电影
+            keep = np.isin(movie, movie_ids)
+            if sampled_users is not None:
+                keep &= np.isin(user, sampled_users)
+            if not keep.any():
+                continue
 
-# --------------------------
-# 4. 生成TF-IDF矩阵（基于全部电影的特征）
-# --------------------------
-# 基于全部电影的标签生成TF-IDF（行数 = 全部电影数）
-tfidf = TfidfVectorizer(stop_words='english')
-tfidf_matrix = tfidf.fit_transform(movie_data['tag'])  # 使用包含所有电影的movie_data
+            user = user[keep]
+            user_ids.append(np.unique(user))
+            timestamp = chunk['timestamp'].to_numpy()[keep]
+            values = {
+                'userId': user,
+                # 对电影ID编码（基于全部电影ID，而非仅抽样用户交互过的电影）
+                'movieId': np.searchsorted(movie_ids, movie[keep]),
+                'rating': chunk['rating'].to_numpy()[keep],
+                'timestamp': timestamp,
+                # 时间特征处理
+                'rating_year': timestamp.astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64) + 1970,
+            }
+            for name, dtype in FULL_DATA_COLUMNS.items():
+                values[name].astype(dtype, copy=False).tofile(columns[name])
+            n_rows += int(keep.sum())
+    finally:
+        for f in columns.values():
+            f.close()
 
-# --------------------------
-# 5. 时间特征处理
-# --------------------------
-full_data['timestamp'] = pd.to_datetime(full_data['timestamp'], unit='s')
-full_data['rating_year'] = full_data['timestamp'].dt.year
+    # 对用户ID编码（仅针对抽样用户）
+    le_user = LabelEncoder()
+    le_user.fit(np.unique(np.concatenate(user_ids)) if user_ids else np.array([], dtype=np.int32))
+
+    for name, dtype in FULL_DATA_COLUMNS.items():
+        raw = np.memmap(os.path.join(tmp_path, f'{name}.bin'), dtype=dtype, mode='r', shape=(n_rows,)) \
+            if n_rows else np.zeros(0, dtype=dtype)
+        out = np.lib.format.open_memmap(os.path.join(tmp_path, f'{name}.npy'), mode='w+', dtype=dtype, shape=(n_rows,))
+        for start in range(0, n_rows, chunk_size):
+            block = raw[start:start + chunk_size]
+            if name == 'userId':
+                block = np.searchsorted(le_user.classes_, block)
+            out[start:start + chunk_size] = block
+        out.flush()
+        del raw, out
+        os.remove(os.path.join(tmp_path, f'{name}.bin'))
+
+    # 全部写完后再替换旧的输出目录
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.replace(tmp_path, output_path)
+    return n_rows, le_user
 
-# --------------------------
-# 6. 验证数据一致性（关键检查）
-# --------------------------
-print(f"全部电影数量: {len(all_movie_ids)}")
-print(f"TF-IDF矩阵行数（电影特征数）: {tfidf_matrix.shape[0]}")
-print(f"标签编码器电影数: {len(le_movie.classes_)}")
 
-if tfidf_matrix.shape[0] != len(le_movie.classes_):
-    raise ValueError("数据不一致：TF-IDF矩阵与标签编码器的电影数量不匹配！")
+def process_data(sample_fraction=SAMPLE_FRACTION, data_dir=DATA_DIR, output_dir=OUTPUT_DIR, chunk_size=CHUNK_SIZE):
+    movie_data = load_movie_data(data_dir, chunk_size)
+    all_movie_ids = movie_data['movieId'].unique()  # 全部电影的ID列表
+
+    # 对电影ID编码（关键：基于全部电影ID，而非仅抽样用户交互过的电影）
+    le_movie = LabelEncoder()
+    le_movie.fit(all_movie_ids)  # 用所有电影ID训练编码器
+
+    ratings_path = os.path.join(data_dir, 'ratings.csv')
+    sampled_users = sample_users(ratings_path, sample_fraction, chunk_size)
+    full_data_path = os.path.join(output_dir, FULL_DATA_DIR)
+    n_rows, le_user = process_ratings(ratings_path, le_movie.classes_, sampled_users, full_data_path, chunk_size)
+
+    # --------------------------
+    # 4. 生成TF-IDF矩阵（基于全部电影的特征）
+    # --------------------------
+    # 基于全部电影的标签生成TF-IDF（行数 = 全部电影数），行顺序与le_movie的编码一致
+    movie_data = movie_data.iloc[np.argsort(movie_data['movieId'].to_numpy(), kind='stable')]
+    tfidf = TfidfVectorizer(stop_words='english')
+    tfidf_matrix = tfidf.fit_transform(movie_data['tag'])  # 使用包含所有电影的movie_data
+
+    # --------------------------
+    # 5. 验证数据一致性（关键检查）
+    # --------------------------
+    print(f"全部电影数量: {len(all_movie_ids)}")
+    print(f"TF-IDF矩阵行数（电影特征数）: {tfidf_matrix.shape[0]}")
+    print(f"标签编码器电影数: {len(le_movie.classes_)}")
+
+    if tfidf_matrix.shape[0] != len(le_movie.classes_):
+        raise ValueError("数据不一致：TF-IDF矩阵与标签编码器的电影数量不匹配！")
+
+    # --------------------------
+    # 6. 保存数据（评分数据已按列写入full_data目录）
+    # --------------------------
+    scipy.sparse.save_npz(os.path.join(output_dir, 'tfidf_matrix.npz'), tfidf_matrix)
+    joblib.dump(le_user, os.path.join(output_dir, 'le_user.pkl'))
+    joblib.dump(le_movie, os.path.join(output_dir, 'le_movie.pkl'))
+    joblib.dump(tfidf, os.path.join(output_dir, 'tfidf_vectorizer.pkl'))
+
+    # 输出抽样后交互数据的统计信息
+    full_data = load_full_data(full_data_path, mmap_mode='r')
+    print(f"抽样后用户-电影交互数据形状: {full_data.shape}")
+    print(f"抽样后用户数量: {len(le_user.classes_)}")
+    print(f"抽样后交互涉及的电影数量: {len(np.unique(full_data['movieId']))}")
+    return full_data
+
 
 # --------------------------
-# 7. 保存数据
+# 增量更新电影特征（新增电影、标签变化的电影）
 # --------------------------
-full_data.to_csv('data/processed/full_data.csv', index=False)
-scipy.sparse.save_npz('data/processed/tfidf_matrix.npz', tfidf_matrix)
-joblib.dump(le_user, 'data/processed/le_user.pkl')
-joblib.dump(le_movie, 'data/processed/le_movie.pkl')
-joblib.dump(tfidf, 'data/processed/tfidf_vectorizer.pkl')
-
-# 输出抽样后交互数据的统计信息
-print(f"抽样后用户-电影交互数据形状: {full_data.shape}")
-print(f"抽样后用户数量: {full_data['userId'].nunique()}")
-print(f"抽样后交互涉及的电影数量: {full_data['movieId'].nunique()}")
\ No newline at end of file
+def update_movie_features(changed_movie_ids=(), data_dir=DATA_DIR, output_dir=OUTPUT_DIR, chunk_size=CHUNK_SIZE):
+    """只为新增电影和changed_movie_ids（原始movieId，标签有变化的已有电影）计算TF-IDF特征
+
+    使用已保存的tfidf_vectorizer.pkl的词表和idf（不重新fit，词表外的新词被忽略，需要时重新运行process_data），
+    新电影的特征行追加到tfidf_matrix.npz末尾、ID追加到le_movie，已有电影的编码不变；
+    已有的内容近邻索引同时增量刷新。返回被更新的电影（编码后的ID）
+    """
+    tfidf_matrix_path = os.path.join(output_dir, 'tfidf_matrix.npz')
+    le_movie_path = os.path.join(output_dir, 'le_movie.pkl')
+    tfidf = joblib.load(os.path.join(output_dir, 'tfidf_vectorizer.pkl'))
+    le_movie = joblib.load(le_movie_path)
+    tfidf_matrix = scipy.sparse.load_npz(tfidf_matrix_path).tocsr()
+
+    # 新电影：电影表中有、编码器中没有的ID
+    movie_ids = load_movies(data_dir)['movieId'].to_numpy()
+    new_ids = np.setdiff1d(movie_ids, le_movie.classes_)
+    if len(new_ids) and len(le_movie.classes_) and new_ids[0] <= le_movie.classes_[-1]:
+        # LabelEncoder要求ID有序，中间插入会改变已有电影的编码
+        raise ValueError(
+            f"新电影ID（{new_ids[0]}）不大于已有的最大电影ID（{le_movie.classes_[-1]}），"
+            "无法在不重新编码的情况下追加，请重新运行process_data"
+        )
+    changed_ids = np.intersect1d(np.asarray(changed_movie_ids, dtype=le_movie.classes_.dtype), le_movie.classes_)
+    if len(new_ids) == 0 and len(changed_ids) == 0:
+        print("没有新增或变化的电影，特征无需更新")
+        return np.array([], dtype=np.int64)
+
+    # 只读取这些电影的标签并向量化
+    update_ids = np.concatenate([changed_ids, new_ids])
+    movie_tags = load_movie_tags(data_dir, chunk_size, movie_ids=update_ids)
+    update_rows = tfidf.transform([movie_tags.get(movie_id, '') for movie_id in update_ids])
+
+    # 变化的电影替换原来的行，新电影追加在末尾（按行号重排拼接后的矩阵，不转换为逐元素格式）
+    n_movies = tfidf_matrix.shape[0]
+    old_signature = NeighborIndex.matrix_signature(tfidf_matrix)
+    changed_rows = np.searchsorted(le_movie.classes_, changed_ids)
+    order = np.arange(n_movies + len(new_ids))
+    order[changed_rows] = n_movies + np.arange(len(changed_ids))
+    order[n_movies:] = n_movies + len(changed_ids) + np.arange(len(new_ids))
+    tfidf_matrix = scipy.sparse.vstack([tfidf_matrix, update_rows], format='csr')[order]
+    le_movie.classes_ = np.concatenate([le_movie.classes_, new_ids.astype(le_movie.classes_.dtype)])
+
+    if tfidf_matrix.shape[0] != len(le_movie.classes_):
+        raise ValueError("数据不一致：TF-IDF矩阵与标签编码器的电影数量不匹配！")
+
+    # 先写临时文件再替换，避免读到写了一半的文件
+    tmp_matrix_path = f'{tfidf_matrix_path}.tmp.npz'
+    scipy.sparse.save_npz(tmp_matrix_path, tfidf_matrix)
+    tmp_le_movie_path = f'{le_movie_path}.tmp'
+    joblib.dump(le_movie, tmp_le_movie_path)
+    os.replace(tmp_matrix_path, tfidf_matrix_path)
+    os.replace(tmp_le_movie_path, le_movie_path)
+
+    updated = np.concatenate([changed_rows, np.arange(n_movies, len(le_movie.classes_))])
+    content_neighbors_path = os.path.join(output_dir, 'content_neighbors.npz')  # 与make_recommend.CONTENT_NEIGHBORS_PATH相同
+    if os.path.exists(content_neighbors_path):
+        content_neighbors = NeighborIndex.load(content_neighbors_path)
+        # 只有索引确实是在更新前的特征矩阵上构建的（签名含内容校验和），才能只刷新变化的电影
+        if np.array_equal(content_neighbors.signature, old_signature):
+            refreshed = content_neighbors.refresh(tfidf_matrix, changed_rows)
+            content_neighbors.save(content_neighbors_path)
+            print(f"内容近邻索引已增量刷新，重算 {len(refreshed)} 部电影")
+        else:
+            print("内容近邻索引与更新前的特征矩阵不一致，将在下次加载时重新构建")
+
+    print(f"新增电影 {len(new_ids)} 部，更新电影 {len(changed_ids)} 部，电影总数 {len(le_movie.classes_)}")
+    return updated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='预处理MovieLens数据')
+    parser.add_argument('--sample-fraction', type=float, default=SAMPLE_FRACTION, help='用户抽样比例，1.0为全部用户')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='每次读取的CSV行数')
+    parser.add_argument('--update-features', action='store_true',
+                        help='只增量更新新增电影和--changed-movies的TF-IDF特征，不重新处理评分')
+    parser.add_argument('--changed-movies', type=int, nargs='*', default=[], help='标签有变化的已有电影（原始movieId）')
+    args = parser.parse_args()
+    if args.update_features:
+        update_movie_features(args.changed_movies, chunk_size=args.chunk_size)
+    else:
+        process_data(sample_fraction=args.sample_fraction, chunk_size=args.chunk_size)
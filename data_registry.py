@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+# 处理后的数据文件
+FULL_DATA_DIR = 'data/processed/full_data'  # data_process.py按列写出的评分数据（.npy）
+FULL_DATA_PATH = 'data/processed/full_data.csv'  # 旧版本的CSV格式，没有按列的数据时使用
+FULL_DATA_COLUMNS = ('userId', 'movieId', 'rating', 'timestamp', 'rating_year')
+TFIDF_MATRIX_PATH = 'data/processed/tfidf_matrix.npz'
+LE_USER_PATH = 'data/processed/le_user.pkl'
+LE_MOVIE_PATH = 'data/processed/le_movie.pkl'
+TFIDF_VECTORIZER_PATH = 'data/processed/tfidf_vectorizer.pkl'
+MOVIES_PATH = 'data/movies.csv'
+
+
+class DataRegistry:
+    """进程内共享的数据/模型注册表
+
+    每个名字注册一个加载函数，第一次get时才加载，之后所有模块复用同一个对象；记录每次加载的耗时。
+    已加载对象的get不加锁；set整体替换对象并递增版本号，已经取到旧对象的调用方继续使用旧对象
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._values = {}
+        self._locks = {}
+        self.load_times = {}  # 名字 -> 加载耗时（秒）
+        self.versions = {}  # 名字 -> 版本号（首次加载为1，每次set加1）
+
+    def register(self, name, loader):
+        """注册（或替换）加载函数，已加载的对象不受影响"""
+        self._loaders[name] = loader
+        self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        if name in self._values:
+            return self._values[name]
+        if name not in self._loaders:
+            raise KeyError(f"未注册的数据：{name}")
+        # 每个名字单独加锁，多个线程同时首次访问时只加载一次
+        with self._locks[name]:
+            if name not in self._values:
+                start = time.perf_counter()
+                value = self._loaders[name]()
+                self.load_times[name] = time.perf_counter() - start
+                print(f"加载 {name} 用时 {self.load_times[name]:.3f} 秒")
+                self._values[name] = value
+                self.versions[name] = self.versions.get(name, 0) + 1
+        return self._values[name]
+
+    def set(self, name, value):
+        """直接放入已加载的对象（如基准测试生成的合成数据、后台重建的推荐器），替换同名的已有对象，返回新的版本号"""
+        self._locks.setdefault(name, threading.Lock())
+        with self._locks[name]:
+            self._values[name] = value
+            self.versions[name] = self.versions.get(name, 0) + 1
+            return self.versions[name]
+
+    def version(self, name):
+        """当前对象的版本号，尚未加载时为0"""
+        return self.versions.get(name, 0)
+
+    def is_loaded(self, name):
+        return name in self._values
+
+    def __contains__(self, name):
+        return name in self._loaders
+
+
+def load_full_data(path=FULL_DATA_DIR, mmap_mode=None):
+    """读取按列保存的评分数据，返回DataFrame；目录不存在时读取旧的full_data.csv"""
+    if not os.path.isdir(path):
+        return pd.read_csv(FULL_DATA_PATH)
+    return pd.DataFrame({
+        name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+        for name in FULL_DATA_COLUMNS
+        if os.path.exists(os.path.join(path, f'{name}.npy'))
+    })
+
+
+registry = DataRegistry()
+registry.register('full_data', load_full_data)
+registry.register('tfidf_matrix', lambda: scipy.sparse.load_npz(TFIDF_MATRIX_PATH))
+registry.register('le_user', lambda: joblib.load(LE_USER_PATH))
+registry.register('le_movie', lambda: joblib.load(LE_MOVIE_PATH))
+registry.register('tfidf', lambda: joblib.load(TFIDF_VECTORIZER_PATH))
+registry.register('movies', lambda: pd.read_csv(MOVIES_PATH))
+
+
+def get(name):
+    """从全局注册表取数据（首次访问时加载）"""
+    return registry.get(name)
@@ -0,0 +1,304 @@
+import concurrent.futures
+import os
+
+import numpy as np
+import scipy.sparse
+from sklearn.decomposition import TruncatedSVD
+
+from ann_index import IVFIndex
+
+# ALS求解时预先计算另一侧全部 y_i y_iᵀ 的内存上限，超过时按块计算
+MAX_OUTER_BYTES = 256 * 2 ** 20
+
+
+class SVDFactorModel:
+    """截断SVD因子模型：只训练一次，新用户/评分变化的用户通过投影折叠(fold-in)进模型
+
+    user_factors: 用户×k（即 U·Σ），components: k×电影（即 Vᵀ），预测评分 = user_factors[u] @ components
+    """
+
+    def __init__(self, n_components=20, random_state=42, retrain_threshold=0.1):
+        self.n_components = n_components
+        self.random_state = random_state
+        self.retrain_threshold = retrain_threshold  # 折叠的评分数占训练评分数的比例超过该值时需要重新训练
+        self.user_factors = None
+        self.components = None
+        self.n_train_ratings = 0
+        self.n_folded_ratings = 0
+        self.fold_seq = 0
+        self.folded_users = {}  # user_id -> 最近一次fold-in的序号
+        self.item_index = None  # 电影因子上的ANN索引（build_item_index），用于top-N检索
+
+    def get_params(self):
+        return {
+            'n_components': self.n_components,
+            'random_state': self.random_state,
+            'retrain_threshold': self.retrain_threshold,
+        }
+
+    def fit(self, user_item_matrix, warm_start=None):
+        """在稀疏评分矩阵上训练（TruncatedSVD不支持热启动，warm_start被忽略）"""
+        svd = TruncatedSVD(n_components=self.n_components, random_state=self.random_state)
+        self.user_factors = svd.fit_transform(user_item_matrix)
+        self.components = svd.components_
+        self.n_train_ratings = user_item_matrix.nnz
+        self.n_folded_ratings = 0
+        self.folded_users = {}
+        return self
+
+    def fold_in(self, user_id, user_ratings, n_changed=None):
+        """把用户的评分向量投影到已有的因子空间（X·Vᵀ，与TruncatedSVD.transform一致），不重新训练
+
+        user_ratings: 长度为电影数的评分向量（稠密或1×n稀疏）；n_changed: 本次变化的评分数，用于估计漂移
+        """
+        factors = np.asarray(user_ratings @ self.components.T).ravel()
+        if user_id >= self.user_factors.shape[0]:
+            extra = user_id + 1 - self.user_factors.shape[0]
+            self.user_factors = np.vstack([self.user_factors, np.zeros((extra, self.n_components))])
+        self.user_factors[user_id] = factors
+
+        if n_changed is None:
+            n_changed = user_ratings.nnz if scipy.sparse.issparse(user_ratings) else np.count_nonzero(user_ratings)
+        self.n_folded_ratings += n_changed
+        self.fold_seq += 1
+        self.folded_users[user_id] = self.fold_seq
+        return factors
+
+    def predict(self, user_id):
+        """一个用户向量 × 电影因子，得到该用户对所有电影的预测评分"""
+        return self.user_factors[user_id] @ self.components
+
+    def build_item_index(self, **params):
+        """在电影因子上构建ANN索引（IVFIndex，params为其参数），预测评分最高的电影可以近似检索"""
+        self.item_index = IVFIndex(**params).fit(self.components.T)
+        return self.item_index
+
+    def drift(self):
+        """训练后通过fold-in加入的评分占训练评分的比例"""
+        return self.n_folded_ratings / max(self.n_train_ratings, 1)
+
+    def needs_retrain(self):
+        return self.drift() >= self.retrain_threshold
+
+
+class ALSFactorModel:
+    """带偏置项的交替最小二乘(ALS)因子模型，只在观测到的评分上训练
+
+    预测评分 = 全局均值 + 用户偏置 + 电影偏置 + p_u·q_i。为了与SVDFactorModel使用相同的接口（预测 = user_factors[u] @ components），
+    偏置项拼在因子末尾：user_factors[u] = [p_u, b_u, 1]，components[:, i] = [q_i, 1, 均值 + b_i]。
+    每轮先固定电影因子求解所有用户，再固定用户因子求解所有电影；每个用户/电影的正则化最小二乘
+    按块批量求解并分到线程池中，代价与评分数(nnz)成正比。留出一部分评分做验证集，验证RMSE不再下降时提前停止，
+    确定轮数后再用全部评分从相同的初始值重新训练这么多轮（验证集只用来选轮数，最终模型不丢弃任何评分）
+    """
+
+    def __init__(self, n_components=20, regularization=0.1, n_iterations=15, validation_fraction=0.1, tol=1e-4,
+                 n_threads=None, block_nnz=32768, random_state=42, retrain_threshold=0.1):
+        self.n_components = n_components
+        self.regularization = regularization  # 正则化系数，按每个用户/电影的评分数加权（ALS-WR）
+        self.n_iterations = n_iterations
+        self.validation_fraction = validation_fraction  # 留作验证集的评分比例，0表示不做提前停止
+        self.tol = tol  # 验证RMSE下降小于tol时停止
+        self.n_threads = n_threads
+        self.block_nnz = block_nnz  # 每块求解的评分数上限，决定临时内存（约 block_nnz × (k+1)(k+2)/2 个浮点数）
+        self.random_state = random_state
+        self.retrain_threshold = retrain_threshold  # 折叠的评分数占训练评分数的比例超过该值时需要重新训练
+        self.user_factors = None
+        self.components = None
+        self.global_mean = 0.0
+        self.validation_rmse = []  # 每轮的验证RMSE
+        self.best_n_iterations = 0  # 提前停止选出的轮数（最终模型在全部评分上训练的轮数）
+        self.n_train_ratings = 0
+        self.n_folded_ratings = 0
+        self.fold_seq = 0
+        self.folded_users = {}  # user_id -> 最近一次fold-in的序号
+        self.item_index = None  # 电影因子上的ANN索引（build_item_index），用于top-N检索
+
+    def get_params(self):
+        return {
+            'n_components': self.n_components,
+            'regularization': self.regularization,
+            'n_iterations': self.n_iterations,
+            'validation_fraction': self.validation_fraction,
+            'tol': self.tol,
+            'n_threads': self.n_threads,
+            'block_nnz': self.block_nnz,
+            'random_state': self.random_state,
+            'retrain_threshold': self.retrain_threshold,
+        }
+
+    def fit(self, user_item_matrix, warm_start=None):
+        """在稀疏评分矩阵的非零元上训练
+
+        warm_start: 之前训练好的ALSFactorModel，用它的因子初始化（新增的用户/电影随机初始化），通常几轮即可收敛
+        """
+        rng = np.random.default_rng(self.random_state)
+        ratings = scipy.sparse.csr_matrix(user_item_matrix, dtype=np.float64)
+        ratings.eliminate_zeros()
+        n_users, n_items = ratings.shape
+        k = self.n_components
+
+        # 随机留出验证集
+        coo = ratings.tocoo()
+        is_validation = rng.random(coo.nnz) < self.validation_fraction
+        train = scipy.sparse.csr_matrix(
+            (coo.data[~is_validation], (coo.row[~is_validation], coo.col[~is_validation])), shape=ratings.shape
+        )
+        validation = (coo.row[is_validation], coo.col[is_validation], coo.data[is_validation])
+        self.global_mean = ratings.data.mean() if ratings.nnz else 0.0
+
+        # 初始化：[p_u, b_u] 和 [q_i, b_i]
+        users = np.hstack([rng.normal(0, 0.1, (n_users, k)), np.zeros((n_users, 1))])
+        items = np.hstack([rng.normal(0, 0.1, (n_items, k)), np.zeros((n_items, 1))])
+        if warm_start is not None and warm_start.user_factors is not None and warm_start.n_components == k:
+            old_users = min(n_users, warm_start.user_factors.shape[0])
+            old_items = min(n_items, warm_start.components.shape[1])
+            users[:old_users] = warm_start.user_factors[:old_users, :k + 1]
+            items[:old_items, :k] = warm_start.components[:k, :old_items].T
+            items[:old_items, k] = warm_start.components[k + 1, :old_items] - self.global_mean
+
+        self.validation_rmse = []
+        self.best_n_iterations = self.n_iterations
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.n_threads or os.cpu_count()) as executor:
+            if len(validation[0]):
+                # 在训练集上迭代，验证RMSE不再下降时停止，记下最好的轮数
+                train_mean = train.data.mean() if train.nnz else 0.0
+                train_t = train.T.tocsr()
+                train_items = items
+                best_rmse = np.inf
+                for iteration in range(self.n_iterations):
+                    train_users, train_items = self._iterate(train, train_t, train_items, train_mean, executor)
+                    rmse = self._rmse(train_users, train_items, validation, train_mean)
+                    self.validation_rmse.append(rmse)
+                    if rmse < best_rmse - self.tol:
+                        best_rmse = rmse
+                        self.best_n_iterations = iteration + 1
+                    else:
+                        break
+
+            # 用全部评分从相同的初始值训练选出的轮数
+            ratings_t = ratings.T.tocsr()
+            for _ in range(self.best_n_iterations):
+                users, items = self._iterate(ratings, ratings_t, items, self.global_mean, executor)
+
+        self.user_factors = np.hstack([users, np.ones((n_users, 1))])
+        self.components = np.hstack([items[:, :k], np.ones((n_items, 1)), items[:, k:] + self.global_mean]).T
+        self.n_train_ratings = ratings.nnz
+        self.n_folded_ratings = 0
+        self.folded_users = {}
+        return self
+
+    def _iterate(self, ratings, ratings_t, items, global_mean, executor):
+        """一轮ALS：固定电影求解用户（目标为 r - 均值 - b_i），再固定用户求解电影（目标为 r - 均值 - b_u）"""
+        users = self._solve_side(ratings, items, global_mean, executor)
+        items = self._solve_side(ratings_t, users, global_mean, executor)
+        return users, items
+
+    def _solve_side(self, ratings, fixed, global_mean, executor):
+        """固定另一侧的 [因子, 偏置]，为ratings的每一行求解 [因子, 偏置]（ratings的列对应fixed的行）
+
+        第u行的最小二乘：特征为 [y_i, 1]，目标为 r_ui - 均值 - 另一侧偏置，正则化系数为 λ×该行评分数
+        """
+        k = self.n_components
+        n_rows = ratings.shape[0]
+        features = np.hstack([fixed[:, :k], np.ones((len(fixed), 1))])
+        residual = ratings.data - global_mean - fixed[ratings.indices, k]
+        counts = np.diff(ratings.indptr)
+
+        upper = np.triu_indices(k + 1)
+        # 另一侧对象数不多时一次算好所有 y_i y_iᵀ（只取上三角），否则每块只算块内出现的对象
+        outer = None
+        if len(fixed) * len(upper[0]) * features.itemsize <= MAX_OUTER_BYTES:
+            outer = features[:, upper[0]] * features[:, upper[1]]
+
+        def solve(start, end):
+            # 用稀疏矩阵乘法按行求和得到 Σ y_i y_iᵀ 和 Σ y_i (r_ui - ...)
+            lo, hi = ratings.indptr[start], ratings.indptr[end]
+            block_indptr = ratings.indptr[start:end + 1] - lo
+            if outer is not None:
+                columns, block_features, block_outer = ratings.indices[lo:hi], features, outer
+            else:
+                present, columns = np.unique(ratings.indices[lo:hi], return_inverse=True)
+                block_features = features[present]
+                block_outer = block_features[:, upper[0]] * block_features[:, upper[1]]
+            shape = (end - start, len(block_features))
+            pattern = scipy.sparse.csr_matrix((np.ones(hi - lo), columns, block_indptr), shape=shape)
+            weighted = scipy.sparse.csr_matrix((residual[lo:hi], columns, block_indptr), shape=shape)
+            gram_upper = pattern @ block_outer
+            gram = np.empty((end - start, k + 1, k + 1))
+            gram[:, upper[0], upper[1]] = gram_upper
+            gram[:, upper[1], upper[0]] = gram_upper
+            gram += (self.regularization * np.maximum(counts[start:end], 1))[:, np.newaxis, np.newaxis] * np.eye(k + 1)
+            target = weighted @ block_features
+            return np.linalg.solve(gram, target[:, :, np.newaxis])[:, :, 0]
+
+        # 按评分数分块（评分特别多的行单独成块），各块在线程池中求解（NumPy运算释放GIL）
+        starts = np.searchsorted(ratings.indptr, np.arange(0, ratings.nnz, self.block_nnz), side='right') - 1
+        starts = np.unique(np.concatenate([[0], starts]))
+        starts = starts[starts < n_rows]
+        ends = np.append(starts[1:], n_rows)
+        solved = list(executor.map(solve, starts, ends))
+        # 没有评分的行解为0（只依赖全局均值和另一侧偏置）
+        return np.vstack(solved) if solved else np.zeros((0, k + 1))
+
+    def _rmse(self, users, items, validation, global_mean):
+        rows, cols, values = validation
+        k = self.n_components
+        predictions = (np.einsum('ij,ij->i', users[rows, :k], items[cols, :k])
+                       + users[rows, k] + items[cols, k] + global_mean)
+        return float(np.sqrt(np.mean((predictions - values) ** 2)))
+
+    def fold_in(self, user_id, user_ratings, n_changed=None):
+        """固定电影因子，只为该用户求解一次正则化最小二乘（与训练中的用户步骤相同），不重新训练
+
+        user_ratings: 长度为电影数的评分向量（稠密或1×n稀疏）；n_changed: 本次变化的评分数，用于估计漂移
+        """
+        if scipy.sparse.issparse(user_ratings):
+            row = scipy.sparse.csr_matrix(user_ratings)
+            rated, values = row.indices, row.data
+        else:
+            user_ratings = np.asarray(user_ratings).ravel()
+            rated = np.flatnonzero(user_ratings)
+            values = user_ratings[rated]
+
+        k = self.n_components
+        factors = np.zeros(k + 2)
+        factors[k + 1] = 1
+        if len(rated):
+            features = self.components[:k + 1, rated].T  # [q_i, 1]
+            target = values - self.components[k + 1, rated]  # r - 均值 - b_i
+            gram = features.T @ features + self.regularization * len(rated) * np.eye(k + 1)
+            factors[:k + 1] = np.linalg.solve(gram, features.T @ target)
+
+        if user_id >= self.user_factors.shape[0]:
+            extra = user_id + 1 - self.user_factors.shape[0]
+            padding = np.zeros((extra, k + 2))
+            padding[:, k + 1] = 1
+            self.user_factors = np.vstack([self.user_factors, padding])
+        self.user_factors[user_id] = factors
+
+        if n_changed is None:
+            n_changed = len(rated)
+        self.n_folded_ratings += n_changed
+        self.fold_seq += 1
+        self.folded_users[user_id] = self.fold_seq
+        return factors
+
+    def predict(self, user_id):
+        """一个用户向量 × 电影因子，得到该用户对所有电影的预测评分"""
+        return self.user_factors[user_id] @ self.components
+
+    def build_item_index(self, **params):
+        """在电影因子上构建ANN索引（IVFIndex，params为其参数），预测评分最高的电影可以近似检索"""
+        self.item_index = IVFIndex(**params).fit(self.components.T)
+        return self.item_index
+
+    def drift(self):
+        """训练后通过fold-in加入的评分占训练评分的比例"""
+        return self.n_folded_ratings / max(self.n_train_ratings, 1)
+
+    def needs_retrain(self):
+        return self.drift() >= self.retrain_threshold
+
+
+# 因子模型类型名 -> 类，模型文件包中按类型名重建
+FACTOR_MODELS = {'svd': SVDFactorModel, 'als': ALSFactorModel}
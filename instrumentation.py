@@ -0,0 +1,137 @@
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+
+# 直方图的桶上限（秒），与Prometheus客户端的默认桶相近，补充了亚毫秒级的桶
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+enabled = True  # 关闭后timer()直接返回空的上下文管理器，几乎没有开销
+_local = threading.local()  # 当前线程正在记录的请求（各阶段用时列表）
+_NULL_TIMER = nullcontext()
+
+
+class Histogram:
+    """Prometheus风格的累计直方图：每个桶记录 ≤上限 的观测次数，外加总次数和总和"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf 桶
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """(各桶的累计次数, 总次数, 总和)"""
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        cumulative = []
+        running = 0
+        for n in counts:
+            running += n
+            cumulative.append(running)
+        return cumulative, count, total
+
+
+class _Timer:
+    __slots__ = ('histograms', 'labels', 'trace', 'start')
+
+    def __init__(self, histograms, labels, trace):
+        self.histograms = histograms
+        self.labels = labels
+        self.trace = trace
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.histograms.observe(self.labels, elapsed)
+        if self.trace is not None:
+            self.trace.append((self.labels, elapsed))
+        return False
+
+
+class HistogramFamily:
+    """同名、按一个标签区分的一组直方图（如按阶段区分的 frs_stage_seconds）"""
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        histogram = self.histograms.get(label_value)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(label_value, Histogram(self.buckets))
+        histogram.observe(value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_value in sorted(self.histograms):
+            cumulative, count, total = self.histograms[label_value].snapshot()
+            label = f'{self.label}="{_escape(label_value)}"'
+            for bound, n in zip(self.buckets + ('+Inf',), cumulative):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {n}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+
+stage_seconds = HistogramFamily('frs_stage_seconds', '推荐请求各阶段用时（秒）', 'stage')
+request_seconds = HistogramFamily('frs_request_seconds', 'HTTP请求总用时（秒）', 'endpoint')
+
+
+def timer(stage, trace=None):
+    """记录一个阶段的用时：with timer('db_query'): ...
+
+    用时计入stage_seconds直方图；trace默认为当前线程正在记录的请求（见start_trace），在线程池中计时时需显式传入
+    """
+    if not enabled:
+        return _NULL_TIMER
+    return _Timer(stage_seconds, stage, trace if trace is not None else getattr(_local, 'trace', None))
+
+
+def timed_call(stage, trace, func, *args):
+    """在计时下调用func(*args)，用于提交到线程池的任务"""
+    with timer(stage, trace):
+        return func(*args)
+
+
+def start_trace():
+    """开始记录当前线程的请求，返回各阶段用时列表 [(阶段, 秒)]"""
+    trace = [] if enabled else None
+    _local.trace = trace
+    return trace
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+def end_trace():
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace
+
+
+def render_prometheus(extra_lines=()):
+    """Prometheus文本格式的全部指标"""
+    lines = stage_seconds.render() + request_seconds.render() + list(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -1,44 +1,179 @@
 import os
+import numpy as np
 import pandas as pd
-import scipy.sparse
-import joblib
+import data_registry
+import instrumentation
 from recommender_systems import RecommenderSystem
+from neighbor_index import NeighborIndex
+from cold_start import ColdStartRecommender
+from model_store import BundleError, load_bundle, save_bundle, verify_bundle
 
-# 加载处理后的数据
-full_data = pd.read_csv('data/processed/full_data.csv')
-tfidf_matrix = scipy.sparse.load_npz('data/processed/tfidf_matrix.npz')
-le_movie = joblib.load('data/processed/le_movie.pkl')  # 加载电影标签编码器
+
+# 处理后的数据由data_registry在首次使用时加载（兼容 make_recommend.full_data 等旧写法）
+def __getattr__(name):
+    if name in data_registry.registry:
+        return data_registry.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # 关键：添加数据一致性校验
-print(f"TF-IDF矩阵行数（特征矩阵电影数）: {tfidf_matrix.shape[0]}")
-print(f"标签编码器中的电影数: {len(le_movie.classes_)}")
-
-# 校验不通过时抛出明确信息并终止
-if tfidf_matrix.shape[0] != len(le_movie.classes_):
-    raise ValueError(
-        f"数据不一致：特征矩阵电影数（{tfidf_matrix.shape[0]}）与标签编码器电影数（{len(le_movie.classes_)}）不匹配！"
-        "\n请重新生成tfidf_matrix和le_movie，确保它们基于同一批电影数据"
-    )
+def check_data_consistency():
+    tfidf_matrix = data_registry.get('tfidf_matrix')
+    le_movie = data_registry.get('le_movie')
+    print(f"TF-IDF矩阵行数（特征矩阵电影数）: {tfidf_matrix.shape[0]}")
+    print(f"标签编码器中的电影数: {len(le_movie.classes_)}")
+
+    # 校验不通过时抛出明确信息并终止
+    if tfidf_matrix.shape[0] != len(le_movie.classes_):
+        raise ValueError(
+            f"数据不一致：特征矩阵电影数（{tfidf_matrix.shape[0]}）与标签编码器电影数（{len(le_movie.classes_)}）不匹配！"
+            "\n请重新生成tfidf_matrix和le_movie，确保它们基于同一批电影数据"
+        )
 
-# 新增：定义推荐器保存路径
-RECOMMENDER_SAVE_PATH = 'data/processed/recommender_model.pkl'
+# 新增：定义推荐器保存路径（内存映射的模型文件包目录）
+RECOMMENDER_BUNDLE_PATH = 'data/processed/recommender_bundle'
+ITEM_NEIGHBORS_PATH = 'data/processed/item_neighbors.npz'  # 物品近邻索引（与le_movie.pkl同目录）
+CONTENT_NEIGHBORS_PATH = 'data/processed/content_neighbors.npz'  # 基于TF-IDF的内容近邻索引
+# 电影数达到此规模时使用ANN索引（电影因子上的矩阵分解检索、TF-IDF上的内容近邻构建），更小的目录精确计算已足够快
+ANN_MIN_ITEMS = 20000
 
 # 新增：加载已保存的推荐器，若不存在则初始化并保存
 def load_or_init_recommender():
-    if os.path.exists(RECOMMENDER_SAVE_PATH):
+    if os.path.exists(RECOMMENDER_BUNDLE_PATH):
         print("加载已保存的推荐器...")
-        return joblib.load(RECOMMENDER_SAVE_PATH)
+        try:
+            # 数组以内存映射方式打开，多个worker进程共享同一份页缓存；
+            # 只检查manifest和形状类型，sha256在保存文件包后校验，不在每个worker启动时读一遍整个文件包
+            recommender = load_bundle(RECOMMENDER_BUNDLE_PATH)
+            # 电影特征增量更新（data_process.update_movie_features）后，文件包中的电影目录已过期
+            if NeighborIndex.matrix_signature(recommender.movie_features).tolist() == \
+                    NeighborIndex.matrix_signature(data_registry.get('tfidf_matrix')).tolist():
+                return recommender
+            print("电影特征已更新，推荐器文件包已过期，重新初始化...")
+        except BundleError as e:
+            # 版本过旧或文件不完整（如写到一半）时重建
+            print(f"已保存的推荐器不可用（{e}），重新初始化...")
+
+    print("初始化新的推荐器...")
+    check_data_consistency()
+    recommender = RecommenderSystem(
+        ratings_data=data_registry.get('full_data'),
+        movie_features=data_registry.get('tfidf_matrix'),
+        le_movie=data_registry.get('le_movie')
+    )
+    recommender.fit_factor_model()  # 因子模型只训练一次，随推荐器一起保存
+    if use_ann(recommender):
+        recommender.build_factor_index()  # ANN索引随因子模型一起保存在文件包中
+    load_neighbor_indexes(recommender)
+    # 保存初始化后的推荐器
+    save_bundle(recommender, RECOMMENDER_BUNDLE_PATH)
+    verify_bundle(RECOMMENDER_BUNDLE_PATH)
+    print(f"推荐器已保存至 {RECOMMENDER_BUNDLE_PATH}")
+    return recommender
+
+# 推荐器也登记到注册表，各模块通过 data_registry.get('recommender') 共享同一个实例
+data_registry.registry.register('recommender', load_or_init_recommender)
+
+def rebuild_recommender(current=None, online_ratings=None, bundle_path=None):
+    """用离线评分数据加上在线用户的评分重新构建推荐器（供model_refresher在后台调用）
+
+    online_ratings: DataFrame(userId, movieId, rating)，ID已编码（userId = n_base_users + 数据库用户ID）。
+    current为正在使用的推荐器：沿用它的n_base_users和内容近邻，因子模型以它的因子热启动。
+    物品近邻在内存中重建，不覆盖离线的近邻索引文件；给出bundle_path时保存为新的模型文件包
+    """
+    full_data = data_registry.get('full_data')
+    ratings_data = full_data[['userId', 'movieId', 'rating']]
+    n_base_users = current.n_base_users if current is not None else int(full_data['userId'].max()) + 1
+    if online_ratings is not None and len(online_ratings):
+        ratings_data = pd.concat([ratings_data, online_ratings[['userId', 'movieId', 'rating']]], ignore_index=True)
+
+    recommender = RecommenderSystem(
+        ratings_data=ratings_data,
+        movie_features=data_registry.get('tfidf_matrix'),
+        le_movie=data_registry.get('le_movie'),
+        n_base_users=n_base_users
+    )
+    old_model = current.factor_model if current is not None else None
+    if old_model is not None:
+        recommender.factor_model = type(old_model)(**old_model.get_params()).fit(
+            recommender.user_item_matrix, warm_start=old_model
+        )
+        if old_model.item_index is not None:
+            recommender.build_factor_index(**old_model.item_index.get_params())
     else:
-        print("初始化新的推荐器...")
-        recommender = RecommenderSystem(
-            ratings_data=full_data,
-            movie_features=tfidf_matrix,
-            le_movie=le_movie
+        recommender.fit_factor_model()
+        if use_ann(recommender):
+            recommender.build_factor_index()
+    recommender.build_item_neighbors()
+    if current is not None and current.content_neighbors is not None:
+        recommender.content_neighbors = current.content_neighbors
+        recommender.content_index = current.content_index
+    else:
+        recommender.build_content_neighbors(approximate=use_ann(recommender))
+    if bundle_path is not None:
+        save_bundle(recommender, bundle_path)
+        verify_bundle(bundle_path)
+    return recommender
+
+def use_ann(recommender):
+    """电影目录是否大到需要ANN索引"""
+    return recommender.item_user_matrix.shape[1] >= ANN_MIN_ITEMS
+
+def load_neighbor_indexes(recommender):
+    """加载物品近邻和内容近邻索引（大目录的内容近邻用TF-IDF上的ANN索引近似构建）"""
+    recommender.item_neighbors = load_neighbor_index(
+        ITEM_NEIGHBORS_PATH, recommender.item_user_matrix.T, recommender.build_item_neighbors
+    )
+    recommender.content_neighbors = load_neighbor_index(
+        CONTENT_NEIGHBORS_PATH, recommender.movie_features,
+        lambda: recommender.build_content_neighbors(approximate=use_ann(recommender))
+    )
+
+def load_neighbor_index(path, item_vectors, build):
+    """加载近邻索引，不存在或与输入矩阵不匹配时离线构建并保存"""
+    if os.path.exists(path):
+        index = NeighborIndex.load(path)
+        signature = NeighborIndex.matrix_signature(item_vectors)
+        if np.array_equal(index.signature, signature):
+            return index
+        n_indexed = int(index.signature[0])
+        if n_indexed < signature[0] and \
+                np.array_equal(index.signature, NeighborIndex.matrix_signature(item_vectors[:n_indexed])):
+            # 只是末尾追加了新物品（如新增电影）：前n_indexed行与构建索引时完全相同（含内容校验和），只需计算新物品
+            n_added = int(signature[0] - index.signature[0])
+            index.refresh(item_vectors, [])
+            index.save(path)
+            print(f"近邻索引 {path} 已追加 {n_added} 个物品")
+            return index
+        print(f"近邻索引 {path} 已过期，重新构建...")
+
+    print(f"构建近邻索引 {path}...")
+    index = build()
+    index.save(path)
+    print(f"近邻索引已保存至 {path}")
+    return index
+
+# 冷启动推荐器（热门/质量表 + 内容近邻），首次使用时构建
+_cold_start_recommender = None
+
+def get_cold_start_recommender(recommender=None):
+    """获取冷启动推荐器：内容近邻优先复用已加载推荐器中的索引"""
+    global _cold_start_recommender
+    if _cold_start_recommender is None:
+        if recommender is not None and recommender.content_neighbors is not None:
+            content_neighbors = recommender.content_neighbors
+        else:
+            tfidf_matrix = data_registry.get('tfidf_matrix')
+            content_neighbors = load_neighbor_index(
+                CONTENT_NEIGHBORS_PATH, tfidf_matrix, lambda: NeighborIndex.build(tfidf_matrix)
+            )
+        full_data = data_registry.get('full_data')
+        _cold_start_recommender = ColdStartRecommender(
+            movie_ids=full_data['movieId'].to_numpy(),
+            ratings=full_data['rating'].to_numpy(),
+            content_neighbors=content_neighbors,
+            n_movies=len(data_registry.get('le_movie').classes_)
         )
-        # 保存初始化后的推荐器
-        joblib.dump(recommender, RECOMMENDER_SAVE_PATH)
-        print(f"推荐器已保存至 {RECOMMENDER_SAVE_PATH}")
-        return recommender
+    return _cold_start_recommender
 
 def recommend_for_new_user(
         recommender=None,
@@ -47,53 +182,25 @@ def recommend_for_new_user(
         popular_threshold=50  # 热门电影的最低评分次数
 ):
     """为新用户推荐电影（处理冷启动问题）"""
-    # 1. 若新用户无任何评分，返回热门电影
+    cold_start = get_cold_start_recommender(recommender)
+
+    # 1. 若新用户无任何评分，返回热门电影（评分次数≥threshold，平均评分≥3.5）
     if not new_user_ratings:
-        # 计算电影评分次数和平均评分（筛选热门且质量高的电影）
-        movie_popularity = full_data.groupby('movieId').agg(
-            rating_count=('rating', 'count'),
-            avg_rating=('rating', 'mean')
-        )
-        # 筛选热门电影（评分次数≥threshold，平均评分≥3.5）
-        popular_movies = movie_popularity[
-            (movie_popularity['rating_count'] >= popular_threshold) &
-            (movie_popularity['avg_rating'] >= 3.5)
-            ].sort_values(by=['rating_count', 'avg_rating'], ascending=False)
-
-        # 取前n个热门电影
-        top_popular = popular_movies.head(n_recommendations).index.tolist()
-        # 转换为 (电影ID, 推荐分数) 格式（分数用评分次数归一化）
-        max_count = popular_movies['rating_count'].max()
-        return [(mid, cnt / max_count) for mid, cnt in
-                zip(top_popular, popular_movies.loc[top_popular, 'rating_count'])]
+        with instrumentation.timer('new_user.popular'):
+            return cold_start.popular(n_recommendations, popular_threshold=popular_threshold, min_avg_rating=3.5)
 
     # 2. 若新用户有初始评分，基于内容推荐相似电影
-    else:
-        # 将新用户的原始movieId转换为编码后的ID
-        try:
-            encoded_movies = le_movie.transform(list(new_user_ratings.keys()))
-        except ValueError as e:
-            raise ValueError(f"部分电影ID不在训练集中：{e}")
-
-        # 为新用户创建临时评分数据（用户ID用一个未出现的值，如max_id+1）
-        new_user_id = full_data['userId'].max() + 1 if not full_data.empty else 0
-        temp_ratings = pd.DataFrame({
-            'userId': [new_user_id] * len(encoded_movies),
-            'movieId': encoded_movies,
-            'rating': list(new_user_ratings.values())
-        })
-
-        # 将临时数据加入推荐器的评分数据中
-        temp_full_data = pd.concat([full_data, temp_ratings], ignore_index=True)
-        temp_recommender = RecommenderSystem(
-            ratings_data=temp_full_data,
-            movie_features=tfidf_matrix,
-            le_movie=le_movie
-        )
-
-        # 使用基于内容的推荐（依赖初始评分的电影特征）
-        return temp_recommender.content_based(
-            user_id=new_user_id,
+    # 将新用户的原始movieId转换为编码后的ID
+    try:
+        with instrumentation.timer('new_user.encode'):
+            encoded_movies = data_registry.get('le_movie').transform(list(new_user_ratings.keys()))
+    except ValueError as e:
+        raise ValueError(f"部分电影ID不在训练集中：{e}")
+
+    # 直接用初始评分在内容近邻上打分，不需要把新用户加入评分数据
+    with instrumentation.timer('new_user.content'):
+        return cold_start.recommend(
+            dict(zip(encoded_movies, new_user_ratings.values())),
             n_recommendations=n_recommendations
         )
 
@@ -109,8 +216,6 @@ def recommend_for_old_user(
         weights=[0.25, 0.25, 0.25, 0.25]
     )
 
-# 加载原始电影数据
-movies = pd.read_csv('data/movies.csv')
 # 修正电影名称映射函数：使用le_movie转换编码ID为原始ID
 def get_movie_names(recommendations, movies_df, le_movie):
     rec_movie_ids = [movie_id for movie_id, _ in recommendations]
@@ -135,6 +240,6 @@ if __name__ == "__main__":
         print(f"{movie_id}: {score:.4f}")
 
     # 转换混合推荐结果为电影名称（传入le_movie）
-    rec_movie_names = get_movie_names(hybrid_recs, movies, le_movie)
+    rec_movie_names = get_movie_names(hybrid_recs, data_registry.get('movies'), data_registry.get('le_movie'))
     print("\n推荐电影名称：")
     print(rec_movie_names['title'].tolist())
\ No newline at end of file
@@ -0,0 +1,112 @@
+import gc
+import threading
+import time
+import weakref
+
+import data_registry
+
+
+class ModelRefresher:
+    """后台线程定期重建模型，完成后通过data_registry整体替换（版本号加1）
+
+    请求在开始时取一次模型引用（data_registry.get，已加载时不加锁），正在处理的请求继续使用旧模型直到结束。
+    被替换的旧模型在最后一个请求释放后才会被回收；下一次重建要等旧模型回收之后才开始，
+    因此内存中最多同时存在两份模型（正在使用的和正在构建的）。
+    两次重建之间每隔maintain_interval秒在当前模型上调用一次maintain（如刷新评分变化电影的近邻），
+    这类增量维护不在请求中执行
+    """
+
+    def __init__(self, build, name='recommender', interval=3600, retire_timeout=600, on_swap=None,
+                 maintain=None, maintain_interval=10, registry=data_registry.registry):
+        self.build = build  # build(当前模型) -> 新模型
+        self.name = name
+        self.interval = interval  # 两次重建之间的间隔（秒）
+        self.maintain = maintain  # maintain(当前模型)，已加载的模型上的增量维护
+        self.maintain_interval = maintain_interval  # 两次增量维护之间的间隔（秒）
+        self.retire_timeout = retire_timeout  # 等待旧模型回收的最长时间（秒），超时则跳过本次重建
+        self.on_swap = on_swap  # 替换后的回调 on_swap(版本号)，如清空推荐缓存
+        self.registry = registry
+        self.last_refresh = None  # 上次替换的时间戳
+        self.last_build_seconds = None
+        self.last_error = None
+        self._retired = None  # 被替换的旧模型的弱引用
+        self._refresh_lock = threading.Lock()  # 同一时间只做一次重建（只在后台线程中使用，不在请求路径上）
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动后台线程，已启动时直接返回（可以在每个请求开始时调用，已启动时不加锁）"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            return thread
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name=f'{self.name}-refresher', daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        next_refresh = time.monotonic() + self.interval
+        wait = self.interval if self.maintain is None else min(self.interval, self.maintain_interval)
+        while not self._stop.wait(wait):
+            try:
+                if time.monotonic() >= next_refresh:
+                    next_refresh = time.monotonic() + self.interval
+                    self.refresh()
+                elif self.maintain is not None and self.registry.is_loaded(self.name):
+                    self.maintain(self.registry.get(self.name))
+            except Exception as e:
+                # 重建或维护失败时继续使用当前模型，等待下一次
+                self.last_error = repr(e)
+                print(f"更新 {self.name} 失败：{e}")
+
+    def refresh(self):
+        """立即重建并替换模型，返回新的版本号；旧模型尚未回收时返回None"""
+        with self._refresh_lock:
+            if not self._wait_retired():
+                print(f"旧的 {self.name} 在 {self.retire_timeout} 秒内仍未释放，跳过本次重建")
+                return None
+
+            start = time.perf_counter()
+            current = self.registry.get(self.name)
+            model = self.build(current)
+            version = self.registry.set(self.name, model)
+            self._retired = weakref.ref(current)
+            del current, model
+
+            self.last_build_seconds = time.perf_counter() - start
+            self.last_refresh = time.time()
+            self.last_error = None
+            print(f"{self.name} 已更新到版本 {version}，重建用时 {self.last_build_seconds:.1f} 秒")
+            if self.on_swap is not None:
+                self.on_swap(version)
+            return version
+
+    def _wait_retired(self):
+        """等待上一次被替换的模型被回收"""
+        deadline = time.monotonic() + self.retire_timeout
+        while self._retired is not None and self._retired() is not None:
+            gc.collect()  # 模型内部可能有循环引用，引用计数不能单独回收
+            if self._retired() is None:
+                break
+            if time.monotonic() > deadline or self._stop.wait(1):
+                return False
+        self._retired = None
+        return True
+
+    def status(self):
+        return {
+            'name': self.name,
+            'version': self.registry.version(self.name),
+            'last_refresh': self.last_refresh,
+            'last_build_seconds': self.last_build_seconds,
+            'last_error': self.last_error,
+            'running': self._thread is not None and self._thread.is_alive(),
+        }
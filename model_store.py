@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import scipy.sparse
+from sklearn.preprocessing import LabelEncoder
+
+from ann_index import IVFIndex
+from factor_model import FACTOR_MODELS
+from neighbor_index import NeighborIndex
+from recommender_systems import RecommenderSystem, MODEL_VERSION
+
+# 模型文件包格式版本，文件布局变化时加一
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+
+class BundleError(ValueError):
+    """模型文件包不存在、版本不符或校验失败"""
+
+
+def save_bundle(recommender, directory):
+    """把推荐器保存为模型文件包：每个数组一个.npy文件，外加记录版本、形状和sha256校验和的manifest.json
+
+    先写到临时目录，全部写完后再替换正式目录，manifest最后写入
+    """
+    arrays = {
+        'movie_ids': np.asarray(recommender.le_movie.classes_),
+        'user_mask': recommender.user_mask,
+        'item_mask': recommender.item_mask,
+    }
+    _add_sparse(arrays, 'user_item', recommender.user_item_matrix)
+    _add_sparse(arrays, 'item_user', recommender.item_user_matrix)
+    if recommender.movie_features is not None:
+        _add_sparse(arrays, 'movie_features', scipy.sparse.csr_matrix(recommender.movie_features))
+    for name in ('item_neighbors', 'content_neighbors'):
+        index = getattr(recommender, name)
+        if index is not None:
+            arrays[f'{name}.indices'] = index.indices
+            arrays[f'{name}.scores'] = index.scores
+            arrays[f'{name}.signature'] = index.signature
+
+    meta = {
+        'n_base_users': recommender.n_base_users,
+        'n_workers': recommender.n_workers,
+        'component_timeout': recommender.component_timeout,
+    }
+    if recommender.content_index is not None:
+        arrays.update(recommender.content_index.to_arrays('content_index'))
+        meta['content_index'] = recommender.content_index.get_params()
+    factor_model = recommender.factor_model
+    if factor_model is not None:
+        arrays['factors.user'] = factor_model.user_factors
+        arrays['factors.components'] = factor_model.components
+        arrays['factors.folded_users'] = np.array(list(factor_model.folded_users.items()), dtype=np.int64).reshape(-1, 2)
+        meta['factor_model'] = {
+            'type': next(name for name, cls in FACTOR_MODELS.items() if isinstance(factor_model, cls)),
+            'params': factor_model.get_params(),
+            'global_mean': float(getattr(factor_model, 'global_mean', 0.0)),
+            'n_train_ratings': factor_model.n_train_ratings,
+            'n_folded_ratings': factor_model.n_folded_ratings,
+            'fold_seq': factor_model.fold_seq,
+        }
+        if factor_model.item_index is not None:
+            arrays.update(factor_model.item_index.to_arrays('factors.item_index'))
+            meta['factor_model']['item_index'] = factor_model.item_index.get_params()
+
+    directory = os.path.abspath(directory)
+    tmp_directory = f'{directory}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+
+    manifest = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'model_version': MODEL_VERSION,
+        'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'meta': meta,
+        'arrays': {},
+    }
+    for name, array in arrays.items():
+        file_name = f'{name}.npy'
+        path = os.path.join(tmp_directory, file_name)
+        np.save(path, np.asarray(array))
+        manifest['arrays'][name] = {
+            'file': file_name,
+            'shape': list(np.shape(array)),
+            'dtype': str(np.asarray(array).dtype),
+            'sha256': _sha256(path),
+        }
+    with open(os.path.join(tmp_directory, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # 替换旧的文件包
+    old_directory = f'{directory}.old-{os.getpid()}'
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+    return manifest
+
+
+def load_bundle(directory, verify=False):
+    """以内存映射方式打开模型文件包并组装推荐器
+
+    数组用mmap_mode='c'（写时复制）打开：多个进程共享同一份页缓存，
+    某个进程增量更新时只复制被修改的页。默认只检查manifest、文件是否齐全及各数组的形状和类型，
+    不读取文件内容（worker启动时不必把整个文件包读一遍）；verify=True时另外校验每个文件的sha256
+    """
+    manifest = verify_bundle(directory) if verify else read_manifest(directory)
+    arrays = {}
+    for name, info in manifest['arrays'].items():
+        path = os.path.join(directory, info['file'])
+        if not os.path.exists(path):
+            raise BundleError(f"模型文件包缺少文件：{info['file']}")
+        try:
+            # 文件被截断或头部损坏时np.load抛出ValueError/OSError，统一视为文件包不可用
+            array = np.load(path, mmap_mode='c', allow_pickle=False)
+        except (ValueError, OSError) as e:
+            raise BundleError(f"模型文件无法读取：{info['file']}（{e}）") from e
+        if list(array.shape) != info['shape'] or str(array.dtype) != info['dtype']:
+            raise BundleError(f"模型文件形状或类型与manifest不符：{info['file']}")
+        arrays[name] = array
+
+    meta = manifest['meta']
+    le_movie = LabelEncoder()
+    le_movie.classes_ = arrays['movie_ids']
+
+    recommender = RecommenderSystem.__new__(RecommenderSystem)
+    state = {
+        'ratings': None,  # 文件包中不保存原始评分DataFrame，评分矩阵即完整数据
+        'movie_features': _load_sparse(arrays, 'movie_features', scipy.sparse.csr_matrix),
+        'le_movie': le_movie,
+        'model_version': manifest['model_version'],
+        'user_item_matrix': _load_sparse(arrays, 'user_item', scipy.sparse.csr_matrix),
+        'item_user_matrix': _load_sparse(arrays, 'item_user', scipy.sparse.csc_matrix),
+        'user_mask': arrays['user_mask'],
+        'item_mask': arrays['item_mask'],
+        'n_base_users': meta['n_base_users'],
+        'item_neighbors': _load_index(arrays, 'item_neighbors'),
+        'content_neighbors': _load_index(arrays, 'content_neighbors'),
+        'content_index': None,
+        'factor_model': None,
+        'n_workers': meta['n_workers'],
+        'component_timeout': meta['component_timeout'],
+        '_executor': None,
+        '_user_norms': None,
+        '_popular_movies': None,
+        '_pending_neighbor_items': [],
+    }
+    if 'content_index' in meta:
+        state['content_index'] = IVFIndex.from_arrays(arrays, 'content_index', meta['content_index'])
+    if 'factor_model' in meta:
+        params = meta['factor_model']
+        factor_model = FACTOR_MODELS[params['type']](**params['params'])
+        if hasattr(factor_model, 'global_mean'):
+            factor_model.global_mean = params['global_mean']
+        factor_model.user_factors = arrays['factors.user']
+        factor_model.components = arrays['factors.components']
+        factor_model.n_train_ratings = params['n_train_ratings']
+        factor_model.n_folded_ratings = params['n_folded_ratings']
+        factor_model.fold_seq = params['fold_seq']
+        factor_model.folded_users = {int(u): int(seq) for u, seq in arrays['factors.folded_users']}
+        if 'item_index' in params:
+            factor_model.item_index = IVFIndex.from_arrays(arrays, 'factors.item_index', params['item_index'])
+        state['factor_model'] = factor_model
+    recommender.__setstate__(state)
+    return recommender
+
+
+def verify_bundle(directory):
+    """完整校验模型文件包：逐个文件计算sha256并与manifest比对（保存后或显式检查时调用），返回manifest"""
+    manifest = read_manifest(directory)
+    for info in manifest['arrays'].values():
+        path = os.path.join(directory, info['file'])
+        if not os.path.exists(path):
+            raise BundleError(f"模型文件包缺少文件：{info['file']}")
+        if _sha256(path) != info['sha256']:
+            raise BundleError(f"模型文件校验失败：{info['file']}")
+    return manifest
+
+
+def read_manifest(directory):
+    """读取并检查manifest，格式或推荐器版本不符时抛出BundleError"""
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        raise BundleError(f"模型文件包不存在或不完整：{directory}")
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (ValueError, OSError) as e:
+        raise BundleError(f"模型文件包的manifest无法读取：{e}") from e
+    if manifest.get('format_version') != BUNDLE_FORMAT_VERSION:
+        raise BundleError(f"模型文件包格式版本不符：{manifest.get('format_version')}")
+    if manifest.get('model_version') != MODEL_VERSION:
+        raise BundleError(f"模型文件包的推荐器版本过旧：{manifest.get('model_version')}")
+    return manifest
+
+
+def _add_sparse(arrays, name, matrix):
+    arrays[f'{name}.data'] = matrix.data
+    arrays[f'{name}.indices'] = matrix.indices
+    arrays[f'{name}.indptr'] = matrix.indptr
+    arrays[f'{name}.shape'] = np.array(matrix.shape, dtype=np.int64)
+
+
+def _load_sparse(arrays, name, matrix_type):
+    if f'{name}.data' not in arrays:
+        return None
+    return matrix_type(
+        (arrays[f'{name}.data'], arrays[f'{name}.indices'], arrays[f'{name}.indptr']),
+        shape=tuple(int(n) for n in arrays[f'{name}.shape']),
+        copy=False
+    )
+
+
+def _load_index(arrays, name):
+    if f'{name}.indices' not in arrays:
+        return None
+    return NeighborIndex(arrays[f'{name}.indices'], arrays[f'{name}.scores'], np.asarray(arrays[f'{name}.signature']))
+
+
+def _sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,222 @@
+import numpy as np
+import scipy.sparse
+
+
+class NeighborIndex:
+    """物品近邻索引：为每个物品保存余弦相似度最高的K个物品（不含自身）
+
+    indices[i] / scores[i] 按相似度降序排列，只保存相似度>0的近邻，不足K个时用-1 / 0填充。
+    signature记录构建时输入矩阵的形状、非零元个数和内容校验和，用于加载时判断索引是否过期。
+    """
+
+    def __init__(self, indices, scores, signature=None):
+        self.indices = indices
+        self.scores = scores
+        self.signature = signature
+        self._norms = None  # 每个物品向量的L2范数，refresh时只重算变化的物品（不保存）
+        self._checksums = None  # 每个物品向量的校验和，同上
+
+    def __len__(self):
+        return self.indices.shape[0]
+
+    @property
+    def k(self):
+        return self.indices.shape[1]
+
+    @staticmethod
+    def matrix_signature(item_vectors):
+        """输入矩阵的签名：(行数, 列数, 非零元个数, 内容校验和)
+
+        校验和是各行校验和之和，只由非零元的行号、列号和数值决定：
+        矩阵前n行的签名等于只有这n行时的签名，可用来确认末尾追加物品时已有物品的向量没有变化
+        """
+        vectors = _as_csr(item_vectors)
+        return _signature(vectors, _row_checksums(vectors))
+
+    @classmethod
+    def build(cls, item_vectors, k=20, block_size=256):
+        """离线构建索引，item_vectors为 物品×特征 的稀疏矩阵（每行一个物品）"""
+        n_items = item_vectors.shape[0]
+        index = cls(
+            np.full((n_items, k), -1, dtype=np.int32),
+            np.zeros((n_items, k), dtype=np.float32)
+        )
+        vectors = _as_csr(item_vectors)
+        index._norms = _row_norms(vectors)
+        index._checksums = _row_checksums(vectors)
+        index.signature = _signature(vectors, index._checksums)
+        index._fill_rows(vectors, vectors.T.tocsr(), np.arange(n_items), block_size)
+        return index
+
+    def refresh(self, item_vectors, changed_items, block_size=256, item_vectors_t=None):
+        """增量刷新：只重算向量发生变化的物品，以及近邻列表会因此改变的物品
+
+        item_vectors_t为 特征×物品 的CSR矩阵（item_vectors的转置，如推荐器的user_item_matrix），
+        调用方已经维护时传入，避免每次刷新都转置整个矩阵。物品范数缓存在索引中，只重算changed_items，
+        （校验和同样），因此changed_items必须包含所有向量变化过的物品。返回被重新计算的物品下标
+        """
+        vectors = _as_csr(item_vectors)
+        n_items = vectors.shape[0]
+        changed = np.unique(np.asarray(changed_items, dtype=np.int64))
+
+        # 新增物品：扩展数组，新物品都需要计算
+        if n_items > len(self):
+            extra = n_items - len(self)
+            self.indices = np.vstack([self.indices, np.full((extra, self.k), -1, dtype=np.int32)])
+            self.scores = np.vstack([self.scores, np.zeros((extra, self.k), dtype=np.float32)])
+            changed = np.union1d(changed, np.arange(n_items - extra, n_items))
+        if self._norms is None or len(self._norms) != n_items:
+            self._norms = _row_norms(vectors)
+        elif len(changed):
+            self._norms[changed] = _row_norms(vectors[changed])
+        if self._checksums is None or len(self._checksums) != n_items:
+            self._checksums = _row_checksums(vectors)
+        elif len(changed):
+            self._checksums[changed] = _row_checksums(vectors, changed)
+        if len(changed) == 0:
+            self.signature = _signature(vectors, self._checksums)
+            return changed
+        vectors_t = vectors.T.tocsr() if item_vectors_t is None else item_vectors_t
+
+        # 受影响的物品：近邻列表里有变化物品，或变化物品的新相似度超过了当前第K个近邻
+        contains = np.isin(self.indices, changed).any(axis=1)
+        kth_score = np.where(self.indices[:, -1] >= 0, self.scores[:, -1], 0)
+        beats = np.zeros(n_items, dtype=bool)
+        for start in range(0, len(changed), block_size):
+            # 变化物品与所有物品之间的新相似度（代价与这些物品的特征所共现的非零元个数成正比，而不是整个矩阵）
+            block = changed[start:start + block_size]
+            sim = self._cosine(vectors[block] @ vectors_t, block)
+            sim[np.arange(len(block)), block] = 0
+            beats |= (sim > kth_score[np.newaxis, :]).any(axis=0)
+        affected = np.union1d(np.flatnonzero(contains | beats), changed)
+
+        self._fill_rows(vectors, vectors_t, affected, block_size)
+        self.signature = _signature(vectors, self._checksums)
+        return affected
+
+    def _cosine(self, dot, rows):
+        """rows对应物品与全部物品的内积（稀疏矩阵）除以两边的范数，得到稠密的余弦相似度"""
+        sim = dot.toarray()
+        denominator = self._norms[rows][:, np.newaxis] * self._norms[np.newaxis, :]
+        return np.divide(sim, denominator, out=np.zeros_like(sim), where=denominator > 0)
+
+    def _fill_rows(self, vectors, vectors_t, rows, block_size):
+        """分块计算rows对应物品与全部物品的相似度，写入top-K结果"""
+        k = self.k
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            sim = self._cosine(vectors[block] @ vectors_t, block)
+            sim[np.arange(len(block)), block] = -np.inf  # 排除自身
+            top = top_k_indices(sim, k)
+            top_scores = np.take_along_axis(sim, top, axis=1)
+            valid = top_scores > 0
+            self.indices[block] = np.where(valid, top, -1)
+            self.scores[block] = np.where(valid, top_scores, 0)
+
+    def aggregate(self, items, weights=None, n_neighbors=None, n_items=None):
+        """汇总items各自的前n_neighbors个近邻：每个近邻累加 相似度×weights
+
+        返回 (scores, is_candidate)，两个长度为n_items的数组，is_candidate标记至少被一个item选为近邻的物品
+        """
+        n_items = n_items or len(self)
+        neighbors = self.indices[items, :n_neighbors]
+        similarity = self.scores[items, :n_neighbors]
+        if weights is not None:
+            similarity = similarity * np.asarray(weights)[:, np.newaxis]
+        valid = neighbors >= 0
+        scores = np.bincount(neighbors[valid], weights=similarity[valid], minlength=n_items)
+        is_candidate = np.bincount(neighbors[valid], minlength=n_items) > 0
+        return scores, is_candidate
+
+    def aggregate_sparse(self, items, weights=None, n_neighbors=None):
+        """与aggregate相同的汇总，只返回被选为近邻的物品：(物品（升序）, 分数)
+
+        代价只与 len(items)×n_neighbors 有关，不随物品总数增长
+        """
+        neighbors = self.indices[items, :n_neighbors]
+        similarity = self.scores[items, :n_neighbors]
+        if weights is not None:
+            similarity = similarity * np.asarray(weights)[:, np.newaxis]
+        valid = neighbors >= 0
+        candidates, inverse = np.unique(neighbors[valid], return_inverse=True)
+        return candidates, np.bincount(inverse, weights=similarity[valid], minlength=len(candidates))
+
+    def to_sparse(self, n_neighbors=None, n_items=None):
+        """转换为 物品×物品 的稀疏相似度矩阵，每行只保留前n_neighbors个近邻"""
+        n_items = n_items or len(self)
+        indices = self.indices[:, :n_neighbors]
+        rows, cols = np.nonzero(indices >= 0)
+        return scipy.sparse.csr_matrix(
+            (self.scores[rows, cols].astype(np.float64), (rows, indices[rows, cols])),
+            shape=(n_items, n_items)
+        )
+
+    def save(self, path):
+        np.savez(path, indices=self.indices, scores=self.scores, signature=self.signature)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['indices'], data['scores'], data['signature'])
+
+
+def top_k_indices(scores, k):
+    """每行取分数最高的k个下标（argpartition部分排序），结果按分数降序、下标升序排列
+
+    第k名有并列时取下标较小的，与稳定排序 np.argsort(-scores, kind='stable')[:, :k] 结果一致
+    """
+    n_rows, n_cols = scores.shape
+    k = min(k, n_cols)
+    if k == 0:
+        return np.empty((n_rows, 0), dtype=np.int64)
+    if k < n_cols:
+        kth = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+        above = scores > kth[:, np.newaxis]
+        tied = scores == kth[:, np.newaxis]
+        n_tied_needed = k - above.sum(axis=1)
+        take = above | (tied & (np.cumsum(tied, axis=1) <= n_tied_needed[:, np.newaxis]))
+        top = np.nonzero(take)[1].reshape(n_rows, k)
+    else:
+        top = np.broadcast_to(np.arange(n_cols), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _as_csr(item_vectors):
+    """转换为float64的CSR矩阵，已经是时不复制（如CSC矩阵的转置）"""
+    return scipy.sparse.csr_matrix(item_vectors, dtype=np.float64)
+
+
+def _row_norms(vectors):
+    return np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+
+
+def _row_checksums(vectors, rows=None, block_size=65536):
+    """rows（默认全部行）各行的校验和：该行每个非零元 (行号, 列号, 数值) 的64位哈希之和（溢出回绕）"""
+    rows = np.arange(vectors.shape[0]) if rows is None else np.asarray(rows, dtype=np.int64)
+    checksums = np.zeros(len(rows), dtype=np.uint64)
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        part = vectors[block]
+        row_ids = np.repeat(block.astype(np.uint64), np.diff(part.indptr))
+        hashes = _mix64(row_ids * np.uint64(0x9E3779B97F4A7C15)
+                        ^ part.indices.astype(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F)
+                        ^ np.ascontiguousarray(part.data).view(np.uint64))
+        hashes[part.data == 0] = 0  # 显式存储的0不影响校验和
+        sums = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(hashes, dtype=np.uint64)])
+        checksums[start:start + len(block)] = sums[part.indptr[1:]] - sums[part.indptr[:-1]]
+    return checksums
+
+
+def _mix64(x):
+    """splitmix64的混合函数（逐元素，uint64溢出回绕）"""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _signature(vectors, checksums):
+    checksum = np.sum(checksums, dtype=np.uint64).view(np.int64)
+    return np.array([vectors.shape[0], vectors.shape[1], vectors.nnz, checksum], dtype=np.int64)
@@ -0,0 +1,69 @@
+import threading
+
+import numpy as np
+
+
+class PopularityIndex:
+    """按评分次数排序的电影热度榜
+
+    counts[m]: 编码后电影m的评分次数；meta_rows[m]: 电影m在电影元数据表(movies_df)中的行号，没有元数据时为-1。
+    order按评分次数降序保存有元数据的电影，rank是order的反向映射；前n_ranked个是有评分的电影。
+    分页只需切片order，新增评分时O(log n)调整位置，不需要重新排序。
+    """
+
+    def __init__(self, counts, meta_rows):
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.meta_rows = np.asarray(meta_rows, dtype=np.int32)
+        catalogue = np.flatnonzero(self.meta_rows >= 0)
+        self.order = catalogue[np.argsort(-self.counts[catalogue], kind='stable')]
+        self.rank = np.full(len(self.counts), -1, dtype=np.int64)
+        self.rank[self.order] = np.arange(len(self.order))
+        self.n_ranked = int(np.count_nonzero(self.counts[self.order]))
+        self._sorted_neg_counts = -self.counts[self.order]  # 按order排列的评分次数取负（升序，供二分查找）
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_ratings(cls, movie_ids, movies_df, le_movie):
+        """由评分数据中的电影列（编码后的movieId）和电影元数据表构建"""
+        n_movies = len(le_movie.classes_)
+        counts = np.bincount(np.asarray(movie_ids, dtype=np.int64), minlength=n_movies)
+
+        # 元数据表中每部电影的编码ID（用searchsorted代替逐个transform）
+        original_ids = movies_df['movieId'].to_numpy()
+        encoded = np.searchsorted(le_movie.classes_, original_ids)
+        known = encoded < n_movies
+        known[known] = le_movie.classes_[encoded[known]] == original_ids[known]
+        meta_rows = np.full(len(counts), -1, dtype=np.int32)
+        meta_rows[encoded[known]] = np.flatnonzero(known)
+        return cls(counts, meta_rows)
+
+    def __len__(self):
+        return self.n_ranked
+
+    def page(self, start, end):
+        """第start到end名的电影（编码后的movieId）及评分次数"""
+        end = min(end, self.n_ranked)
+        movies = self.order[start:end] if start < end else self.order[:0]
+        return movies, self.counts[movies]
+
+    def increment(self, movie):
+        """电影新增一条评分：与同分段最靠前的电影交换位置后加一，保持降序"""
+        if movie < 0 or movie >= len(self.counts):
+            return
+        with self._lock:
+            position = self.rank[movie]
+            if position < 0:
+                # 没有元数据的电影不参与排名，只记录次数
+                self.counts[movie] += 1
+                return
+
+            count = self.counts[movie]
+            # 降序数组中第一个评分次数等于count的位置
+            first = int(np.searchsorted(self._sorted_neg_counts, -count, side='left'))
+            other = self.order[first]
+            self.order[first], self.order[position] = movie, other
+            self.rank[movie], self.rank[other] = first, position
+            self.counts[movie] = count + 1
+            self._sorted_neg_counts[first] = -(count + 1)
+            if count == 0:
+                self.n_ranked += 1
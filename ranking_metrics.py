@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def ranking_metrics(users, scores, relevant, k=10):
+    """按用户分组排序，向量化计算每个用户的 precision@k、recall@k、NDCG@k 和 MAP@k
+
+    users / scores / relevant 为等长的一维数组，每个元素是一个(用户, 电影)对：预测分数和是否相关（如真实评分>=4）。
+    每个用户按分数降序取前k个；precision的分母为 min(k, 该用户的电影数)。没有相关电影的用户不参与评估。
+    返回 {'users', 'precision', 'recall', 'ndcg', 'map'}，每项为按用户升序排列的数组
+    """
+    users = np.asarray(users)
+    scores = np.asarray(scores, dtype=np.float64)
+    relevant = np.asarray(relevant, dtype=np.float64)
+
+    # 先按用户、再按分数降序排列，rank为组内名次（从0开始）
+    order = np.lexsort((-scores, users))
+    relevant = relevant[order]
+    unique_users, starts, counts = np.unique(users[order], return_index=True, return_counts=True)
+    group = np.repeat(np.arange(len(unique_users)), counts)
+    rank = np.arange(len(order)) - np.repeat(starts, counts)
+    hit = relevant * (rank < k)
+
+    n_groups = len(unique_users)
+    n_relevant = np.bincount(group, weights=relevant, minlength=n_groups)
+    hits = np.bincount(group, weights=hit, minlength=n_groups)
+
+    # DCG：命中位置的 1/log2(名次+2)；理想DCG为前 min(相关数, k) 个位置全部命中
+    discounts = 1 / np.log2(np.arange(k) + 2)
+    dcg = np.bincount(group, weights=hit / np.log2(rank + 2), minlength=n_groups)
+    ideal_dcg = np.concatenate([[0], np.cumsum(discounts)])[np.minimum(n_relevant, k).astype(np.int64)]
+
+    # AP：每个命中位置的 precision@名次 之和 / min(相关数, k)
+    cumulative = np.cumsum(relevant)
+    hits_so_far = cumulative - np.repeat(cumulative[starts] - relevant[starts], counts)
+    precision_sum = np.bincount(group, weights=hit * hits_so_far / (rank + 1), minlength=n_groups)
+
+    valid = n_relevant > 0
+    n_relevant, hits = n_relevant[valid], hits[valid]
+    return {
+        'users': unique_users[valid],
+        'precision': hits / np.minimum(counts[valid], k),
+        'recall': hits / n_relevant,
+        'ndcg': dcg[valid] / ideal_dcg[valid],
+        'map': precision_sum[valid] / np.minimum(n_relevant, k),
+    }
+
+
+def mean_ranking_metrics(users, scores, relevant, k=10):
+    """各用户指标的平均值，列名如 'Precision@10'，用于结果表"""
+    metrics = ranking_metrics(users, scores, relevant, k)
+    names = {'precision': 'Precision', 'recall': 'Recall', 'ndcg': 'NDCG', 'map': 'MAP'}
+    return {
+        f'{label}@{k}': float(metrics[name].mean()) if len(metrics['users']) else 0.0
+        for name, label in names.items()
+    }
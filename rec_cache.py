@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RecommendationCache:
+    """按用户缓存推荐结果的LRU缓存
+
+    最多保存max_size个用户，超出时淘汰最久未使用的；条目超过ttl秒后视为过期。
+    每个用户有一个版本号，invalidate时加一（clear时整个缓存的版本加一）：在查缓存时取得版本号，
+    计算完成后连同版本号一起set，期间缓存被失效过则不写回，避免把按旧评分算出的结果写进缓存
+    """
+
+    def __init__(self, max_size=1024, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (写入时间, 推荐结果)
+        self._generations = {}  # user_id -> 失效次数（只记录失效过的用户）
+        self._epoch = 0  # clear的次数
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """命中返回缓存的推荐结果，未命中或已过期返回None"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def generation(self, user_id):
+        """用户缓存的当前版本号，在计算推荐结果之前取得，计算完成后传给set"""
+        with self._lock:
+            return self._epoch, self._generations.get(user_id, 0)
+
+    def set(self, user_id, recommendations, generation=None):
+        """写入缓存，返回是否写入；给出generation且取得之后该用户的缓存被失效或整个缓存被清空时不写入"""
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(user_id, 0)):
+                return False
+            self._entries[user_id] = (time.monotonic(), recommendations)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return True
+
+    def invalidate(self, user_id):
+        """用户评分变化后删除其缓存，并使之前取得的版本号失效"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
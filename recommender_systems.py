@@ -1,233 +1,904 @@
 import numpy as np
 import pandas as pd
 import scipy.sparse
-import joblib
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
 from surprise import Dataset, Reader, KNNBasic, SVD
-from surprise.model_selection import cross_validate, train_test_split
+from surprise.model_selection import KFold
+import concurrent.futures
+import os
+import threading
+import time
 import warnings
+from collections import namedtuple
+
+import data_registry
+import instrumentation
+from ann_index import IVFIndex
+from factor_model import FACTOR_MODELS
+from neighbor_index import NeighborIndex, top_k_indices
+from ranking_metrics import mean_ranking_metrics
 
 warnings.filterwarnings('ignore')
 
-# 加载处理后的数据
-full_data = pd.read_csv('data/processed/full_data.csv')
-tfidf_matrix = scipy.sparse.load_npz('data/processed/tfidf_matrix.npz')
-le_user = joblib.load('data/processed/le_user.pkl')
-le_movie = joblib.load('data/processed/le_movie.pkl')
-tfidf = joblib.load('data/processed/tfidf_vectorizer.pkl')
 
-# 在recommender_systems.py已有导入下方添加
-le_movie = joblib.load('data/processed/le_movie.pkl')  # 加载电影ID编码器
+# 处理后的数据（full_data、tfidf_matrix、le_user、le_movie、tfidf）不在导入时加载，
+# 访问 recommender_systems.full_data 等属性时由data_registry首次加载并在各模块间共享
+def __getattr__(name):
+    if name in data_registry.registry:
+        return data_registry.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# 推荐器数据结构版本，结构变化后旧的pickle需要重建
+MODEL_VERSION = 5
+
 
 class RecommenderSystem:
-    def __init__(self, ratings_data, movie_features, le_movie):
+    def __init__(self, ratings_data, movie_features, le_movie, item_neighbors=None, content_neighbors=None,
+                 n_workers=4, component_timeout=None, n_base_users=None):
         self.ratings = ratings_data
         self.movie_features = movie_features
         self.le_movie = le_movie
-        self.user_item_matrix = self._create_user_item_matrix()  # 初始化用户-物品矩阵
+        self.model_version = MODEL_VERSION
+        self.user_item_matrix = self._create_user_item_matrix()  # 初始化用户-物品稀疏矩阵（CSR，按用户取行）
+        self.item_user_matrix = self.user_item_matrix.tocsc()  # 同一矩阵的CSC副本（按电影取列）
+        # 有评分记录的用户/电影（对应原来pivot的行索引/列索引）
+        self.user_mask = np.diff(self.user_item_matrix.indptr) > 0
+        self.item_mask = np.diff(self.item_user_matrix.indptr) > 0
+        # 离线数据集中的用户数，在线用户排在其后；ratings_data中已包含在线用户的评分时需显式传入
+        self.n_base_users = self.user_item_matrix.shape[0] if n_base_users is None else n_base_users
+        self.item_neighbors = item_neighbors  # 物品近邻索引，未提供时在首次使用时构建
+        self.content_neighbors = content_neighbors  # 基于TF-IDF的电影内容近邻索引
+        self.content_index = None  # 归一化TF-IDF上的ANN索引（build_content_index），用于近似构建内容近邻
+        self.factor_model = None  # 因子模型（默认ALS），训练一次后缓存并随推荐器一起保存
+        self.n_workers = n_workers  # 混合推荐并行计算组件的线程数
+        self.component_timeout = component_timeout  # 单个推荐组件的超时时间（秒），None表示一直等待
+        self._retrain_lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self._executor = None
+        self._user_norms = None  # 每个用户评分向量的L2范数（余弦相似度的分母），首次使用时计算
+        self._popular_movies = None  # 按评分次数降序的电影，首次使用时计算，评分次数变化后失效
+        self._pending_neighbor_items = []  # 评分变化、物品近邻尚未刷新的电影（refresh_pending_item_neighbors在后台处理）
+
+    def __getstate__(self):
+        # 近邻索引单独保存为npz文件，不随推荐器一起pickle；锁和线程池不能pickle
+        state = self.__dict__.copy()
+        state['item_neighbors'] = None
+        state['content_neighbors'] = None
+        del state['_retrain_lock']
+        del state['_update_lock']
+        state['_executor'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._retrain_lock = threading.Lock()
+        self._update_lock = threading.Lock()
 
     def _create_user_item_matrix(self):
-        """创建用户-物品评分矩阵"""
-        return self.ratings.pivot(index='userId', columns='movieId', values='rating').fillna(0)
+        """创建用户-物品评分矩阵（scipy稀疏矩阵，行/列下标即编码后的userId/movieId）"""
+        ratings = self.ratings.drop_duplicates(subset=['userId', 'movieId'], keep='last')
+        user_idx = ratings['userId'].to_numpy(dtype=np.int64)
+        movie_idx = ratings['movieId'].to_numpy(dtype=np.int64)
+        n_users = int(user_idx.max()) + 1 if len(user_idx) else 0
+        n_movies = len(self.le_movie.classes_)
+        if len(movie_idx):
+            n_movies = max(n_movies, int(movie_idx.max()) + 1)
+        matrix = scipy.sparse.csr_matrix(
+            (ratings['rating'].to_numpy(dtype=np.float64), (user_idx, movie_idx)),
+            shape=(n_users, n_movies)
+        )
+        matrix.sort_indices()
+        return matrix
+
+    def update_user_ratings(self, user_id, ratings):
+        """增量写入一个用户新增/修改的评分，不重建推荐器
+
+        ratings为 {编码后的movieId: 评分}。更新稀疏评分矩阵和该用户的因子fold-in，
+        代价与变化的评分数成正比（新增元素时稀疏矩阵的下标数组会整体拷贝一次）。
+        变化的电影记入待刷新列表，物品近邻由refresh_pending_item_neighbors在请求之外（后台线程）刷新。
+        self.ratings保留离线训练数据，不随之更新。返回实际发生变化的电影
+        """
+        if not ratings:
+            return np.array([], dtype=np.int64)
+        movies = np.fromiter(ratings.keys(), dtype=np.int64, count=len(ratings))
+        values = np.fromiter(ratings.values(), dtype=np.float64, count=len(ratings))
+        if movies.min() < 0 or movies.max() >= self.user_item_matrix.shape[1]:
+            raise ValueError("部分电影ID不在评分矩阵中")
+
+        with self._update_lock:
+            # 新用户：扩展矩阵行数
+            n_users, n_movies = self.user_item_matrix.shape
+            if user_id >= n_users:
+                user_item_matrix = self.user_item_matrix.copy()
+                user_item_matrix.resize((user_id + 1, n_movies))
+                item_user_matrix = self.item_user_matrix.copy()
+                item_user_matrix.resize((user_id + 1, n_movies))
+                self.user_item_matrix, self.item_user_matrix = user_item_matrix, item_user_matrix
+                self.user_mask = np.concatenate([self.user_mask, np.zeros(user_id + 1 - n_users, dtype=bool)])
+
+            # 只保留评分确实变化的电影
+            start, end = self.user_item_matrix.indptr[user_id], self.user_item_matrix.indptr[user_id + 1]
+            row_movies = self.user_item_matrix.indices[start:end]
+            row_values = self.user_item_matrix.data[start:end]
+            positions = np.searchsorted(row_movies, movies)
+            found = positions < len(row_movies)
+            found[found] = row_movies[positions[found]] == movies[found]
+            current = np.zeros(len(movies))
+            current[found] = row_values[positions[found]]
+            changed = values != current
+            added = (~found)[changed].any()
+            movies, values = movies[changed], values[changed]
+            if len(movies) == 0:
+                return movies
+
+            users = np.full(len(movies), user_id, dtype=np.int64)
+            self.user_item_matrix = _assign_compressed(self.user_item_matrix, users, movies, values)
+            self.item_user_matrix = _assign_compressed(self.item_user_matrix, movies, users, values)
+            self.user_mask[user_id] = True
+            self.item_mask[movies] = True
+            self._update_user_norm(user_id)
+            if added:
+                self._popular_movies = None  # 评分次数变化，热门电影重新排序
+            if self.item_neighbors is not None:
+                self._pending_neighbor_items.append(movies)
+
+            self.fold_in_user(user_id, n_changed=len(movies))
+        return movies
+
+    def _user_context(self, user_id):
+        """一次性取出各推荐方法共用的用户数据，用户不存在时与原pivot的.loc一样抛出KeyError
+
+        已评分电影直接取自CSR行（升序），作为已看集合用二分查找排除，不展开成长度为电影数的稠密向量
+        """
+        if not 0 <= user_id < self.user_item_matrix.shape[0] or not self.user_mask[user_id]:
+            raise KeyError(user_id)
+        start, end = self.user_item_matrix.indptr[user_id], self.user_item_matrix.indptr[user_id + 1]
+        movies = self.user_item_matrix.indices[start:end].astype(np.int64)
+        values = np.asarray(self.user_item_matrix.data[start:end])
+        rated = values > 0
+        return UserContext(
+            user_id=user_id,
+            rated_movies=movies[rated],
+            rated_values=values[rated],
+            liked_movies=movies[rated & (values >= 4)]
+        )
 
-    def user_based_cf(self, user_id, n_recommendations=10):
+    def _get_user_norms(self):
+        if self._user_norms is None:
+            squared = self.user_item_matrix.multiply(self.user_item_matrix)
+            self._user_norms = np.sqrt(np.asarray(squared.sum(axis=1)).ravel())
+        return self._user_norms
+
+    def _update_user_norm(self, user_id):
+        """评分变化后更新该用户的范数（新用户时扩展数组，已有的读者继续使用旧数组）"""
+        if self._user_norms is None:
+            return
+        norms = self._user_norms
+        if user_id >= len(norms):
+            norms = np.concatenate([norms, np.zeros(self.user_item_matrix.shape[0] - len(norms))])
+        start, end = self.user_item_matrix.indptr[user_id], self.user_item_matrix.indptr[user_id + 1]
+        norms[user_id] = np.sqrt(np.sum(np.square(self.user_item_matrix.data[start:end])))
+        self._user_norms = norms
+
+    def popular_movies(self, n):
+        """评分次数最多的n部电影（编码后的movieId）"""
+        if self._popular_movies is None:
+            counts = np.diff(self.item_user_matrix.indptr)
+            self._popular_movies = np.argsort(-counts, kind='stable')[:np.count_nonzero(counts)]
+        return self._popular_movies[:n]
+
+    def user_based_cf(self, user_id, n_recommendations=10, n_neighbors=10):
         """基于用户的协同过滤推荐"""
-        # 计算用户相似度
-        user_similarity = cosine_similarity(self.user_item_matrix)
-        user_similarity_df = pd.DataFrame(
-            user_similarity,
-            index=self.user_item_matrix.index,
-            columns=self.user_item_matrix.index
+        return _as_pairs(*self._user_cf_scores(self._user_context(user_id), n_recommendations, n_neighbors))
+
+    def _similar_users(self, context, n_neighbors):
+        """与目标用户余弦相似度最高的n_neighbors个用户及相似度
+
+        只有与目标用户评过同一部电影的用户相似度才大于0，从目标用户已评分电影的列中取出这些用户计算，
+        代价与这些列的评分数成正比，而不是整个评分矩阵
+        """
+        co_ratings = self.item_user_matrix[:, context.rated_movies].tocoo()
+        users, inverse = np.unique(co_ratings.row, return_inverse=True)
+        dot = np.bincount(inverse, weights=co_ratings.data * context.rated_values[co_ratings.col],
+                          minlength=len(users))
+        norms = self._get_user_norms()
+        target_norm = np.sqrt(np.sum(np.square(context.rated_values)))
+        similarity = _round_scores(np.divide(dot, target_norm * norms[users], out=np.zeros(len(users)),
+                                             where=norms[users] > 0))
+        keep = (users != context.user_id) & self.user_mask[users] & (similarity > 0)
+        users, similarity = users[keep], similarity[keep]
+
+        # 部分排序(argpartition)找到相似用户
+        top = top_k_indices(similarity[np.newaxis, :], n_neighbors)[0]
+        return users[top], similarity[top]
+
+    def _user_cf_scores(self, context, n_recommendations, n_neighbors=10):
+        similar_users, similar_scores = self._similar_users(context, n_neighbors)
+
+        # 相似用户评过分的电影：按电影汇总 加权评分和 与 相似度和
+        neighbor_ratings = self.user_item_matrix[similar_users].tocoo()
+        movies, inverse = np.unique(neighbor_ratings.col, return_inverse=True)
+        weights = similar_scores[neighbor_ratings.row]
+        weighted_sum = np.bincount(inverse, weights=neighbor_ratings.data * weights, minlength=len(movies))
+        sim_sum = np.bincount(inverse, weights=(neighbor_ratings.data > 0) * weights, minlength=len(movies))
+
+        # 候选：用户未评分、且有相似用户评过分的电影
+        keep = self.item_mask[movies] & ~_is_seen(movies, context.rated_movies) & (sim_sum > 0)
+        predicted = _round_scores(weighted_sum[keep] / sim_sum[keep])
+
+        # 按预测评分排序并返回前n个推荐
+        return _top_n(movies[keep], predicted, n_recommendations)
+
+    def build_item_neighbors(self, k=20):
+        """离线构建物品近邻索引（物品向量为评分矩阵的列）"""
+        self.item_neighbors = NeighborIndex.build(self.item_user_matrix.T, k=k)
+        return self.item_neighbors
+
+    def refresh_item_neighbors(self, changed_movies):
+        """评分列发生变化后，只刷新受影响电影的近邻"""
+        if self.item_neighbors is None:
+            return self.build_item_neighbors()
+        # 物品向量即CSC矩阵的列：转置为CSR不需要复制，其转置就是已有的user_item_matrix
+        self.item_neighbors.refresh(self.item_user_matrix.T, changed_movies, item_vectors_t=self.user_item_matrix)
+        return self.item_neighbors
+
+    def refresh_pending_item_neighbors(self):
+        """刷新update_user_ratings积累的评分变化电影的近邻，返回这些电影
+
+        由后台线程（ModelRefresher的maintain）定期调用，不在处理评分的请求中执行
+        """
+        with self._update_lock:
+            pending, self._pending_neighbor_items = self._pending_neighbor_items, []
+            item_user_matrix, user_item_matrix = self.item_user_matrix, self.user_item_matrix
+        if not pending or self.item_neighbors is None:
+            return np.array([], dtype=np.int64)
+        changed = np.unique(np.concatenate(pending))
+        self.item_neighbors.refresh(item_user_matrix.T, changed, item_vectors_t=user_item_matrix)
+        return changed
+
+    def item_based_cf(self, user_id, n_recommendations=10, n_neighbors=10):
+        """基于物品的协同过滤推荐（使用预计算的物品近邻索引）"""
+        return _as_pairs(*self._item_cf_scores(self._user_context(user_id), n_recommendations, n_neighbors))
+
+    def _item_cf_scores(self, context, n_recommendations, n_neighbors=10):
+        if self.item_neighbors is None:
+            self.build_item_neighbors()
+
+        # 取出每部已评分电影的前n_neighbors个近邻，按 相似度×评分 累加
+        candidates, scores = self.item_neighbors.aggregate_sparse(
+            context.rated_movies, weights=context.rated_values, n_neighbors=n_neighbors
+        )
+        keep = ~_is_seen(candidates, context.rated_movies)
+
+        # 按加权评分排序并返回前n个推荐
+        return _top_n(candidates[keep], scores[keep], n_recommendations)
+
+    def fit_factor_model(self, n_components=20, method='als', **params):
+        """训练因子模型并缓存
+
+        method为 'als'（只在观测到的评分上训练的ALS，带偏置项）或 'svd'（原来的TruncatedSVD），params传给模型构造函数
+        """
+        if method not in FACTOR_MODELS:
+            raise ValueError(f"未知的因子模型：{method}")
+        self.factor_model = FACTOR_MODELS[method](n_components=n_components, **params).fit(self.user_item_matrix)
+        return self.factor_model
+
+    def fold_in_user(self, user_id, n_changed=None):
+        """新用户或评分变化的用户：用当前评分行折叠进因子模型，不重新训练
+
+        漂移超过阈值时在后台线程重新训练
+        """
+        if self.factor_model is None:
+            self.fit_factor_model()
+        self.factor_model.fold_in(user_id, self.user_item_matrix[user_id], n_changed)
+        if self.factor_model.needs_retrain():
+            self.retrain_factor_model_async()
+
+    def retrain_factor_model_async(self):
+        """后台重新训练因子模型，训练完成后整体替换；已有训练在进行时直接返回
+
+        新模型以旧模型的因子热启动（ALS），通常几轮即可收敛
+        """
+        if not self._retrain_lock.acquire(blocking=False):
+            return None
+
+        def retrain(old_model, matrix, start_seq):
+            try:
+                new_model = type(old_model)(**old_model.get_params()).fit(matrix, warm_start=old_model)
+                if old_model.item_index is not None:
+                    new_model.build_item_index(**old_model.item_index.get_params())
+                # 训练期间又发生变化的用户，在新模型上重新fold-in
+                for user_id, seq in list(old_model.folded_users.items()):
+                    if seq > start_seq:
+                        new_model.fold_in(user_id, self.user_item_matrix[user_id])
+                self.factor_model = new_model
+            finally:
+                self._retrain_lock.release()
+
+        thread = threading.Thread(
+            target=retrain,
+            args=(self.factor_model, self.user_item_matrix.copy(), self.factor_model.fold_seq),
+            daemon=True
         )
+        thread.start()
+        return thread
 
-        # 找到相似用户
-        similar_users = user_similarity_df[user_id].sort_values(ascending=False)[1:11]
+    def build_factor_index(self, **params):
+        """在电影因子上构建ANN索引（params传给IVFIndex），之后矩阵分解推荐用近似检索代替对全部电影打分"""
+        if self.factor_model is None:
+            self.fit_factor_model()
+        return self.factor_model.build_item_index(**params)
 
-        # 生成推荐
-        user_ratings = self.user_item_matrix.loc[user_id]
-        unrated_movies = user_ratings[user_ratings == 0].index
+    def matrix_factorization(self, user_id, n_recommendations=10, n_components=20):
+        """基于矩阵分解的推荐"""
+        movies, _ = self._mf_scores(self._user_context(user_id), n_recommendations, n_components)
+        return movies.tolist()
+
+    def _mf_scores(self, context, n_recommendations, n_components=20, candidates=None):
+        """candidates为None时对全部电影预测；给出候选电影（升序）时只计算这些电影的预测评分"""
+        # 只在第一次使用（或维度变化）时训练，之后复用缓存的因子
+        if self.factor_model is None or self.factor_model.n_components != n_components:
+            self.fit_factor_model(n_components)
+
+        item_index = self.factor_model.item_index
+        if candidates is None and item_index is not None:
+            # 近似检索预测评分最高的电影，多取已评分电影的个数以便排除后仍够n个
+            indices, predictions = item_index.search(
+                self.factor_model.user_factors[context.user_id],
+                n_recommendations + len(context.rated_movies)
+            )
+            found = indices[0] >= 0
+            candidates, predictions = indices[0][found], predictions[0][found]
+            order = np.argsort(candidates)  # 按电影下标排列，分数并列时与精确检索的顺序一致
+            candidates, predictions = candidates[order], predictions[order]
+        elif candidates is None:
+            # 预测评分：用户因子 × 电影因子
+            user_predictions = self.factor_model.predict(context.user_id)
+            candidates = np.flatnonzero(self.item_mask)
+            predictions = user_predictions[candidates]
+        else:
+            predictions = self.factor_model.user_factors[context.user_id] @ \
+                self.factor_model.components[:, candidates]
+
+        # 排除已评分电影和没有任何评分的电影
+        keep = self.item_mask[candidates] & ~_is_seen(candidates, context.rated_movies)
+        return _top_n(candidates[keep], predictions[keep], n_recommendations)
+
+    def build_content_index(self, **params):
+        """在按行归一化的TF-IDF上构建ANN索引（params传给IVFIndex），内积即余弦相似度"""
+        if self.movie_features is None:
+            raise ValueError("未提供电影特征数据")
+        self.content_index = IVFIndex(**params).fit(normalize(scipy.sparse.csr_matrix(self.movie_features)))
+        return self.content_index
 
-        recommendations = {}
-        for movie in unrated_movies:
-            movie_ratings = self.user_item_matrix[movie]
-            weighted_sum = 0
-            sim_sum = 0
+    def build_content_neighbors(self, k=20, approximate=False, block_size=1024):
+        """离线构建电影内容近邻索引（电影向量为tfidf_matrix的行）
 
-            for similar_user, similarity in similar_users.items():
-                rating = movie_ratings.loc[similar_user]
-                if rating > 0:
-                    weighted_sum += similarity * rating
-                    sim_sum += similarity
+        approximate=True时用content_index近似检索每部电影的近邻（未构建时先用默认参数构建），
+        代价不再随电影数平方增长，适合大目录
+        """
+        if self.movie_features is None:
+            raise ValueError("未提供电影特征数据")
+        if not approximate:
+            self.content_neighbors = NeighborIndex.build(self.movie_features, k=k)
+            return self.content_neighbors
+
+        if self.content_index is None:
+            self.build_content_index()
+        vectors = normalize(scipy.sparse.csr_matrix(self.movie_features))
+        n_movies = vectors.shape[0]
+        indices = np.full((n_movies, k), -1, dtype=np.int32)
+        scores = np.zeros((n_movies, k), dtype=np.float32)
+        for start in range(0, n_movies, block_size):
+            block = np.arange(start, min(start + block_size, n_movies))
+            # 多取一个以便去掉电影自身，只保留相似度>0的近邻（与NeighborIndex.build一致）
+            found, similarity = self.content_index.search(vectors[block], k + 1)
+            valid = (found != block[:, np.newaxis]) & (found >= 0) & (similarity > 0)
+            for row, movie in enumerate(block):
+                neighbors = found[row][valid[row]][:k]
+                indices[movie, :len(neighbors)] = neighbors
+                scores[movie, :len(neighbors)] = similarity[row][valid[row]][:k]
+        self.content_neighbors = NeighborIndex(indices, scores, NeighborIndex.matrix_signature(self.movie_features))
+        return self.content_neighbors
 
-            if sim_sum > 0:
-                recommendations[movie] = weighted_sum / sim_sum
+    def content_based(self, user_id, n_recommendations=10):
+        if self.movie_features is None:
+            raise ValueError("未提供电影特征数据")
 
-        # 按预测评分排序并返回前n个推荐
-        return sorted(recommendations.items(), key=lambda x: x[1], reverse=True)[:n_recommendations]
-
-    def item_based_cf(self, user_id, n_recommendations=10):
-        """基于物品的协同过滤推荐"""
-        # 计算物品相似度
-        item_similarity = cosine_similarity(self.user_item_matrix.T)
-        item_similarity_df = pd.DataFrame(
-            item_similarity,
-            index=self.user_item_matrix.columns,
-            columns=self.user_item_matrix.columns
-        )
+        # 获取用户喜欢的电影（使用编码后的movieId），排除用户评过分的所有电影
+        return _as_pairs(*self._user_content_scores(self._user_context(user_id), n_recommendations))
 
-        # 获取用户已评分的电影及评分
-        user_ratings = self.user_item_matrix.loc[user_id]
-        rated_movies = user_ratings[user_ratings > 0].index
+    def content_scores(self, liked_movies, n_recommendations=10, n_neighbors=10, seen_movies=None):
+        """根据喜欢的电影（编码后的movieId）汇总内容近邻，返回 [(movieId, 相似度和)]
 
-        # 生成推荐
-        recommendations = {}
-        for movie, rating in user_ratings[rated_movies].items():
-            similar_items = item_similarity_df[movie].sort_values(ascending=False)[1:11]
+        喜欢的电影和seen_movies（如用户已评分的其他电影）都不会出现在结果中
+        """
+        return _as_pairs(*self._content_scores(liked_movies, n_recommendations, n_neighbors, seen_movies))
 
-            for similar_movie, similarity in similar_items.items():
-                if similar_movie not in rated_movies:
-                    if similar_movie not in recommendations:
-                        recommendations[similar_movie] = 0
-                    recommendations[similar_movie] += similarity * rating
+    def _user_content_scores(self, context, n_recommendations, n_neighbors=10):
+        return self._content_scores(context.liked_movies, n_recommendations, n_neighbors, context.rated_movies)
 
-        # 按加权评分排序排序并返回前n个推荐
-        return sorted(recommendations.items(), key=lambda x: x[1], reverse=True)[:n_recommendations]
+    def _content_scores(self, liked_movies, n_recommendations, n_neighbors=10, seen_movies=None):
+        if len(liked_movies) == 0:
+            return _EMPTY_SCORES
+
+        # tfidf_matrix的行与le_movie.classes_一一对应，编码后的movieId即特征矩阵的行号
+        total_movies = self.movie_features.shape[0]
+        if len(self.le_movie.classes_) != total_movies:
+            raise ValueError(f"电影特征矩阵行数（{total_movies}）与le_movie中的电影数（{len(self.le_movie.classes_)}）不匹配")
+
+        liked_indices = np.unique(np.asarray(liked_movies, dtype=np.int64))
+        liked_indices = liked_indices[(liked_indices >= 0) & (liked_indices < total_movies)]
+        if len(liked_indices) == 0:
+            return _EMPTY_SCORES
+
+        if self.content_neighbors is None:
+            self.build_content_neighbors()
+
+        # 取出每部喜欢电影的前n_neighbors个内容近邻，累加相似度
+        candidates, scores = self.content_neighbors.aggregate_sparse(liked_indices, n_neighbors=n_neighbors)
+        keep = ~_is_seen(candidates, liked_indices)
+        if seen_movies is not None:
+            keep &= ~_is_seen(candidates, np.unique(np.asarray(seen_movies, dtype=np.int64)))
+        return _top_n(candidates[keep], scores[keep], n_recommendations)
+
+    def hybrid_recommender(self, user_id, n_recommendations=10, weights=[0.3, 0.3, 0.2, 0.2], timeout=None,
+                           n_candidates_per_source=100):
+        """混合推荐系统（两阶段：候选生成 + 在候选上重新打分）
+
+        第一阶段由用户协同过滤、物品近邻、内容近邻、热门电影（有因子ANN索引时还有矩阵分解的近似检索）
+        各自给出最多n_candidates_per_source部候选
+        （近邻类组件在线程池中并行计算，NumPy/SciPy运算会释放GIL；超过timeout秒仍未完成的组件直接丢弃），
+        合并后排除已看过的电影；第二阶段矩阵分解只对这几百部候选打分，各组件在候选中取前2n名后加权融合。
+        每次请求的代价只与候选数和用户/近邻的评分数有关，不随电影总数增长
+        """
+        with instrumentation.timer('hybrid.user_context'):
+            context = self._user_context(user_id)
+        if self.movie_features is None:
+            raise ValueError("未提供电影特征数据")
+        if timeout is None:
+            timeout = self.component_timeout
+
+        # 第一阶段：候选生成
+        n_candidates = n_recommendations * 2
+        n_per_source = max(n_candidates_per_source, n_candidates)
+        generators = {
+            'user_based_cf': (self._user_cf_scores, context),
+            'item_based_cf': (self._item_cf_scores, context),
+            'content_based': (self._user_content_scores, context),
+        }
+        if self.factor_model is not None and self.factor_model.item_index is not None:
+            # 有因子ANN索引时，矩阵分解也参与候选生成（近似检索预测评分最高的电影）
+            generators['mf_retrieval'] = (self._mf_scores, context)
+        executor = self._get_executor()
+        # 组件在线程池中计时，各阶段用时记入调用线程正在记录的请求
+        trace = instrumentation.current_trace()
+        futures = {
+            name: executor.submit(instrumentation.timed_call, f'hybrid.{name}', trace, scorer, arg, n_per_source)
+            for name, (scorer, arg) in generators.items()
+        }
+        concurrent.futures.wait(futures.values(), timeout=timeout)
+
+        generated = {}
+        for name, future in futures.items():
+            if not future.done():
+                print(f"推荐组件 {name} 超时，已跳过")
+                generated[name] = _EMPTY_SCORES
+                continue
+            generated[name] = future.result()
+
+        with instrumentation.timer('hybrid.candidates'):
+            pool = np.unique(np.concatenate(
+                [movies for movies, _ in generated.values()] + [self.popular_movies(n_per_source)]
+            )).astype(np.int64)
+            pool = pool[~_is_seen(pool, context.rated_movies)]
+
+        # 第二阶段：在候选上打分，各组件取前n_candidates名
+        with instrumentation.timer('hybrid.matrix_factorization'):
+            mf_movies, _ = self._mf_scores(context, n_candidates, candidates=pool)
+        component_scores = []
+        for name in ('user_based_cf', 'item_based_cf', 'matrix_factorization', 'content_based'):
+            if name == 'matrix_factorization':
+                # 矩阵分解只提供排序，用名次作为分数
+                component_scores.append((mf_movies, np.arange(1, len(mf_movies) + 1, dtype=np.float64)))
+                continue
+            movies, scores = generated[name]
+            # 生成阶段的结果已按分数降序排列，去掉候选之外（已看过）的电影后取前n_candidates个
+            keep = np.flatnonzero(_is_seen(movies, pool))[:n_candidates]
+            component_scores.append((movies[keep], scores[keep]))
+
+        with instrumentation.timer('hybrid.fuse'):
+            return _as_pairs(*fuse_scores(component_scores, weights, n_recommendations))
+
+    def recommend_batch(self, user_ids, n_recommendations=10, method='hybrid', weights=[0.3, 0.3, 0.2, 0.2],
+                        block_size=256, n_candidates_per_source=100):
+        """批量推荐：每block_size个用户一块，用矩阵-矩阵乘法和批量top-N计算
+
+        method为 'user_based_cf' / 'item_based_cf' / 'matrix_factorization' / 'content_based' / 'hybrid'，
+        返回 {user_id: 推荐结果}，推荐结果与对应的单用户方法一致（hybrid与hybrid_recommender同样分两阶段计算）。
+        每块的稠密分数矩阵为 block_size×电影数；用户协同过滤的相似度分段计算（每段 block_size×4096），
+        再取出相似用户（最多 block_size×n_neighbors 个）的评分行，不复制整个评分矩阵
+        """
+        scorers = {
+            'user_based_cf': self._user_cf_batch,
+            'item_based_cf': self._item_cf_batch,
+            'matrix_factorization': self._mf_batch,
+            'content_based': self._content_batch,
+        }
+        if method != 'hybrid' and method not in scorers:
+            raise ValueError(f"未知的推荐方法：{method}")
+        if method in ('content_based', 'hybrid') and self.movie_features is None:
+            raise ValueError("未提供电影特征数据")
 
-    def matrix_factorization(self, user_id, n_recommendations=10, n_components=20):
-        """基于矩阵分解(SVD)的推荐"""
-        # 应用SVD
-        svd = TruncatedSVD(n_components=n_components)
-        user_factors = svd.fit_transform(self.user_item_matrix)
-        item_factors = svd.components_.T
-
-        # 预测评分
-        predicted_ratings = np.dot(user_factors, item_factors.T)
-        predicted_df = pd.DataFrame(
-            predicted_ratings,
-            index=self.user_item_matrix.index,
-            columns=self.user_item_matrix.columns
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        for user_id in user_ids:
+            if not 0 <= user_id < self.user_item_matrix.shape[0] or not self.user_mask[user_id]:
+                raise KeyError(int(user_id))
+
+        results = {}
+        for start in range(0, len(user_ids), block_size):
+            block = user_ids[start:start + block_size]
+            if method == 'hybrid':
+                movies, scores = self._hybrid_batch(block, n_recommendations, weights, n_candidates_per_source)
+            else:
+                movies, scores = scorers[method](block, n_recommendations)
+
+            for row, user_id in enumerate(block):
+                valid = movies[row] >= 0
+                if method == 'matrix_factorization':
+                    results[int(user_id)] = movies[row][valid].tolist()
+                else:
+                    results[int(user_id)] = _as_pairs(movies[row][valid], scores[row][valid])
+        return results
+
+    def _user_cf_batch(self, block, n_recommendations, n_neighbors=10, user_block_size=4096):
+        """一块用户的基于用户的协同过滤，与_user_cf_scores的结果一致
+
+        与所有用户的余弦相似度按user_block_size个用户一段计算（范数复用_get_user_norms），逐段合并出前n_neighbors个相似用户，
+        加权求和只取出相似用户的评分行：内存只与块大小有关，不随用户数和评分数增长，也不复制评分矩阵
+        """
+        norms = self._get_user_norms()
+        block_ratings = self.user_item_matrix[block]
+        block_t = block_ratings.T.tocsr()
+        n_users = self.user_item_matrix.shape[0]
+        similar_users = np.empty((len(block), 0), dtype=np.int64)
+        similar_scores = np.empty((len(block), 0))
+        for start in range(0, n_users, user_block_size):
+            users = np.arange(start, min(start + user_block_size, n_users))
+            dot = (self.user_item_matrix[start:users[-1] + 1] @ block_t).toarray().T
+            denominator = norms[block][:, np.newaxis] * norms[users][np.newaxis, :]
+            similarity = _round_scores(np.divide(dot, denominator, out=np.zeros_like(dot), where=denominator > 0))
+            invalid = (similarity <= 0) | ~self.user_mask[users] | (users == block[:, np.newaxis])
+            similarity[invalid] = -np.inf
+
+            # 与前面各段的结果合并后重新取前n_neighbors个（前面的段用户编号更小，并列时优先，与单用户路径一致）
+            candidates = np.hstack([similar_users, np.broadcast_to(users, similarity.shape)])
+            scores = np.hstack([similar_scores, similarity])
+            top = top_k_indices(scores, n_neighbors)
+            similar_users = np.take_along_axis(candidates, top, axis=1)
+            similar_scores = np.take_along_axis(scores, top, axis=1)
+
+        # 相似用户组成稀疏权重矩阵 W（块内用户×相似用户），只取出这些用户的评分行
+        rows, cols = np.nonzero(np.isfinite(similar_scores))
+        neighbors, columns = np.unique(similar_users[rows, cols], return_inverse=True)
+        neighbor_weights = scipy.sparse.csr_matrix(
+            (similar_scores[rows, cols], (rows, columns)), shape=(len(block), len(neighbors))
+        )
+        neighbor_ratings = self.user_item_matrix[neighbors]
+        weighted_sum = (neighbor_weights @ neighbor_ratings).toarray()
+        sim_sum = (neighbor_weights @ _binarize(neighbor_ratings)).toarray()
+
+        valid = self.item_mask & (block_ratings.toarray() == 0) & (sim_sum > 0)
+        predicted = _round_scores(np.divide(weighted_sum, sim_sum, out=np.zeros_like(weighted_sum), where=valid))
+        return _batch_top_n(predicted, valid, n_recommendations)
+
+    def _item_cf_batch(self, block, n_recommendations, n_neighbors=10):
+        if self.item_neighbors is None:
+            self.build_item_neighbors()
+        n_movies = self.user_item_matrix.shape[1]
+        item_similarity = self.item_neighbors.to_sparse(n_neighbors, n_movies)
+
+        # 评分矩阵块 × 物品近邻矩阵 = 每部电影的 相似度×评分 之和
+        block_ratings = self.user_item_matrix[block]
+        scores = (block_ratings @ item_similarity).toarray()
+        is_candidate = (_binarize(block_ratings) @ _binarize(item_similarity)).toarray() > 0
+        is_candidate &= block_ratings.toarray() == 0
+        return _batch_top_n(scores, is_candidate, n_recommendations)
+
+    def _mf_batch(self, block, n_recommendations, n_components=20):
+        if self.factor_model is None or self.factor_model.n_components != n_components:
+            self.fit_factor_model(n_components)
+
+        predictions = self.factor_model.user_factors[block] @ self.factor_model.components
+        valid = self.item_mask & (self.user_item_matrix[block].toarray() == 0)
+        return _batch_top_n(predictions, valid, n_recommendations)
+
+    def _content_batch(self, block, n_recommendations, n_neighbors=10):
+        if self.content_neighbors is None:
+            self.build_content_neighbors()
+        n_movies = self.user_item_matrix.shape[1]
+        content_similarity = self.content_neighbors.to_sparse(n_neighbors, n_movies)
+
+        # 喜欢矩阵（评分>=4记为1） × 内容近邻矩阵 = 每部电影的相似度之和
+        liked = self.user_item_matrix[block]
+        liked.data = (liked.data >= 4).astype(np.float64)
+        liked.eliminate_zeros()
+        scores = (liked @ content_similarity).toarray()
+        is_candidate = (liked @ _binarize(content_similarity)).toarray() > 0
+        is_candidate &= self.user_item_matrix[block].toarray() == 0  # 与单用户混合推荐一致，排除所有已看过的电影
+        return _batch_top_n(scores, is_candidate, n_recommendations)
+
+    def _hybrid_batch(self, block, n_recommendations, weights, n_candidates_per_source=100):
+        candidates, component_values = self._hybrid_components_batch(
+            block, n_recommendations * 2, n_candidates_per_source
         )
+        return blend_components(candidates, component_values, weights, n_recommendations)
+
+    def hybrid_components(self, user_ids, n_recommendations=10, block_size=256, n_candidates_per_source=100):
+        """混合推荐中与权重无关的部分：每个用户的候选电影和四个组件归一化后的分数
+
+        返回 (candidates, component_values)：candidates为 用户数×候选数 的编码后movieId（每行升序，不足时用-1填充），
+        component_values为 4×用户数×候选数 的归一化分数。任意权重的混合推荐结果都可以由
+        blend_components(candidates, component_values, weights, n_recommendations) 直接得到，无需重新计算各组件
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        return stack_components([
+            self._hybrid_components_batch(
+                user_ids[start:start + block_size], n_recommendations * 2, n_candidates_per_source
+            )
+            for start in range(0, len(user_ids), block_size)
+        ])
+
+    def _hybrid_components_batch(self, block, n_candidates, n_candidates_per_source=100):
+        """与hybrid_recommender相同的两阶段计算：生成候选池，矩阵分解只在候选池中打分，各组件取前n_candidates名"""
+        n_per_source = max(n_candidates_per_source, n_candidates)
+        generated = [
+            self._user_cf_batch(block, n_per_source),
+            self._item_cf_batch(block, n_per_source),
+            self._content_batch(block, n_per_source),
+        ]
+
+        # 第一阶段：每个用户的候选池为各组件的候选和热门电影（有因子ANN索引时还有矩阵分解的近似检索），排除已看过的电影
+        if self.factor_model is None:
+            self.fit_factor_model()
+        contexts = [self._user_context(int(user_id)) for user_id in block]
+        pool = np.zeros((len(block), self.user_item_matrix.shape[1]), dtype=bool)
+        for movies, _ in generated:
+            rows, cols = np.nonzero(movies >= 0)
+            pool[rows, movies[rows, cols]] = True
+        pool[:, self.popular_movies(n_per_source)] = True
+        if self.factor_model.item_index is not None:
+            for row, context in enumerate(contexts):
+                pool[row, self._mf_scores(context, n_per_source)[0]] = True
+        pool[self.user_item_matrix[block].nonzero()] = False
+
+        # 第二阶段：矩阵分解在候选池中打分（逐个用户，与单用户路径的计算完全相同），只提供排序，用名次作为分数
+        mf_movies = np.full((len(block), n_candidates), -1, dtype=np.int64)
+        for row, context in enumerate(contexts):
+            movies, _ = self._mf_scores(context, n_candidates, candidates=np.flatnonzero(pool[row]))
+            mf_movies[row, :len(movies)] = movies
+        mf_ranks = np.broadcast_to(np.arange(1, n_candidates + 1, dtype=np.float64), mf_movies.shape)
+        # 生成阶段的结果已排除看过的电影并按分数降序排列，取前n_candidates个
+        component_scores = [(movies[:, :n_candidates], scores[:, :n_candidates]) for movies, scores in generated]
+        component_scores.insert(2, (mf_movies, np.where(mf_movies >= 0, mf_ranks, 0)))
+
+        # 各组件按行最大值归一化，(用户, 电影) 编成一个键
+        n_movies = self.user_item_matrix.shape[1]
+        keys, values = [], []
+        for movies, scores in component_scores:
+            valid = movies >= 0
+            max_score = np.where(valid, scores, 0).max(axis=1, initial=0)
+            normalized = np.divide(scores, max_score[:, np.newaxis], out=np.zeros_like(scores),
+                                   where=max_score[:, np.newaxis] > 0)
+            row, col = np.nonzero(valid)
+            keys.append(row * n_movies + movies[row, col])
+            values.append(normalized[row, col])
+
+        # 每个用户的候选电影为四个组件的并集，按电影升序排成定长数组
+        candidate_keys = np.unique(np.concatenate(keys))
+        rows = candidate_keys // n_movies
+        row_counts = np.bincount(rows, minlength=len(block))
+        row_starts = np.concatenate([[0], np.cumsum(row_counts)[:-1]])
+        positions = np.arange(len(candidate_keys)) - row_starts[rows]
+        width = int(row_counts.max(initial=0))
+
+        candidates = np.full((len(block), width), -1, dtype=np.int64)
+        candidates[rows, positions] = candidate_keys % n_movies
+        component_values = np.zeros((len(component_scores), len(block), width))
+        for i, (component_keys, component_value) in enumerate(zip(keys, values)):
+            index = np.searchsorted(candidate_keys, component_keys)
+            component_values[i, rows[index], positions[index]] = component_value
+        return candidates, component_values
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.n_workers)
+        return self._executor
+
+
+UserContext = namedtuple('UserContext', ['user_id', 'rated_movies', 'rated_values', 'liked_movies'])
+
+_EMPTY_SCORES = (np.array([], dtype=np.int64), np.array([], dtype=np.float64))
+SCORE_DECIMALS = 10
+
+
+def fuse_scores(component_scores, weights, n_recommendations):
+    """按最大值归一化各组件分数后加权求和，返回前n个 (movies, scores)"""
+    movies = []
+    scores = []
+    for weight, (component_movies, component_values) in zip(weights, component_scores):
+        if len(component_movies) == 0:
+            continue
+        max_score = component_values.max()
+        movies.append(component_movies)
+        scores.append(weight * component_values / max_score if max_score > 0 else np.zeros(len(component_values)))
+    if not movies:
+        return _EMPTY_SCORES
+
+    candidates, inverse = np.unique(np.concatenate(movies), return_inverse=True)
+    fused = _round_scores(np.bincount(inverse, weights=np.concatenate(scores), minlength=len(candidates)))
+    return _top_n(candidates, fused, n_recommendations)
+
+
+def blend_components(candidates, component_values, weights, n_recommendations):
+    """按权重混合hybrid_components的结果，返回每个用户前n个 (movies, scores)，不足n个时用-1 / 0填充"""
+    fused = _round_scores(np.tensordot(np.asarray(weights, dtype=np.float64), component_values, axes=1))
+    top, top_scores = _batch_top_n(fused, candidates >= 0, n_recommendations)
+    movies = np.where(top >= 0, np.take_along_axis(candidates, np.maximum(top, 0), axis=1), -1)
+    return movies, top_scores
+
+
+def stack_components(blocks):
+    """按行拼接多块hybrid_components的结果，候选数不同的块用-1 / 0补齐"""
+    width = max((candidates.shape[1] for candidates, _ in blocks), default=0)
+    n_users = sum(len(candidates) for candidates, _ in blocks)
+    candidates = np.full((n_users, width), -1, dtype=np.int64)
+    component_values = np.zeros((4, n_users, width))
+    start = 0
+    for block_candidates, block_values in blocks:
+        end = start + len(block_candidates)
+        candidates[start:end, :block_candidates.shape[1]] = block_candidates
+        component_values[:, start:end, :block_values.shape[2]] = block_values
+        start = end
+    return candidates, component_values
+
+
+def _is_seen(movies, seen):
+    """movies中的每个元素是否在升序数组seen中（二分查找）"""
+    positions = np.searchsorted(seen, movies)
+    found = positions < len(seen)
+    found[found] = seen[positions[found]] == movies[found]
+    return found
+
+
+def _top_n(movies, scores, n):
+    """按分数降序取前n个，分数相同时保持movies原有顺序"""
+    order = np.argsort(-scores, kind='stable')[:n]
+    return movies[order], scores[order]
+
+
+def _assign_compressed(matrix, major, minor, values):
+    """在CSR（major=行）或CSC（major=列）矩阵中写入若干元素
+
+    已存在的元素原地修改；不存在的一次性插入，返回新的矩阵对象，已有的读者继续使用旧矩阵
+    """
+    indptr, indices = matrix.indptr, matrix.indices
+    positions = np.empty(len(major), dtype=np.int64)
+    exists = np.zeros(len(major), dtype=bool)
+    for i, (a, b) in enumerate(zip(major, minor)):
+        start, end = indptr[a], indptr[a + 1]
+        positions[i] = start + np.searchsorted(indices[start:end], b)
+        exists[i] = positions[i] < end and indices[positions[i]] == b
+    matrix.data[positions[exists]] = values[exists]
+
+    new = ~exists
+    if not new.any():
+        return matrix
+    # 插入位置相同时按 (major, minor) 排序，保证插入后每行/列的下标仍然有序
+    order = np.lexsort((minor[new], major[new], positions[new]))
+    insert_at = positions[new][order]
+    new_indices = np.insert(indices, insert_at, minor[new][order].astype(indices.dtype))
+    new_data = np.insert(matrix.data, insert_at, values[new][order])
+    counts = np.bincount(major[new], minlength=len(indptr) - 1)
+    new_indptr = indptr + np.concatenate([[0], np.cumsum(counts)]).astype(indptr.dtype)
+    return type(matrix)((new_data, new_indices, new_indptr), shape=matrix.shape)
+
+
+def _round_scores(scores):
+    """分数保留10位小数：单用户和批量路径的求和顺序不同，末位误差会让并列的分数排序不一致"""
+    return np.round(scores, SCORE_DECIMALS)
+
+
+def _batch_top_n(scores, valid, n):
+    """批量top-N：每行在valid为True的位置中取分数最高的n个，不足n个时用-1 / 0填充"""
+    scores = np.where(valid, scores, -np.inf)
+    top = top_k_indices(scores, n)
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    found = np.isfinite(top_scores)
+    return np.where(found, top, -1), np.where(found, top_scores, 0)
+
+
+def _binarize(matrix):
+    """稀疏矩阵的非零位置记为1"""
+    matrix = matrix.copy()
+    matrix.data = np.ones_like(matrix.data)
+    return matrix
+
+
+def _as_pairs(movies, scores):
+    """转换为原有接口的 [(movieId, 分数)] 格式"""
+    return [(int(movie), score) for movie, score in zip(movies, scores)]
 
-        # 获取用户已评分的电影
-        user_ratings = self.user_item_matrix.loc[user_id]
-        rated_movies = user_ratings[user_ratings > 0].index
 
-        # 生成推荐
-        user_predictions = predicted_df.loc[user_id]
-        recommendations = user_predictions.drop(rated_movies).sort_values(ascending=False)
+# 使用Surprise库实现的推荐算法评估
+# 交叉验证的各折（主进程中只划分一次，由进程池的initializer传给各评估进程）
+_cv_folds = None
 
-        return list(recommendations.head(n_recommendations).index)
 
-    def content_based(self, user_id, n_recommendations=10):
-        if self.movie_features is None:
-            raise ValueError("未提供电影特征数据")
+def _init_cv_worker(folds):
+    global _cv_folds
+    _cv_folds = folds
 
-        # 获取用户喜欢的电影（使用编码后的movieId）
-        user_ratings = self.ratings[self.ratings['userId'] == user_id]
-        liked_movies = user_ratings[user_ratings['rating'] >= 4]['movieId'].values
-        if len(liked_movies) == 0:
-            return []
-
-        # 关键修复：通过tfidf_matrix的行数确定电影数量，生成与特征矩阵匹配的索引
-        # 注意：tfidf_matrix的行数 = 全量电影数（与le_movie编码的总电影数一致）
-        total_movies = self.movie_features.shape[0]  # 获取特征矩阵的行数（全量电影数）
-        all_movie_ids = le_movie.classes_  # le_movie包含所有电影的编码映射，classes_是原始电影ID列表
-
-        # 验证长度是否匹配（调试用，可删除）
-        if len(all_movie_ids) != total_movies:
-            raise ValueError(f"电影特征矩阵行数（{total_movies}）与le_movie中的电影数（{len(all_movie_ids)}）不匹配")
-
-        # 仅提取用户喜欢的电影的特征向量索引
-        liked_indices = []
-        for movie_id in liked_movies:
-            # 找到该电影在le_movie中的索引（即特征矩阵中的行索引）
-            idx = np.where(le_movie.classes_ == movie_id)[0]
-            if len(idx) > 0:
-                liked_indices.append(idx[0])
-        if not liked_indices:
-            return []
-
-        # 提取特征向量并计算相似度
-        liked_movie_features = self.movie_features[liked_indices]
-        movie_similarity = cosine_similarity(liked_movie_features, self.movie_features)
-
-        # 生成推荐
-        recommendations = {}
-        for i in range(len(liked_indices)):
-            similar_scores = movie_similarity[i]  # 长度=total_movies
-            # 用全量电影ID作为索引（长度=total_movies，与similar_scores一致）
-            similar_movies = pd.Series(
-                similar_scores,
-                index=all_movie_ids
-            ).sort_values(ascending=False)[1:11]  # 排除自身
-
-            for similar_movie, similarity in similar_movies.items():
-                if similar_movie not in liked_movies:
-                    recommendations[similar_movie] = recommendations.get(similar_movie, 0) + similarity
-
-        return sorted(recommendations.items(), key=lambda x: x[1], reverse=True)[:n_recommendations]
-
-    def hybrid_recommender(self, user_id, n_recommendations=10, weights=[0.3, 0.3, 0.2, 0.2]):
-        """混合推荐系统"""
-        # 获取各种方法的推荐
-        ub_recs = dict(self.user_based_cf(user_id, n_recommendations * 2))
-        ib_recs = dict(self.item_based_cf(user_id, n_recommendations * 2))
-        mf_recs = {movie: i + 1 for i, movie in enumerate(self.matrix_factorization(user_id, n_recommendations * 2))}
-        cb_recs = dict(self.content_based(user_id, n_recommendations * 2))
-
-        # 归一化分数
-        def normalize(scores):
-            if not scores:
-                return {}
-            max_score = max(scores.values())
-            return {k: v / max_score for k, v in scores.items()}
-
-        ub_norm = normalize(ub_recs)
-        ib_norm = normalize(ib_recs)
-        mf_norm = normalize(mf_recs)
-        cb_norm = normalize(cb_recs)
-
-        # 组合推荐
-        recommendations = {}
-        for movie in set(ub_norm.keys() | ib_norm.keys() | mf_norm.keys() | cb_norm.keys()):
-            score = (
-                    weights[0] * ub_norm.get(movie, 0) +
-                    weights[1] * ib_norm.get(movie, 0) +
-                    weights[2] * mf_norm.get(movie, 0) +
-                    weights[3] * cb_norm.get(movie, 0)
-            )
-            recommendations[movie] = score
 
-        # 返回前n个推荐
-        return sorted(recommendations.items(), key=lambda x: x[1], reverse=True)[:n_recommendations]
+def _evaluate_fold(algo, fold, k, relevance_threshold):
+    """在第fold折上训练并测试一个算法，返回该折的误差和排序指标"""
+    trainset, testset = _cv_folds[fold]
+    start = time.perf_counter()
+    algo.fit(trainset)
+    fit_time = time.perf_counter() - start
 
+    start = time.perf_counter()
+    predictions = algo.test(testset)
+    test_time = time.perf_counter() - start
 
-# 使用Surprise库实现的推荐算法评估
-def evaluate_algorithms(ratings_data):
-    """评估不同推荐算法的性能"""
+    users, _, true_ratings, estimates, _ = zip(*predictions)
+    true_ratings = np.array(true_ratings)
+    estimates = np.array(estimates)
+    errors = estimates - true_ratings
+    result = {'RMSE': np.sqrt(np.mean(errors ** 2)), 'MAE': np.mean(np.abs(errors))}
+    # 每个用户的测试电影按预测评分排序，真实评分>=relevance_threshold的电影视为相关
+    result.update(mean_ranking_metrics(np.array(users), estimates, true_ratings >= relevance_threshold, k))
+    result.update({'Fit Time': fit_time, 'Test Time': test_time})
+    return result
+
+
+def evaluate_algorithms(ratings_data, cv=5, n_jobs=None, k=10, relevance_threshold=4.0, random_state=42):
+    """评估不同推荐算法的性能
+
+    各折只划分一次，所有 (算法, 折) 组合在进程池中并行训练和测试；n_jobs默认为CPU核数，1表示在当前进程计算。
+    结果表每个算法一行：各折平均的RMSE、MAE、Precision@k、Recall@k、NDCG@k、MAP@k和训练/测试用时
+    """
     # 准备数据
     reader = Reader(rating_scale=(0.5, 5.0))
     data = Dataset.load_from_df(ratings_data[['userId', 'movieId', 'rating']], reader)
+    folds = list(KFold(n_splits=cv, random_state=random_state).split(data))
 
     # 定义算法
     algorithms = {
-        '基于用户的协同过滤': KNNBasic(sim_options={'user_based': True}),
-        '基于物品的协同过滤': KNNBasic(sim_options={'user_based': False}),
-        'SVD矩阵分解': SVD()
+        '基于用户的协同过滤': KNNBasic(sim_options={'user_based': True}, verbose=False),
+        '基于物品的协同过滤': KNNBasic(sim_options={'user_based': False}, verbose=False),
+        'SVD矩阵分解': SVD(random_state=random_state)
     }
 
     # 评估算法
+    tasks = [(name, fold) for name in algorithms for fold in range(cv)]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(tasks))
+    print(f"评估 {len(algorithms)} 个算法 × {cv} 折，{n_jobs} 个进程...")
+    if n_jobs <= 1:
+        _init_cv_worker(folds)
+        fold_results = [_evaluate_fold(algorithms[name], fold, k, relevance_threshold) for name, fold in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_cv_worker,
+                                                    initargs=(folds,)) as executor:
+            futures = [executor.submit(_evaluate_fold, algorithms[name], fold, k, relevance_threshold)
+                       for name, fold in tasks]
+            fold_results = [future.result() for future in futures]
+
     results = {}
-    for name, algo in algorithms.items():
-        print(f"评估 {name}...")
-        cv_results = cross_validate(algo, data, measures=['RMSE', 'MAE'], cv=5, verbose=False)
-        results[name] = {
-            'RMSE': np.mean(cv_results['test_rmse']),
-            'MAE': np.mean(cv_results['test_mae']),
-            'Fit Time': np.mean(cv_results['fit_time']),
-            'Test Time': np.mean(cv_results['test_time'])
-        }
+    for (name, _), result in zip(tasks, fold_results):
+        results.setdefault(name, []).append(result)
+    results = {name: pd.DataFrame(rows).mean() for name, rows in results.items()}
 
     # 输出结果
     results_df = pd.DataFrame(results).T
@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# 项目模块都在仓库根目录（平铺结构），测试直接按模块名导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def synthetic_data():
+    """小规模的合成评分数据：(full_data, tfidf_matrix, le_movie)"""
+    from benchmark import generate_synthetic_data
+    return generate_synthetic_data(300, 200, mean_ratings=20, seed=7)
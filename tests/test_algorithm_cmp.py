@@ -0,0 +1,24 @@
+import pytest
+
+from algorithm_cmp import HybridWeightTuner, prepare_evaluation_data
+from recommender_systems import RecommenderSystem
+
+
+@pytest.fixture(scope='module')
+def tuner_setup(synthetic_data):
+    full_data, tfidf_matrix, le_movie = synthetic_data
+    train_data, test_data = prepare_evaluation_data(full_data[['userId', 'movieId', 'rating']])
+    recommender = RecommenderSystem(train_data, tfidf_matrix, le_movie)
+    recommender.fit_factor_model(method='svd')
+    tuner = HybridWeightTuner(recommender, test_data, n_recommendations=10, n_jobs=1)
+    return recommender, tuner
+
+
+@pytest.mark.parametrize('weights', [[0.3, 0.3, 0.2, 0.2], [0.25, 0.25, 0.25, 0.25], [1, 0, 0, 0], [0, 0.5, 0.5, 0]])
+def test_tuner_rankings_match_recommend_batch(tuner_setup, weights):
+    recommender, tuner = tuner_setup
+    assert len(tuner.users)
+    movies = tuner.recommend(weights)
+    batch = recommender.recommend_batch(tuner.users, 10, weights=weights)
+    for row, user_id in enumerate(tuner.users):
+        assert movies[row][movies[row] >= 0].tolist() == [movie for movie, _ in batch[int(user_id)]]
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from cold_start import ColdStartRecommender
+from neighbor_index import NeighborIndex
+
+
+@pytest.fixture(scope='module')
+def cold_start(synthetic_data):
+    full_data, tfidf_matrix, le_movie = synthetic_data
+    return ColdStartRecommender(
+        movie_ids=full_data['movieId'].to_numpy(),
+        ratings=full_data['rating'].to_numpy(),
+        content_neighbors=NeighborIndex.build(tfidf_matrix),
+        n_movies=len(le_movie.classes_)
+    )
+
+
+def test_recommend_excludes_every_rated_movie(cold_start):
+    liked = int(np.flatnonzero(cold_start.content_neighbors.indices[:, 1] >= 0)[0])
+    neighbors = cold_start.content_neighbors.indices[liked]
+    # 喜欢的电影的前两个内容近邻，一个评了低分、一个评了中等分
+    ratings = {liked: 5.0, int(neighbors[0]): 1.0, int(neighbors[1]): 3.0}
+
+    recommended = [movie for movie, _ in cold_start.recommend(ratings, n_recommendations=20)]
+    assert recommended
+    assert not set(recommended) & set(ratings)
+    expected = [int(movie) for movie in neighbors if movie >= 0 and movie not in ratings][:len(recommended)]
+    assert recommended == expected
+
+
+def test_recommend_without_liked_movies_is_empty(cold_start):
+    assert cold_start.recommend({0: 2.0, 1: 3.5}) == []
@@ -0,0 +1,129 @@
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse
+
+import data_process
+import data_registry
+import make_recommend
+from model_store import load_bundle
+from neighbor_index import NeighborIndex
+from test_neighbor_index import assert_same_neighbors
+
+WORDS = ['action', 'space', 'robot', 'romance', 'comedy', 'horror', 'drama', 'war', 'music', 'crime', 'magic', 'sport']
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """小规模的MovieLens格式原始数据，处理后写入 tmp_path/processed"""
+    rng = np.random.default_rng(0)
+    data_dir, output_dir = tmp_path / 'raw', tmp_path / 'processed'
+    data_dir.mkdir()
+    output_dir.mkdir()
+    movie_ids = np.arange(1, 61) * 2
+    pd.DataFrame({'movieId': movie_ids, 'title': [f'Movie {m}' for m in movie_ids], 'genres': 'Drama'}) \
+        .to_csv(data_dir / 'movies.csv', index=False)
+    pd.DataFrame({
+        'userId': 1,
+        'movieId': np.repeat(movie_ids, 3),
+        'tag': rng.choice(WORDS, len(movie_ids) * 3),
+    }).to_csv(data_dir / 'tags.csv', index=False)
+    n_ratings = 1200
+    pd.DataFrame({
+        'userId': rng.integers(1, 81, n_ratings),
+        'movieId': rng.choice(movie_ids, n_ratings),
+        'rating': rng.integers(1, 11, n_ratings) / 2,
+        'timestamp': rng.integers(1_000_000_000, 1_600_000_000, n_ratings),
+    }).drop_duplicates(['userId', 'movieId']).to_csv(data_dir / 'ratings.csv', index=False)
+    data_process.process_data(sample_fraction=1.0, data_dir=str(data_dir), output_dir=str(output_dir), chunk_size=97)
+    return str(data_dir), str(output_dir)
+
+
+def add_movie(data_dir, movie_id, tags):
+    movies = pd.read_csv(os.path.join(data_dir, 'movies.csv'))
+    movies.loc[len(movies)] = [movie_id, f'Movie {movie_id}', 'Drama']
+    movies.to_csv(os.path.join(data_dir, 'movies.csv'), index=False)
+    retag(data_dir, movie_id, tags)
+
+
+def retag(data_dir, movie_id, tags):
+    path = os.path.join(data_dir, 'tags.csv')
+    tag_data = pd.read_csv(path)
+    tag_data = tag_data[tag_data['movieId'] != movie_id]
+    pd.concat([tag_data, pd.DataFrame({'userId': 1, 'movieId': movie_id, 'tag': tags})]).to_csv(path, index=False)
+
+
+def use_registry(monkeypatch, output_dir):
+    """data_registry指向测试数据（每次调用都是新的注册表，重新读取文件）"""
+    registry = data_registry.DataRegistry()
+    registry.register('full_data', lambda: data_registry.load_full_data(os.path.join(output_dir, 'full_data')))
+    registry.register('tfidf_matrix', lambda: scipy.sparse.load_npz(os.path.join(output_dir, 'tfidf_matrix.npz')))
+    registry.register('le_movie', lambda: joblib.load(os.path.join(output_dir, 'le_movie.pkl')))
+    monkeypatch.setattr(data_registry, 'registry', registry)
+
+
+def test_update_adds_new_movie_and_refreshes_content_neighbors(dataset):
+    data_dir, output_dir = dataset
+    tfidf_path = os.path.join(output_dir, 'tfidf_matrix.npz')
+    neighbors_path = os.path.join(output_dir, 'content_neighbors.npz')
+    old_matrix = scipy.sparse.load_npz(tfidf_path).tocsr()
+    NeighborIndex.build(old_matrix).save(neighbors_path)
+
+    add_movie(data_dir, 1000, ['robot', 'space', 'war'])
+    retag(data_dir, 10, ['music', 'romance'])
+    updated = data_process.update_movie_features([10], data_dir=data_dir, output_dir=output_dir, chunk_size=97)
+
+    le_movie = joblib.load(os.path.join(output_dir, 'le_movie.pkl'))
+    matrix = scipy.sparse.load_npz(tfidf_path).tocsr()
+    assert le_movie.classes_[-1] == 1000 and matrix.shape[0] == old_matrix.shape[0] + 1
+    changed_row = int(np.searchsorted(le_movie.classes_, 10))
+    assert sorted(updated.tolist()) == [changed_row, matrix.shape[0] - 1]
+
+    # 新电影和标签变化的电影按已保存的词表向量化，其余行不变
+    tfidf = joblib.load(os.path.join(output_dir, 'tfidf_vectorizer.pkl'))
+    expected = tfidf.transform(['robot, space, war', 'music, romance'])
+    np.testing.assert_allclose(matrix[-1].toarray(), expected[0].toarray())
+    np.testing.assert_allclose(matrix[changed_row].toarray(), expected[1].toarray())
+    unchanged = np.setdiff1d(np.arange(old_matrix.shape[0]), [changed_row])
+    assert (matrix[unchanged] != old_matrix[unchanged]).nnz == 0
+
+    # 内容近邻索引增量刷新后与重建的结果一致
+    index = NeighborIndex.load(neighbors_path)
+    np.testing.assert_array_equal(index.signature, NeighborIndex.matrix_signature(matrix))
+    assert_same_neighbors(index, NeighborIndex.build(matrix))
+
+
+def test_update_rejects_new_movie_below_max_id(dataset):
+    data_dir, output_dir = dataset
+    add_movie(data_dir, 11, ['robot'])
+    with pytest.raises(ValueError):
+        data_process.update_movie_features(data_dir=data_dir, output_dir=output_dir)
+
+
+def test_feature_update_triggers_bundle_rebuild(dataset, tmp_path, monkeypatch):
+    data_dir, output_dir = dataset
+    bundle_path = str(tmp_path / 'bundle')
+    monkeypatch.setattr(make_recommend, 'RECOMMENDER_BUNDLE_PATH', bundle_path)
+    monkeypatch.setattr(make_recommend, 'ITEM_NEIGHBORS_PATH', os.path.join(output_dir, 'item_neighbors.npz'))
+    monkeypatch.setattr(make_recommend, 'CONTENT_NEIGHBORS_PATH', os.path.join(output_dir, 'content_neighbors.npz'))
+
+    # 第一次初始化并保存文件包，第二次直接加载（文件包中不保存原始评分）
+    use_registry(monkeypatch, output_dir)
+    n_movies = make_recommend.load_or_init_recommender().movie_features.shape[0]
+    use_registry(monkeypatch, output_dir)
+    assert make_recommend.load_or_init_recommender().ratings is None
+
+    # 新增电影后，文件包中的电影特征与tfidf_matrix不一致，重新初始化并覆盖文件包
+    add_movie(data_dir, 1000, ['robot', 'space'])
+    data_process.update_movie_features(data_dir=data_dir, output_dir=output_dir)
+    use_registry(monkeypatch, output_dir)
+    recommender = make_recommend.load_or_init_recommender()
+    assert recommender.ratings is not None
+    assert recommender.movie_features.shape[0] == n_movies + 1
+    assert load_bundle(bundle_path).movie_features.shape[0] == n_movies + 1
+    np.testing.assert_array_equal(
+        recommender.content_neighbors.signature, NeighborIndex.matrix_signature(recommender.movie_features)
+    )
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from factor_model import ALSFactorModel
+
+
+@pytest.fixture(scope='module')
+def ratings(synthetic_data):
+    from recommender_systems import RecommenderSystem
+    full_data, tfidf_matrix, le_movie = synthetic_data
+    return RecommenderSystem(full_data, tfidf_matrix, le_movie).user_item_matrix
+
+
+def test_validation_only_selects_iteration_count(ratings):
+    model = ALSFactorModel(n_components=8, n_iterations=50, validation_fraction=0.2, tol=1e-3, n_threads=2).fit(ratings)
+    # 提前停止：验证RMSE在最后一轮没有下降
+    assert 0 < model.best_n_iterations < len(model.validation_rmse) <= 50
+    assert model.validation_rmse[-1] >= min(model.validation_rmse) - model.tol
+    assert model.n_train_ratings == ratings.nnz
+
+    # 最终模型与不留验证集、训练同样轮数的模型相同（随机初始值一致）
+    full = ALSFactorModel(n_components=8, n_iterations=model.best_n_iterations, validation_fraction=0,
+                          n_threads=2).fit(ratings)
+    np.testing.assert_allclose(model.user_factors, full.user_factors)
+    np.testing.assert_allclose(model.components, full.components)
+
+
+def test_every_rating_affects_final_factors(ratings):
+    params = dict(n_components=8, n_iterations=3, validation_fraction=0.5, tol=-np.inf, n_threads=2)
+    model = ALSFactorModel(**params).fit(ratings)
+    assert model.best_n_iterations == 3
+
+    rows, cols = ratings.nonzero()
+    for position in np.random.default_rng(0).choice(len(rows), 8, replace=False):
+        user, movie = rows[position], cols[position]
+        changed = ratings.copy()
+        changed[user, movie] = 0.5 if ratings[user, movie] != 0.5 else 5.0
+        refit = ALSFactorModel(**params).fit(changed)
+        assert not np.allclose(refit.user_factors[user], model.user_factors[user])
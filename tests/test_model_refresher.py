@@ -0,0 +1,36 @@
+import threading
+
+from data_registry import DataRegistry
+from model_refresher import ModelRefresher
+
+
+class Model:
+    def __init__(self, generation=0):
+        self.generation = generation
+
+
+def test_refresh_swaps_model_and_bumps_version():
+    registry = DataRegistry()
+    registry.register('model', Model)
+    registry.get('model')
+    refresher = ModelRefresher(lambda current: Model(current.generation + 1), name='model',
+                               retire_timeout=1, registry=registry)
+    assert refresher.refresh() == 2
+    assert registry.get('model').generation == 1
+    assert refresher.refresh() == 3  # 被替换的模型已经释放
+
+
+def test_maintain_runs_between_rebuilds():
+    registry = DataRegistry()
+    registry.register('model', Model)
+    registry.get('model')
+    maintained = threading.Event()
+    refresher = ModelRefresher(lambda current: current, name='model', interval=3600, registry=registry,
+                               maintain=lambda model: maintained.set(), maintain_interval=0.01)
+    refresher.start()
+    assert refresher.start() is refresher._thread  # 已启动时不会再起线程
+    try:
+        assert maintained.wait(5)
+    finally:
+        refresher.stop(timeout=5)
+    assert registry.version('model') == 1  # 只做了增量维护，没有重建
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from model_store import BundleError, load_bundle, save_bundle, verify_bundle
+from recommender_systems import RecommenderSystem
+
+
+@pytest.fixture
+def bundle(synthetic_data, tmp_path):
+    full_data, tfidf_matrix, le_movie = synthetic_data
+    recommender = RecommenderSystem(full_data, tfidf_matrix, le_movie, n_workers=2)
+    recommender.fit_factor_model(method='svd')
+    recommender.build_factor_index(n_lists=8, n_probe=2)
+    recommender.build_item_neighbors()
+    recommender.build_content_neighbors()
+    directory = str(tmp_path / 'bundle')
+    save_bundle(recommender, directory)
+    loaded = load_bundle(directory)
+    yield recommender, loaded, directory
+    for model in (recommender, loaded):
+        if model._executor is not None:
+            model._executor.shutdown()
+
+
+def test_round_trip_preserves_recommendations(bundle, synthetic_data):
+    recommender, loaded, directory = bundle
+    verify_bundle(directory)
+    assert (loaded.user_item_matrix != recommender.user_item_matrix).nnz == 0
+    np.testing.assert_array_equal(loaded.item_neighbors.indices, recommender.item_neighbors.indices)
+    np.testing.assert_array_equal(loaded.content_neighbors.signature, recommender.content_neighbors.signature)
+
+    users = np.unique(synthetic_data[0]['userId'].to_numpy())[:20]
+    for user_id in users.tolist():
+        assert loaded.matrix_factorization(user_id, 10) == recommender.matrix_factorization(user_id, 10)
+        assert loaded.item_based_cf(user_id, 10) == recommender.item_based_cf(user_id, 10)
+        assert loaded.hybrid_recommender(user_id, 10) == recommender.hybrid_recommender(user_id, 10)
+
+
+def test_updates_do_not_touch_bundle_files(bundle):
+    recommender, loaded, directory = bundle
+    user_id = int(np.flatnonzero(loaded.user_mask)[0])
+    row = loaded.user_item_matrix[user_id]
+    loaded.update_user_ratings(user_id, {int(row.indices[0]): 0.5 if row.data[0] != 0.5 else 5.0})
+    verify_bundle(directory)
+    assert (load_bundle(directory).user_item_matrix != recommender.user_item_matrix).nnz == 0
+
+
+def test_corrupted_file_is_caught_by_verification(bundle):
+    recommender, loaded, directory = bundle
+    path = f'{directory}/user_item.data.npy'
+    data = np.load(path)
+    data[0] += 1
+    np.save(path, data)
+
+    # 服务路径只检查形状和类型，完整校验才计算sha256
+    load_bundle(directory)
+    with pytest.raises(BundleError):
+        verify_bundle(directory)
+    with pytest.raises(BundleError):
+        load_bundle(directory, verify=True)
+
+
+def test_shape_mismatch_and_missing_manifest_are_rejected(bundle, tmp_path):
+    recommender, loaded, directory = bundle
+    path = f'{directory}/user_mask.npy'
+    np.save(path, np.load(path)[:-1])
+    with pytest.raises(BundleError):
+        load_bundle(directory)
+    with pytest.raises(BundleError):
+        load_bundle(str(tmp_path / 'missing'))
+
+
+@pytest.mark.parametrize('keep_bytes', [10, -16])
+def test_truncated_file_is_rejected(bundle, keep_bytes):
+    recommender, loaded, directory = bundle
+    path = f'{directory}/user_item.data.npy'
+    with open(path, 'rb') as f:
+        content = f.read()
+    # 只剩头部的一部分，或数据末尾被截断
+    with open(path, 'wb') as f:
+        f.write(content[:keep_bytes])
+    with pytest.raises(BundleError):
+        load_bundle(directory)
+
+
+def test_corrupted_manifest_is_rejected(bundle):
+    recommender, loaded, directory = bundle
+    with open(f'{directory}/manifest.json', 'w', encoding='utf-8') as f:
+        f.write('{"format_version": 1, "arr')
+    with pytest.raises(BundleError):
+        load_bundle(directory)
@@ -0,0 +1,107 @@
+import numpy as np
+import scipy.sparse
+
+from neighbor_index import NeighborIndex, top_k_indices
+
+
+def random_vectors(n_items=120, n_features=80, density=0.08, seed=0):
+    return scipy.sparse.random(n_items, n_features, density=density, format='csr', random_state=seed)
+
+
+def assert_same_neighbors(actual, expected):
+    """相似度一致；近邻只比较严格高于第K名的部分（第K名并列时取哪一个不影响结果）"""
+    np.testing.assert_allclose(actual.scores, expected.scores, atol=1e-6)
+    for row in range(len(expected)):
+        kth = expected.scores[row, -1]
+        strict = expected.scores[row] > kth + 1e-6
+        assert set(actual.indices[row][strict]) == set(expected.indices[row][strict])
+
+
+def test_top_k_indices_matches_stable_sort():
+    scores = np.random.default_rng(0).integers(0, 5, (20, 30)).astype(float)
+    expected = np.argsort(-scores, axis=1, kind='stable')[:, :7]
+    np.testing.assert_array_equal(top_k_indices(scores, 7), expected)
+
+
+def test_build_matches_brute_force():
+    vectors = random_vectors()
+    index = NeighborIndex.build(vectors, k=5)
+    dense = vectors.toarray()
+    norms = np.linalg.norm(dense, axis=1)
+    sim = dense @ dense.T / np.maximum(np.outer(norms, norms), 1e-12)
+    np.fill_diagonal(sim, -np.inf)
+    for row in range(len(index)):
+        valid = index.indices[row] >= 0
+        np.testing.assert_allclose(index.scores[row][valid], sim[row, index.indices[row][valid]], rtol=1e-6)
+        np.testing.assert_allclose(index.scores[row][valid], np.sort(sim[row])[::-1][:valid.sum()], rtol=1e-6)
+
+
+def test_refresh_matches_rebuild():
+    vectors = random_vectors().tolil()
+    index = NeighborIndex.build(vectors.tocsr(), k=5)
+
+    # 修改已有的值、增加新的非零元、清空一行
+    rng = np.random.default_rng(1)
+    changed = rng.choice(vectors.shape[0], 10, replace=False)
+    for item in changed[:-1]:
+        vectors[item, rng.integers(0, vectors.shape[1], 3)] = rng.random(3)
+    vectors[changed[-1], :] = 0
+    vectors = vectors.tocsr()
+
+    index.refresh(vectors, changed)
+    assert_same_neighbors(index, NeighborIndex.build(vectors, k=5))
+    np.testing.assert_array_equal(index.signature, NeighborIndex.matrix_signature(vectors))
+
+
+def test_refresh_with_transposed_vectors_and_new_items():
+    vectors = random_vectors()
+    index = NeighborIndex.build(vectors, k=5)
+    extended = scipy.sparse.vstack([vectors, random_vectors(5, vectors.shape[1], density=0.3, seed=2)]).tocsr()
+
+    refreshed = index.refresh(extended, [], item_vectors_t=extended.T.tocsr())
+    assert set(range(vectors.shape[0], extended.shape[0])) <= set(refreshed)
+    assert_same_neighbors(index, NeighborIndex.build(extended, k=5))
+
+
+def test_signature_detects_content_changes():
+    vectors = random_vectors()
+    signature = NeighborIndex.matrix_signature(vectors)
+
+    # 形状和非零元个数不变，只改一个数值或交换两行
+    modified = vectors.copy()
+    modified.data[0] += 0.5
+    assert not np.array_equal(NeighborIndex.matrix_signature(modified), signature)
+    swapped = vectors[np.r_[1, 0, 2:vectors.shape[0]]]
+    assert not np.array_equal(NeighborIndex.matrix_signature(swapped), signature)
+
+    # 前n行的签名与只有这n行的矩阵相同
+    extended = scipy.sparse.vstack([vectors, random_vectors(5, vectors.shape[1], seed=2)]).tocsr()
+    np.testing.assert_array_equal(NeighborIndex.matrix_signature(extended[:vectors.shape[0]]), signature)
+
+
+def test_load_neighbor_index_appends_only_when_existing_rows_unchanged(tmp_path):
+    from make_recommend import load_neighbor_index
+
+    vectors = random_vectors()
+    path = str(tmp_path / 'neighbors.npz')
+    NeighborIndex.build(vectors, k=5).save(path)
+    extended = scipy.sparse.vstack([vectors, random_vectors(5, vectors.shape[1], density=0.3, seed=2)]).tocsr()
+    rebuilt = []
+
+    def build(item_vectors):
+        rebuilt.append(True)
+        return NeighborIndex.build(item_vectors, k=5)
+
+    # 只在末尾追加：增量计算新物品，不重建
+    index = load_neighbor_index(path, extended, lambda: build(extended))
+    assert not rebuilt
+    assert_same_neighbors(index, NeighborIndex.build(extended, k=5))
+    np.testing.assert_array_equal(NeighborIndex.load(path).signature, NeighborIndex.matrix_signature(extended))
+
+    # 已有物品的数值变化（形状和非零元个数不变）时重建
+    modified = extended.copy()
+    modified.data[0] += 0.5
+    modified = scipy.sparse.vstack([modified, random_vectors(3, vectors.shape[1], density=0.3, seed=3)]).tocsr()
+    index = load_neighbor_index(path, modified, lambda: build(modified))
+    assert rebuilt
+    assert_same_neighbors(index, NeighborIndex.build(modified, k=5))
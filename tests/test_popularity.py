@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import LabelEncoder
+
+from popularity import PopularityIndex
+
+
+@pytest.fixture
+def catalogue():
+    le_movie = LabelEncoder().fit(np.arange(10, 30))
+    # 最后两部电影没有元数据
+    movies = pd.DataFrame({'movieId': np.arange(10, 28), 'title': [f'm{i}' for i in range(18)]})
+    movie_ids = np.random.default_rng(0).integers(0, 20, 200)
+    return movie_ids, movies, le_movie
+
+
+def assert_consistent(index):
+    """order按评分次数降序，rank为其反向映射，前n_ranked个为有评分的电影"""
+    counts = index.counts[index.order]
+    assert np.all(np.diff(counts) <= 0)
+    np.testing.assert_array_equal(index.rank[index.order], np.arange(len(index.order)))
+    assert index.n_ranked == np.count_nonzero(counts)
+
+
+def test_increment_keeps_order(catalogue):
+    movie_ids, movies, le_movie = catalogue
+    index = PopularityIndex.from_ratings(movie_ids, movies, le_movie)
+    assert_consistent(index)
+    assert set(index.order) == set(range(18))
+
+    for movie in np.random.default_rng(1).integers(-1, 21, 300):
+        index.increment(int(movie))
+        assert_consistent(index)
+    page_movies, page_counts = index.page(0, 5)
+    np.testing.assert_array_equal(page_counts, np.sort(index.counts[:18])[::-1][:5])
+    np.testing.assert_array_equal(index.counts[page_movies], page_counts)
+
+
+def test_new_movie_enters_ranking(catalogue):
+    movie_ids, movies, le_movie = catalogue
+    index = PopularityIndex.from_ratings(movie_ids[movie_ids != 3], movies, le_movie)
+    n_ranked = len(index)
+    index.increment(3)
+    assert len(index) == n_ranked + 1
+    assert 3 in index.page(0, len(index))[0]
+    index.increment(19)  # 没有元数据的电影只记录次数
+    assert len(index) == n_ranked + 1 and index.counts[19] == np.count_nonzero(movie_ids == 19) + 1
+
+
+def test_rebuild_after_swap_matches_incremental_counts(catalogue):
+    # 推荐器替换后热度榜由 离线评分 + 数据库评分 重新计算，与增量维护的次数一致
+    movie_ids, movies, le_movie = catalogue
+    online = np.random.default_rng(2).integers(0, 20, 50)
+    incremental = PopularityIndex.from_ratings(movie_ids, movies, le_movie)
+    for movie in online:
+        incremental.increment(int(movie))
+
+    rebuilt = PopularityIndex.from_ratings(np.concatenate([movie_ids, online]), movies, le_movie)
+    assert_consistent(rebuilt)
+    np.testing.assert_array_equal(rebuilt.counts, incremental.counts)
+    assert len(rebuilt) == len(incremental)
+    np.testing.assert_array_equal(rebuilt.counts[rebuilt.order], incremental.counts[incremental.order])
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from ranking_metrics import mean_ranking_metrics, ranking_metrics
+
+
+def reference_metrics(users, scores, relevant, k):
+    """逐用户循环计算的参考实现（分数并列时保持原顺序）"""
+    result = {name: [] for name in ('users', 'precision', 'recall', 'ndcg', 'map')}
+    for user in np.unique(users):
+        mask = users == user
+        ranked = relevant[mask][np.argsort(-scores[mask], kind='stable')]
+        n_relevant = ranked.sum()
+        if n_relevant == 0:
+            continue
+        top = ranked[:k]
+        ideal = min(n_relevant, k)
+        result['users'].append(user)
+        result['precision'].append(top.sum() / min(mask.sum(), k))
+        result['recall'].append(top.sum() / n_relevant)
+        result['ndcg'].append(np.sum(top / np.log2(np.arange(len(top)) + 2)) / np.sum(1 / np.log2(np.arange(ideal) + 2)))
+        result['map'].append(np.sum(top * np.cumsum(top) / np.arange(1, len(top) + 1)) / ideal)
+    return {name: np.array(values) for name, values in result.items()}
+
+
+def test_hand_computed_example():
+    # 用户1：排序后相关性为 [1, 0, 1]；用户2没有相关电影，不参与评估
+    users = np.array([1, 1, 1, 2, 2])
+    scores = np.array([0.9, 0.1, 0.5, 0.3, 0.2])
+    relevant = np.array([1, 1, 0, 0, 0])
+    metrics = ranking_metrics(users, scores, relevant, k=2)
+    np.testing.assert_array_equal(metrics['users'], [1])
+    np.testing.assert_allclose(metrics['precision'], [0.5])
+    np.testing.assert_allclose(metrics['recall'], [0.5])
+    np.testing.assert_allclose(metrics['ndcg'], [1 / (1 + 1 / np.log2(3))])
+    np.testing.assert_allclose(metrics['map'], [0.5])
+
+
+@pytest.mark.parametrize('k', [1, 5, 10])
+def test_matches_reference_with_ties(k):
+    rng = np.random.default_rng(k)
+    users = rng.integers(0, 40, 600)
+    scores = rng.integers(0, 6, 600).astype(float)  # 大量并列分数
+    relevant = rng.random(600) < 0.3
+    metrics = ranking_metrics(users, scores, relevant, k)
+    expected = reference_metrics(users, scores, relevant.astype(float), k)
+    for name in expected:
+        np.testing.assert_allclose(metrics[name], expected[name])
+
+
+def test_mean_metrics_labels_and_empty_input():
+    users = np.array([1, 1, 2, 2])
+    scores = np.array([0.9, 0.1, 0.8, 0.2])
+    relevant = np.array([1, 0, 0, 1])
+    mean = mean_ranking_metrics(users, scores, relevant, k=1)
+    assert mean == pytest.approx({'Precision@1': 0.5, 'Recall@1': 0.5, 'NDCG@1': 0.5, 'MAP@1': 0.5})
+    assert mean_ranking_metrics(users, scores, np.zeros(4), k=1) == {
+        'Precision@1': 0.0, 'Recall@1': 0.0, 'NDCG@1': 0.0, 'MAP@1': 0.0
+    }
@@ -0,0 +1,37 @@
+from rec_cache import RecommendationCache
+
+
+def test_set_and_get():
+    cache = RecommendationCache(max_size=2)
+    generation = cache.generation(1)
+    assert cache.get(1) is None
+    assert cache.set(1, ['a'], generation)
+    assert cache.get(1) == ['a']
+    cache.set(2, ['b'])
+    cache.set(3, ['c'])
+    assert cache.get(1) is None  # 超出max_size时淘汰最久未使用的
+    assert cache.stats()['size'] == 2
+
+
+def test_invalidate_during_computation_discards_stale_result():
+    cache = RecommendationCache()
+    generation = cache.generation(1)
+    assert cache.get(1) is None
+    # 计算推荐期间用户提交了新评分
+    cache.invalidate(1)
+    assert not cache.set(1, ['stale'], generation)
+    assert cache.get(1) is None
+
+    # 重新取得版本号后可以写入；其他用户的失效不影响
+    generation = cache.generation(1)
+    cache.invalidate(2)
+    assert cache.set(1, ['fresh'], generation)
+    assert cache.get(1) == ['fresh']
+
+
+def test_clear_during_computation_discards_stale_result():
+    cache = RecommendationCache()
+    generation = cache.generation(1)
+    cache.clear()  # 模型替换
+    assert not cache.set(1, ['old model'], generation)
+    assert cache.get(1) is None
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from recommender_systems import RecommenderSystem
+from test_neighbor_index import assert_same_neighbors
+
+
+@pytest.fixture
+def recommender(synthetic_data):
+    full_data, tfidf_matrix, le_movie = synthetic_data
+    recommender = RecommenderSystem(full_data, tfidf_matrix, le_movie, n_workers=2)
+    recommender.fit_factor_model(method='svd')
+    recommender.build_item_neighbors()
+    recommender.build_content_neighbors()
+    yield recommender
+    if recommender._executor is not None:
+        recommender._executor.shutdown()
+
+
+def rated_movies(recommender, user_id):
+    row = recommender.user_item_matrix[user_id]
+    return dict(zip(row.indices.tolist(), row.data.tolist()))
+
+
+def test_incremental_updates_match_rebuild(recommender, synthetic_data):
+    full_data, tfidf_matrix, le_movie = synthetic_data
+    existing_user = int(full_data['userId'].iloc[0])
+    current = rated_movies(recommender, existing_user)
+    modified = next(iter(current))
+    unrated = [movie for movie in range(len(le_movie.classes_)) if movie not in current][:3]
+    new_user = recommender.user_item_matrix.shape[0] + 2
+    updates = {
+        existing_user: {modified: 5.0 if current[modified] != 5.0 else 1.0, unrated[0]: 4.5, unrated[1]: 2.0},
+        new_user: {unrated[1]: 3.0, unrated[2]: 4.0, modified: 0.5},
+    }
+
+    recommender.popular_movies(10)
+    for user_id, ratings in updates.items():
+        recommender.update_user_ratings(user_id, ratings)
+    assert recommender._popular_movies is None  # 新增评分后热门电影重新计算
+    assert len(recommender.refresh_pending_item_neighbors()) > 0
+    assert recommender._pending_neighbor_items == []
+
+    online = pd.DataFrame(
+        [(user_id, movie, rating) for user_id, ratings in updates.items() for movie, rating in ratings.items()],
+        columns=['userId', 'movieId', 'rating']
+    )
+    rebuilt = RecommenderSystem(
+        pd.concat([full_data[['userId', 'movieId', 'rating']], online], ignore_index=True),
+        tfidf_matrix, le_movie
+    )
+    assert (recommender.user_item_matrix != rebuilt.user_item_matrix).nnz == 0
+    assert (recommender.item_user_matrix != rebuilt.item_user_matrix).nnz == 0
+    np.testing.assert_array_equal(recommender.user_mask, rebuilt.user_mask)
+    np.testing.assert_array_equal(recommender.item_mask, rebuilt.item_mask)
+    np.testing.assert_allclose(recommender._get_user_norms(), rebuilt._get_user_norms())
+    np.testing.assert_array_equal(recommender.popular_movies(20), rebuilt.popular_movies(20))
+    assert_same_neighbors(recommender.item_neighbors, rebuilt.build_item_neighbors())
+    assert recommender.user_based_cf(existing_user, 10) == rebuilt.user_based_cf(existing_user, 10)
+
+
+def test_unchanged_ratings_are_ignored(recommender, synthetic_data):
+    user_id = int(synthetic_data[0]['userId'].iloc[0])
+    changed = recommender.update_user_ratings(user_id, rated_movies(recommender, user_id))
+    assert len(changed) == 0
+    assert recommender._pending_neighbor_items == []
+
+
+def test_content_based_excludes_all_rated_movies(recommender, synthetic_data):
+    users = np.unique(synthetic_data[0]['userId'].to_numpy())[:50]
+    batch = recommender.recommend_batch(users, 10, method='content_based')
+    for user_id in users:
+        single = recommender.content_based(int(user_id), 10)
+        rated = set(rated_movies(recommender, int(user_id)))
+        assert not rated & {movie for movie, _ in single}
+        assert [movie for movie, _ in single] == [movie for movie, _ in batch[int(user_id)]]
+        np.testing.assert_allclose([score for _, score in single], [score for _, score in batch[int(user_id)]])
+
+
+@pytest.mark.parametrize('factor_index', [False, True])
+def test_hybrid_batch_matches_single_user(recommender, synthetic_data, factor_index):
+    if factor_index:
+        recommender.build_factor_index(n_lists=8, n_probe=2)
+    users = np.unique(synthetic_data[0]['userId'].to_numpy())[:80]
+    weights = [0.25, 0.25, 0.25, 0.25]
+    batch = recommender.recommend_batch(users, 10, weights=weights, block_size=32)
+    for user_id in users:
+        single = recommender.hybrid_recommender(int(user_id), 10, weights=weights)
+        assert [movie for movie, _ in single] == [movie for movie, _ in batch[int(user_id)]]
+        np.testing.assert_allclose([score for _, score in single], [score for _, score in batch[int(user_id)]])
+
+
+@pytest.mark.parametrize('user_block_size', [37, 4096])
+def test_user_cf_batch_matches_single_user(recommender, synthetic_data, user_block_size):
+    users = np.unique(synthetic_data[0]['userId'].to_numpy())[:64]
+    movies, scores = recommender._user_cf_batch(users, 10, user_block_size=user_block_size)
+    for row, user_id in enumerate(users):
+        single = recommender.user_based_cf(int(user_id), 10)
+        valid = movies[row] >= 0
+        assert [movie for movie, _ in single] == movies[row][valid].tolist()
+        np.testing.assert_allclose([score for _, score in single], scores[row][valid])
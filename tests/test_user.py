@@ -0,0 +1,78 @@
+import sqlite3
+
+import pytest
+from flask import Flask
+
+from user import db, Rating, UPSERT_CHUNK_SIZE, ensure_rating_index, upsert_ratings
+
+# 加唯一索引之前的评分表结构
+LEGACY_RATING_TABLE = '''
+CREATE TABLE rating (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    movie_id INTEGER NOT NULL,
+    rating FLOAT NOT NULL,
+    rated_at DATETIME
+)
+'''
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    return app
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """旧版本创建的数据库：评分表没有 (user_id, movie_id) 唯一索引，且有重复评分"""
+    path = tmp_path / 'user_ratings.db'
+    with sqlite3.connect(path) as connection:
+        connection.execute(LEGACY_RATING_TABLE)
+        connection.executemany(
+            'INSERT INTO rating (user_id, movie_id, rating) VALUES (?, ?, ?)',
+            [(1, 10, 3.0), (1, 10, 4.0), (1, 11, 2.0), (2, 10, 5.0)]
+        )
+    return path
+
+
+def ratings_of(user_id):
+    return {r.movie_id: r.rating for r in Rating.query.filter_by(user_id=user_id)}
+
+
+def test_ensure_rating_index_deduplicates_legacy_db(legacy_db):
+    app = make_app(legacy_db)
+    with app.app_context():
+        db.create_all()
+        ensure_rating_index()
+        assert ratings_of(1) == {10: 4.0, 11: 2.0}  # 重复评分只保留最新一条
+        assert Rating.query.count() == 3
+        ensure_rating_index()  # 索引已存在时什么都不做
+        assert Rating.query.count() == 3
+
+
+def test_upsert_on_legacy_db(legacy_db):
+    app = make_app(legacy_db)
+    with app.app_context():
+        db.create_all()
+        ensure_rating_index()
+        new_movies = upsert_ratings(1, {10: 5.0, 12: 3.5})
+        assert new_movies == [12]
+        assert ratings_of(1) == {10: 5.0, 11: 2.0, 12: 3.5}
+        assert ratings_of(2) == {10: 5.0}
+
+
+def test_upsert_across_chunks(tmp_path):
+    app = make_app(tmp_path / 'user_ratings.db')
+    with app.app_context():
+        db.create_all()
+        ensure_rating_index()
+        ratings = {movie_id: 3.0 for movie_id in range(UPSERT_CHUNK_SIZE * 2 + 1)}
+        assert upsert_ratings(1, ratings) == list(ratings)
+
+        ratings.update({0: 5.0, UPSERT_CHUNK_SIZE * 3: 1.0})
+        assert upsert_ratings(1, ratings) == [UPSERT_CHUNK_SIZE * 3]
+        stored = ratings_of(1)
+        assert stored == ratings
+        assert Rating.query.count() == len(ratings)
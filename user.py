@@ -1,9 +1,29 @@
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import event, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
 
 db = SQLAlchemy()
 
+# 单条SQL语句的绑定参数上限（SQLite 3.32之前的默认值），每行评分占4个参数
+SQLITE_MAX_VARIABLES = 999
+UPSERT_CHUNK_SIZE = SQLITE_MAX_VARIABLES // 4
+
+
+# SQLite连接设置：WAL模式下读不阻塞写，写入只追加到WAL文件；数据库被锁时等待而不是立即报错
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.close()
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
@@ -12,8 +32,64 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Rating(db.Model):
+    # 每个用户对每部电影只有一条评分，按 (user_id, movie_id) 查找和upsert
+    __table_args__ = (db.Index('ix_rating_user_movie', 'user_id', 'movie_id', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     movie_id = db.Column(db.Integer, nullable=False)  # 原始电影ID（与movies.csv一致）
     rating = db.Column(db.Float, nullable=False)  # 1-5分
-    rated_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    rated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def ensure_rating_index():
+    """为已有的数据库补建 (user_id, movie_id) 唯一索引（create_all不会修改已存在的表），重复的评分只保留最新一条
+
+    应用启动时调用，索引已存在时直接返回
+    """
+    exists = db.session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ix_rating_user_movie'"
+    )).first()
+    if exists:
+        return
+    db.session.execute(text(
+        'DELETE FROM rating WHERE id NOT IN (SELECT MAX(id) FROM rating GROUP BY user_id, movie_id)'
+    ))
+    db.session.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_rating_user_movie ON rating (user_id, movie_id)'
+    ))
+    db.session.commit()
+
+
+def upsert_ratings(user_id, ratings):
+    """在一个事务中写入一个用户的多条评分（{原始movieId: 评分}），已有评分则更新
+
+    返回此前没有评分的电影（新增评分）。先插入（冲突时跳过，RETURNING返回实际插入的行），再更新其余已有的评分：
+    第一条语句就取得写锁，新增/更新的判断与写入在同一个事务中，不会与其他请求的写入交错（RETURNING需要SQLite 3.35+）
+    """
+    movie_ids = list(ratings)
+    now = datetime.utcnow()
+    new_movies = []
+    for start in range(0, len(movie_ids), UPSERT_CHUNK_SIZE):
+        chunk = movie_ids[start:start + UPSERT_CHUNK_SIZE]
+        statement = sqlite_insert(Rating).values([
+            {'user_id': user_id, 'movie_id': movie_id, 'rating': ratings[movie_id], 'rated_at': now}
+            for movie_id in chunk
+        ])
+        inserted = set(db.session.execute(
+            statement.on_conflict_do_nothing(index_elements=['user_id', 'movie_id']).returning(Rating.movie_id)
+        ).scalars())
+        new_movies.extend(movie_id for movie_id in chunk if movie_id in inserted)
+
+        existing = [movie_id for movie_id in chunk if movie_id not in inserted]
+        if existing:
+            statement = sqlite_insert(Rating).values([
+                {'user_id': user_id, 'movie_id': movie_id, 'rating': ratings[movie_id], 'rated_at': now}
+                for movie_id in existing
+            ])
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=['user_id', 'movie_id'],
+                set_={'rating': statement.excluded.rating, 'rated_at': statement.excluded.rated_at}
+            ))
+    db.session.commit()
+    return new_movies